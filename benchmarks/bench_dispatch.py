@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""compare command dispatch throughput of the prefix index in Bot.handle
+against the linear scan it replaced, at different numbers of commands
+
+usage: python benchmarks/bench_dispatch.py [messages per run]"""
+import re
+import sys
+import time
+import random
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pbnj.bot import Bot
+from pbnj.models import Message
+
+SIZES = [10, 100, 1000]
+
+
+class NullConnection:
+    """swallows replies so we only measure dispatch"""
+
+    def message(self, dest, text):
+        return True
+
+
+def reply(message):
+    return "ok"
+
+
+def linear_handle(bot, message):
+    """the dispatch loop as it was: every command, uncompiled regex"""
+    for command in bot.commands:
+        if callable(command.filterspec):
+            matched = command.filterspec(message)
+        elif message.type == "PRIVMSG":
+            matched = re.match(command.filterspec, message.message)
+        else:
+            matched = None
+        if matched:
+            return command(message)
+    return False
+
+
+def make_bot(size):
+    bot = Bot("bench", use_builtin=False)
+    bot.conn = NullConnection()
+    for i in range(size):
+        bot.command("^\\.command{}\\b".format(i))(reply)
+    # a couple of callables, like tallybot's ++/-- recognizer
+    bot.command(lambda m: m.type == "PRIVMSG" and "++" in m.message)(reply)
+    return bot
+
+
+def make_messages(size, count):
+    lines = []
+    for i in range(count):
+        if i % 4 == 0:
+            text = "just chatting, nothing to see here"
+        elif i % 4 == 1:
+            text = ".nosuchcommand"
+        else:
+            text = ".command{} some args".format(random.randrange(size))
+        lines.append(":nick!~user@host PRIVMSG #channel :" + text)
+    lines.append(":irc.example.net 366 foo #channel :End of NAMES list")
+    return [Message(line) for line in lines]
+
+
+def measure(handle, bot, messages):
+    start = time.perf_counter()
+    for message in messages:
+        handle(bot, message)
+    return len(messages) / (time.perf_counter() - start)
+
+
+def main(count):
+    random.seed(0)
+    print("{:>8} {:>14} {:>14} {:>8}".format("commands", "linear msg/s", "index msg/s", "speedup"))
+    for size in SIZES:
+        bot = make_bot(size)
+        messages = make_messages(size, count)
+        linear = measure(linear_handle, bot, messages)
+        indexed = measure(Bot.handle, bot, messages)
+        print(
+            "{:>8} {:>14,.0f} {:>14,.0f} {:>7.1f}x".format(
+                size, linear, indexed, indexed / linear
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""feed the test logs, replicated to a few megabytes, through the line framing
+of Connection._recv and the byte concatenation it replaced
+
+usage: python benchmarks/bench_framing.py [megabytes]"""
+import sys
+import time
+
+from corpus import log_lines, replicate
+from pbnj.connection import LineBuffer
+
+CHUNK_SIZES = [512, 4096, 65536, 1024 * 1024]
+
+
+def concatenating(wire, chunk):
+    """the old loop: grow a bytes object, split one line off at a time"""
+    read = b""
+    lines = 0
+    for offset in range(0, len(wire), chunk):
+        read += wire[offset : offset + chunk]
+        while b"\r\n" in read:
+            line, read = read.split(b"\r\n", 1)
+            lines += 1
+    return lines
+
+
+def framing(wire, chunk):
+    framer = LineBuffer()
+    lines = 0
+    for offset in range(0, len(wire), chunk):
+        lines += len(framer.feed(wire[offset : offset + chunk]))
+    return lines
+
+
+def measure(function, wire, chunk):
+    start = time.perf_counter()
+    lines = function(wire, chunk)
+    return lines, time.perf_counter() - start
+
+
+def main(megabytes):
+    wire = replicate(log_lines(), megabytes)
+    size = len(wire) / 1024 / 1024
+    print("{:.1f} MB, {:,} lines".format(size, wire.count(b"\r\n")))
+    print("{:>10} {:>12} {:>12} {:>8}".format("recv size", "old MB/s", "new MB/s", "speedup"))
+    for chunk in CHUNK_SIZES:
+        old_lines, old = measure(concatenating, wire, chunk)
+        new_lines, new = measure(framing, wire, chunk)
+        assert old_lines == new_lines
+        print(
+            "{:>10} {:>12.1f} {:>12.1f} {:>7.1f}x".format(
+                chunk, size / old, size / new, old / new
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 4)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""how an echo bot keeps up with a crowd: a pbnj.testing.Server on localhost
+with users taking turns to talk to the bot at a steady rate, reporting how
+long replies take to come back and how many never do, at a few rates
+
+usage: python benchmarks/bench_load.py [-u USERS] [-r RATE ...] [-d SECONDS]"""
+import logging
+import argparse
+
+import corpus
+from pbnj.bot import Bot
+from pbnj.testing import load_test
+
+
+def echo_bot():
+    bot = Bot("echo", use_builtin=False)
+    bot.command("^\\.echo")(lambda m: m.message)
+    return bot
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    p.add_argument("-u", "--users", type=int, default=50)
+    p.add_argument("-r", "--rate", type=float, nargs="+", default=[100, 500, 2000])
+    p.add_argument("-d", "--duration", type=float, default=3.0)
+    p.add_argument("-l", "--latency", type=float, default=0.0)
+    p.add_argument("-f", "--flood-lines", type=int, help="lines a second to kick at")
+    args = p.parse_args()
+    logging.getLogger("pbnj").setLevel(logging.ERROR)
+    print(
+        "{} users for {:.0f}s, {:.1f}ms latency".format(
+            args.users, args.duration, args.latency * 1000
+        )
+    )
+    print(
+        "{:>8} {:>8} {:>8} {:>8} {:>10} {:>10} {:>10}".format(
+            "rate", "sent", "dropped", "kicked", "p50 ms", "p99 ms", "max ms"
+        )
+    )
+    for rate in args.rate:
+        report = load_test(
+            echo_bot(),
+            users=args.users,
+            rate=rate,
+            duration=args.duration,
+            latency=args.latency,
+            flood_lines=args.flood_lines,
+        )
+        ms = [
+            "-" if report[q] is None else "{:.1f}".format(report[q] * 1000)
+            for q in ("p50", "p99", "max")
+        ]
+        print(
+            "{:>8,.0f} {:>8,} {:>8,} {:>8,} {:>10} {:>10} {:>10}".format(
+                report["rate"],
+                report["sent"],
+                report["dropped"],
+                report["server"]["flood_kicks"],
+                *ms
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""per-message cost of the logging in the receive and dispatch path at
+WARNING, INFO and DEBUG, with the ColorFormatter writing to /dev/null
+
+usage: python benchmarks/bench_logging.py [messages]"""
+import os
+import sys
+import time
+import logging
+
+from corpus import log_lines
+from bench_dispatch import make_bot, make_messages
+from pbnj.logger import ColorFormatter
+from pbnj.models import Message
+
+LEVELS = [logging.WARNING, logging.INFO, logging.DEBUG]
+
+
+def main(count):
+    log = logging.getLogger("pbnj")
+    handler = logging.StreamHandler(open(os.devnull, "w"))
+    handler.setFormatter(ColorFormatter())
+    log.addHandler(handler)
+    bot = make_bot(100)
+    messages = make_messages(100, count) + [Message(l) for l in log_lines()]
+    print("{} messages through Bot.handle with 100 commands".format(len(messages)))
+    print("{:<8} {:>14}".format("level", "usec/message"))
+    for level in LEVELS:
+        log.setLevel(level)
+        start = time.perf_counter()
+        for message in messages:
+            bot.handle(message)
+        elapsed = time.perf_counter() - start
+        print(
+            "{:<8} {:>14.2f}".format(
+                logging.getLevelName(level), elapsed / len(messages) * 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""memory, construction time and comparison time of Message, against the
+__dict__ based Message it replaced
+
+usage: python benchmarks/bench_message.py [messages]"""
+import sys
+import time
+import tracemalloc
+
+from corpus import synthetic
+from pbnj.models import Message, parse_line
+
+attr_filter = lambda x: {
+    a: getattr(x, a)
+    for a in dir(x)
+    if not a.startswith("_") and not callable(getattr(x, a))
+}
+
+
+class DictMessage:
+    """Message as it was before __slots__: eager fields, dir() based __eq__"""
+
+    def __init__(self, raw_msg):
+        self.raw_msg = raw_msg
+        self._tags, prefix, command, self.params = parse_line(raw_msg)
+        self.prefix = prefix
+        self.message = None
+        if prefix is not None and ("!" in prefix or "@" in prefix):
+            rest, _, host = prefix.partition("@")
+            nick, _, user = rest.partition("!")
+            self.nick = nick
+            self.realname = user[1:] if user.startswith("~") else user or None
+            self.host = host or None
+        else:
+            self.nick = self.realname = None
+            self.host = prefix
+        if command.isdigit():
+            self.type = int(command)
+            return
+        self.type = command
+        if command == "PRIVMSG":
+            self.dest = self.params[0]
+            self.reply_dest = self.dest if "#" in self.dest else self.nick
+            msg = self.params[1] if len(self.params) > 1 else ""
+            self.message = msg
+            self.args = msg.split()[1:]
+
+    def __eq__(self, other):
+        for item, val in attr_filter(self).items():
+            if val != getattr(other, item, False):
+                return False
+        return True
+
+
+def construct(cls, lines):
+    tracemalloc.start()
+    start = time.perf_counter()
+    messages = [cls(line) for line in lines]
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return messages, elapsed, size
+
+
+def compare(messages):
+    start = time.perf_counter()
+    for a, b in zip(messages, messages[1:]):
+        a == b
+    return time.perf_counter() - start
+
+
+def main(count):
+    lines = synthetic(count)
+    print("{:,} messages".format(count))
+    print(
+        "{:<14} {:>12} {:>14} {:>14}".format(
+            "", "bytes/msg", "construct/sec", "compare/sec"
+        )
+    )
+    for name, cls in [("dict", DictMessage), ("slots", Message)]:
+        messages, elapsed, size = construct(cls, lines)
+        compared = compare(messages[:100000])
+        print(
+            "{:<14} {:>12,.0f} {:>14,.0f} {:>14,.0f}".format(
+                name,
+                size / count,
+                count / elapsed,
+                min(count, 100000) / compared,
+            )
+        )
+        del messages
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""messages/sec of the Message parser against the regex based one it
+replaced, over the test logs and a large synthetic log
+
+usage: python benchmarks/bench_parse.py [synthetic lines]"""
+import re
+import sys
+import time
+
+from corpus import log_lines, synthetic
+from pbnj.models import Message
+
+
+class RegexMessage:
+    """Message.parse as it was before the hand written parser"""
+
+    def __init__(self, raw_msg):
+        self.raw_msg = raw_msg
+        self.message = None
+        self.nick = None
+        self.realname = None
+        self.host = None
+        sp = self.raw_msg.split()
+        host = sp[0]
+        if "@" in host:
+            hostmask = host[1:] if host.startswith(":") else host
+            groups = re.match(
+                r"^([a-zA-Z0-9_\-\|`\[\]]+)!~?([a-zA-Z0-9\ _]+)@(.*)", hostmask
+            ).groups()
+            self.nick, self.realname, self.host = groups
+            self.type = sp[1]
+        else:
+            self.host = host
+            code = sp[1]
+            self.type = int(code) if code.isdigit() else code
+        if self.type == "PRIVMSG":
+            self.dest = sp[2]
+            self.reply_dest = self.dest if "#" in self.dest else self.nick
+            m = " ".join(sp[3:])
+            msg = m[1:] if m.startswith(":") else m
+            if msg.startswith("ACTION"):
+                self.type = "ACTION"
+                msg = msg[7:]
+            self.message = msg
+            self.args = msg.split()[1:]
+
+
+def measure(parser, lines):
+    start = time.perf_counter()
+    for line in lines:
+        parser(line)
+    return len(lines) / (time.perf_counter() - start)
+
+
+def report(name, lines):
+    old = measure(RegexMessage, lines)
+    new = measure(Message, lines)
+    print("{:<24} {:>12,.0f} {:>12,.0f} {:>7.1f}x".format(name, old, new, new / old))
+
+
+def main(count):
+    print("{:<24} {:>12} {:>12} {:>8}".format("corpus", "regex msg/s", "new msg/s", "speedup"))
+    # the regex parser can't cope with lines that have no prefix
+    logs = [l for l in log_lines() if l.startswith(":")] * 2000
+    report("tests/logs x2000", logs)
+    report("synthetic {:,}".format(count), synthetic(count))
+    tagged = [
+        "@time=2018-01-01T00:00:00.000Z;account=u{0};msgid=abc{0} ".format(i) + line
+        for i, line in enumerate(synthetic(count // 10))
+    ]
+    print(
+        "{:<24} {:>12} {:>12,.0f}".format(
+            "IRCv3 tagged", "n/a", measure(Message, tagged)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
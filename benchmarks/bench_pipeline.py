@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""replay IRC traffic through the whole bot: Connection framing, Message
+parsing and Bot.handle dispatch, with a socket stand-in that hands data out
+in recv sized chunks. Reports messages/sec, dispatch latency percentiles and
+peak RSS, and can save results to compare a later run (or version) against
+
+usage: python benchmarks/bench_pipeline.py [-m MB] [--save FILE] [--compare FILE]"""
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+
+from corpus import log_lines, replicate, synthetic, ChunkingSocket
+from pbnj.bot import Bot
+from pbnj.connection import Connection
+
+
+def make_bot():
+    """a bot with the builtins and a typical handful of commands"""
+    bot = Bot("foo", use_builtin=True)
+
+    @bot.command("^\\.weather [0-9]{5}")
+    def weather(message):
+        return "{}: 72 degrees".format(message.nick)
+
+    @bot.command("^\\.votes")
+    def votes(message):
+        for topic in ("a", "b", "c"):
+            yield "{}: 1 vote".format(topic)
+
+    @bot.command(lambda m: m.type == "PRIVMSG" and "++" in m.message)
+    def increment(message):
+        return "noted"
+
+    for i in range(50):
+        bot.command("^\\.command{}\\b".format(i))(weather)
+    return bot
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def replay(wire, recv_bufsz):
+    """run a bot over the wire data, return its measurements"""
+    bot = make_bot()
+    conn = Connection("127.0.0.1", 6667, recv_bufsz=recv_bufsz)
+    conn.conn.close()
+    conn.conn = ChunkingSocket(wire)
+    bot.conn = conn
+    latencies = []
+    handle = bot.handle
+    clock = time.perf_counter
+
+    def timed_handle(message):
+        start = clock()
+        result = handle(message)
+        latencies.append(clock() - start)
+        return result
+
+    bot.handle = timed_handle
+    start = clock()
+    bot.run()
+    elapsed = clock() - start
+    latencies.sort()
+    lines = wire.count(b"\r\n")
+    return {
+        "lines": lines,
+        "dispatched": len(latencies),
+        "messages_per_sec": lines / elapsed,
+        "p50_usec": percentile(latencies, 0.50) * 1e6,
+        "p99_usec": percentile(latencies, 0.99) * 1e6,
+        "bytes_sent": conn.conn.bytes_sent,
+    }
+
+
+def corpora(megabytes):
+    recorded = replicate(log_lines(), megabytes)
+    lines = synthetic(20000)
+    chatter = replicate(lines + [":u!~u@h PRIVMSG #c :.votes"] * 50, megabytes)
+    return {"recorded": recorded, "synthetic": chatter}
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    p.add_argument("-m", "--megabytes", type=float, default=8)
+    p.add_argument("--recv-bufsz", type=int, default=4096)
+    p.add_argument("--save", help="write the results to this JSON file")
+    p.add_argument("--compare", help="compare against results saved earlier")
+    p.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.10,
+        help="slowdown (as a fraction) to report as a regression",
+    )
+    args = p.parse_args()
+    # the bot saying goodbye at the end of each replay isn't interesting
+    logging.getLogger("pbnj").setLevel(logging.ERROR)
+    results = {}
+    for name, wire in corpora(args.megabytes).items():
+        results[name] = replay(wire, args.recv_bufsz)
+    results["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        "{:<10} {:>10} {:>11} {:>12} {:>10} {:>10}".format(
+            "corpus", "lines", "dispatched", "msg/s", "p50 us", "p99 us"
+        )
+    )
+    for name, r in results.items():
+        if isinstance(r, dict):
+            print(
+                "{:<10} {:>10,} {:>11,} {:>12,.0f} {:>10.1f} {:>10.1f}".format(
+                    name,
+                    r["lines"],
+                    r["dispatched"],
+                    r["messages_per_sec"],
+                    r["p50_usec"],
+                    r["p99_usec"],
+                )
+            )
+    print("peak RSS {:,} KB".format(results["peak_rss_kb"]))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = False
+        for name, r in results.items():
+            if not isinstance(r, dict) or name not in baseline:
+                continue
+            before = baseline[name]["messages_per_sec"]
+            change = r["messages_per_sec"] / before - 1
+            print("{:<10} {:+.1%} messages/sec vs baseline".format(name, change))
+            regressed = regressed or change < -args.tolerance
+        if regressed:
+            print("Throughput regressed by more than {:.0%}".format(args.tolerance))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""CPU time spent by a bot on a busy channel where a lot of the traffic is
+from ignored bots (a relay, a feed) or numerics nobody looks at, with and
+without the byte level prefilter that drops those lines before decoding
+
+usage: python benchmarks/bench_prefilter.py [-m MB]"""
+import time
+import random
+import logging
+import argparse
+
+from corpus import replicate, synthetic, ChunkingSocket
+from pbnj.bot import Bot
+from pbnj.connection import Connection
+
+IGNORED = ["relaybot", "feedbot"]
+
+
+def busy_channel(count):
+    """synthetic chatter, with ignored bots saying a third of it and a
+    sprinkling of WHO/MOTD style numerics and PINGs"""
+    random.seed(2)
+    lines = []
+    for line in synthetic(count):
+        roll = random.random()
+        if roll < 0.33:
+            nick = random.choice(IGNORED)
+            lines.append(
+                ":{0}!~{0}@bots.example.com PRIVMSG #channel :<user{1}> {2}".format(
+                    nick, random.randrange(500), line[-60:]
+                )
+            )
+        elif roll < 0.43:
+            lines.append(
+                ":irc.example.net 352 foo #channel ~u host{0} irc.example.net "
+                "user{0} H :0 Someone".format(random.randrange(5000))
+            )
+        elif roll < 0.44:
+            lines.append("PING :irc.example.net")
+        lines.append(line)
+    return lines
+
+
+def make_bot(prefilter):
+    bot = Bot("foo", ignore={"nicks": IGNORED})
+
+    @bot.command("^\\.weather [0-9]{5}")
+    def weather(message):
+        return "{}: 72 degrees".format(message.nick)
+
+    if not prefilter:
+        bot._prefilter = lambda: None
+    return bot
+
+
+def replay(wire, prefilter):
+    bot = make_bot(prefilter)
+    conn = Connection("127.0.0.1", 6667)
+    conn.conn.close()
+    conn.conn = ChunkingSocket(wire)
+    bot.conn = conn
+    start = time.process_time()
+    bot.run()
+    cpu = time.process_time() - start
+    dropped = conn.prefilter.dropped if conn.prefilter is not None else 0
+    return cpu, dropped
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    p.add_argument("-m", "--megabytes", type=float, default=16)
+    p.add_argument("-r", "--repeat", type=int, default=3)
+    args = p.parse_args()
+    logging.getLogger("pbnj").setLevel(logging.ERROR)
+    wire = replicate(busy_channel(20000), args.megabytes)
+    lines = wire.count(b"\r\n")
+    print("{:,} lines, {:.0f} MB".format(lines, len(wire) / 1024 / 1024))
+    print("{:<12} {:>10} {:>12} {:>10}".format("", "CPU s", "lines/s", "dropped"))
+    results = {}
+    for name, enabled in [("no filter", False), ("prefilter", True)]:
+        # best of a few runs, the rest is noise
+        runs = [replay(wire, enabled) for _ in range(args.repeat)]
+        cpu, dropped = min(runs)
+        results[name] = cpu
+        print(
+            "{:<12} {:>10.2f} {:>12,.0f} {:>10,}".format(
+                name, cpu, lines / cpu, dropped
+            )
+        )
+    saved = 1 - results["prefilter"] / results["no filter"]
+    print("prefilter saves {:.0%} of the CPU time".format(saved))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""how quickly a short-lived bot gets going: the import time of pbnj.bot as
+reported by python -X importtime, and the wall time from starting a fresh
+interpreter until the bot has sent USER to a server. Both are the median of
+several runs, with the time an empty interpreter takes to start shown apart
+
+usage: python benchmarks/bench_startup.py [-r RUNS] [--save FILE] [--compare FILE]"""
+import os
+import sys
+import json
+import socket
+import argparse
+import statistics
+import subprocess
+import threading
+import time
+
+import corpus
+
+ROOT = os.path.abspath(os.path.join(corpus.HERE, ".."))
+ENV = dict(os.environ, PYTHONPATH=ROOT)
+
+BOT = """
+import sys
+import logging
+from pbnj.bot import Bot
+logging.getLogger("pbnj").setLevel(logging.ERROR)
+bot = Bot("startup")
+bot.connect("127.0.0.1", int(sys.argv[1]))
+bot.run()
+"""
+
+
+def import_times():
+    """{module: (self us, cumulative us)} for one import of pbnj.bot"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import pbnj.bot"],
+        env=ENV,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        if own.strip().isdigit():
+            times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def until_registered(code):
+    """seconds from starting an interpreter running code until a server on
+    localhost sees USER from it (or the interpreter exits, for code that
+    never connects)"""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    port = listener.getsockname()[1]
+    registered = []
+
+    def serve():
+        client, _ = listener.accept()
+        buf = b""
+        while b"USER " not in buf:
+            data = client.recv(4096)
+            if not data:
+                break
+            buf += data
+        registered.append(time.perf_counter())
+        client.sendall(b"ERROR :Closing link (benchmark over)\r\n")
+        while client.recv(4096):
+            pass
+        client.close()
+
+    server = threading.Thread(target=serve, daemon=True)
+    server.start()
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code, str(port)], env=ENV, check=True)
+    finished = time.perf_counter()
+    listener.close()
+    return (registered[0] if registered else finished) - start
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    p.add_argument("-r", "--runs", type=int, default=15)
+    p.add_argument("--save", help="write the results to this JSON file")
+    p.add_argument("--compare", help="compare against results saved earlier")
+    p.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.20,
+        help="slowdown (as a fraction) to report as a regression",
+    )
+    args = p.parse_args()
+    runs = [import_times() for _ in range(args.runs)]
+    import_us = statistics.median(r["pbnj.bot"][1] for r in runs)
+    empty = statistics.median(until_registered("pass") for _ in range(args.runs))
+    registered = statistics.median(until_registered(BOT) for _ in range(args.runs))
+    results = {
+        "import_ms": import_us / 1000,
+        "interpreter_ms": empty * 1000,
+        "registered_ms": registered * 1000,
+    }
+    print("import pbnj.bot     {:>8.1f} ms".format(results["import_ms"]))
+    print("empty interpreter   {:>8.1f} ms".format(results["interpreter_ms"]))
+    print("start to USER       {:>8.1f} ms".format(results["registered_ms"]))
+    print("\nslowest modules to import (self time, last run):")
+    heaviest = sorted(runs[-1].items(), key=lambda i: i[1][0], reverse=True)
+    for name, (own, _) in heaviest[:8]:
+        print("  {:<28} {:>8.1f} ms".format(name, own / 1000))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = False
+        for key in ("import_ms", "registered_ms"):
+            change = results[key] / baseline[key] - 1
+            print("{:<14} {:+.1%} vs baseline".format(key, change))
+            regressed = regressed or change > args.tolerance
+        if regressed:
+            print("Startup regressed by more than {:.0%}".format(args.tolerance))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""memory and update speed of pbnj.state.State tracking a large network: the
+bot in thousands of channels shared with 100k users, then a stream of JOINs,
+PARTs, QUITs and NICKs
+
+usage: python benchmarks/bench_state.py [users] [channels]"""
+import sys
+import time
+import random
+import tracemalloc
+
+import corpus  # puts the checkout on sys.path
+from pbnj.models import Message
+from pbnj.state import State
+
+NICK = "pbnj"
+
+
+def burst(users, channels, per_user=3):
+    """the JOIN and NAMES lines the server sends as the bot joins every channel,
+    each user being in per_user random channels"""
+    random.seed(0)
+    members = [[NICK] for _ in range(channels)]
+    for u in range(users):
+        for c in random.sample(range(channels), per_user):
+            nick = "user{}".format(u)
+            members[c].append("@" + nick if u % 50 == 0 else nick)
+    lines = []
+    for c, names in enumerate(members):
+        chan = "#chan{}".format(c)
+        lines.append(":{0}!~{0}@bot.host JOIN {1}".format(NICK, chan))
+        # servers split NAMES replies into lines of a few hundred bytes
+        for i in range(0, len(names), 40):
+            lines.append(
+                ":irc.example.net 353 {} = {} :{}".format(
+                    NICK, chan, " ".join(names[i : i + 40])
+                )
+            )
+        lines.append(":irc.example.net 366 {} {} :End of NAMES list".format(NICK, chan))
+    return lines
+
+
+def churn(users, channels, count):
+    random.seed(1)
+    templates = [
+        ":user{u}!~u@host{u}.example.com JOIN #chan{c}",
+        ":user{u}!~u@host{u}.example.com PART #chan{c} :bye",
+        ":user{u}!~u@host{u}.example.com QUIT :Ping timeout",
+        ":user{u}!~u@host{u}.example.com NICK user{u}_",
+        ":user{u}_!~u@host{u}.example.com NICK user{u}",
+    ]
+    return [
+        random.choice(templates).format(
+            u=random.randrange(users), c=random.randrange(channels)
+        )
+        for _ in range(count)
+    ]
+
+
+def main(users, channels):
+    messages = [Message(line) for line in burst(users, channels)]
+    state = State(NICK)
+    start = time.perf_counter()
+    for message in messages:
+        state.update(message)
+    elapsed = time.perf_counter() - start
+    # and again on a fresh State to see how much memory it holds on to
+    tracemalloc.start()
+    state = State(NICK)
+    for message in messages:
+        state.update(message)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    memberships = sum(len(c.members) for c in state.channels.values())
+    print(
+        "{:,} users, {:,} channels, {:,} memberships".format(
+            len(state.users), len(state.channels), memberships
+        )
+    )
+    print("NAMES burst: {:,.0f} lines/sec".format(len(messages) / elapsed))
+    print(
+        "memory: {:,.1f} MB, {:,.0f} bytes/user, {:,.0f} bytes/membership".format(
+            size / 1024 / 1024, size / len(state.users), size / memberships
+        )
+    )
+    events = [Message(line) for line in churn(users, channels, 200000)]
+    start = time.perf_counter()
+    for message in events:
+        state.update(message)
+    elapsed = time.perf_counter() - start
+    print("churn: {:,.0f} events/sec".format(len(events) / elapsed))
+    start = time.perf_counter()
+    for u in range(0, users, 10):
+        state.channels_of("USER{}".format(u))
+    lookups = users // 10
+    print(
+        "channels_of: {:,.0f} lookups/sec".format(
+            lookups / (time.perf_counter() - start)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5000,
+    )
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""votes/sec of examples/tallybot.py: the autocommit sqlite it used to do
+(a SELECT then an UPDATE or INSERT, then a summary query, per vote) against
+pbnj.store.Store, which bumps counters in memory and writes them out in the
+background
+
+usage: python benchmarks/bench_store.py [votes]"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+
+import corpus  # puts the checkout on sys.path
+from pbnj.store import Store
+
+TOPICS = ["topic{}".format(i) for i in range(500)]
+
+
+def ballots(count):
+    random.seed(0)
+    return [(random.choice(TOPICS), random.random() < 0.7) for _ in range(count)]
+
+
+def autocommit(path, votes):
+    """tallybot before pbnj.store"""
+    db = sqlite3.connect(path, isolation_level=None)
+    cur = db.cursor()
+    cur.execute(
+        "create table if not exists Votes(Message varchar(70) not null, "
+        "Up integer not null, Down integer not null)"
+    )
+    start = time.perf_counter()
+    for topic, up in votes:
+        column = "Up" if up else "Down"
+        cur.execute("select {} from Votes where Message = ?".format(column), (topic,))
+        if cur.fetchone():
+            cur.execute(
+                "update Votes set {0} = {0} + 1 where Message = ?".format(column),
+                (topic,),
+            )
+        else:
+            cur.execute(
+                "insert into Votes values(?, ?, ?)", (topic, int(up), int(not up))
+            )
+        cur.execute("select Message, Up, Down from Votes where Message = ?", (topic,))
+        cur.fetchone()
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed
+
+
+def write_behind(path, votes):
+    """tallybot with pbnj.store"""
+    store = Store(path, "Votes", key="Message", fields=("Up", "Down"))
+    start = time.perf_counter()
+    for topic, up in votes:
+        store.incr(topic, "Up" if up else "Down")
+        store.get(topic)
+    elapsed = time.perf_counter() - start
+    # the votes aren't safe until they're on disk
+    store.close()
+    return elapsed, time.perf_counter() - start
+
+
+def main(count):
+    votes = ballots(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        old = autocommit(os.path.join(tmp, "old.sqlite3"), votes)
+        handled, durable = write_behind(os.path.join(tmp, "new.sqlite3"), votes)
+        with sqlite3.connect(os.path.join(tmp, "new.sqlite3")) as db:
+            total = db.execute("select sum(Up) + sum(Down) from Votes").fetchone()[0]
+        assert total == count, "lost votes: {} of {}".format(total, count)
+    print("{:,} votes on {} topics".format(count, len(TOPICS)))
+    print("{:<14} {:>14}".format("", "votes/sec"))
+    print("{:<14} {:>14,.0f}".format("autocommit", count / old))
+    print("{:<14} {:>14,.0f}".format("store", count / handled))
+    print("{:<14} {:>14,.0f}".format("store+close", count / durable))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
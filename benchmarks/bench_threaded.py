@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""how long the server waits for its PONGs while a bot works through a burst
+of messages with a slow command, reading and dispatching on one thread versus
+with threaded=True, where a reader thread answers PINGs as they arrive
+
+usage: python benchmarks/bench_threaded.py [-n LINES] [-s SECONDS]"""
+import time
+import socket
+import logging
+import argparse
+import threading
+
+import corpus
+from pbnj.bot import Bot
+
+
+class BurstServer(threading.Thread):
+    """accepts one client, sends it lines with a PING every so often and
+    notes how long each PONG takes to come back"""
+
+    def __init__(self, lines, ping_every):
+        super().__init__(daemon=True)
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.lines = lines
+        self.ping_every = ping_every
+        self.pinged = {}
+        self.rtts = []
+        self.replies = 0
+
+    def run(self):
+        client, _ = self.listener.accept()
+        reader = threading.Thread(target=self.read, args=(client,), daemon=True)
+        reader.start()
+        for i, line in enumerate(self.lines):
+            if i % self.ping_every == 0:
+                token = str(i)
+                self.pinged[token] = time.perf_counter()
+                client.sendall(b"PING :" + token.encode() + b"\r\n")
+            client.sendall(line.encode() + b"\r\n")
+        client.sendall(b"PING :done\r\n")
+        self.pinged["done"] = time.perf_counter()
+        reader.join()
+        client.close()
+        self.listener.close()
+
+    def read(self, client):
+        buf = b""
+        while True:
+            data = client.recv(65536)
+            if not data:
+                return
+            buf += data
+            *lines, buf = buf.split(b"\r\n")
+            for line in lines:
+                if line.startswith(b"PONG :"):
+                    token = line[6:].decode()
+                    self.rtts.append(time.perf_counter() - self.pinged[token])
+                    if token == "done":
+                        client.sendall(b"ERROR :Closing link (bye)\r\n")
+                elif line.startswith(b"PRIVMSG"):
+                    self.replies += 1
+
+
+def run(lines, ping_every, delay, threaded, max_inbound):
+    server = BurstServer(lines, ping_every)
+    server.start()
+    bot = Bot("foo", use_builtin=False)
+
+    @bot.command("^\\.slow")
+    def slow(message):
+        time.sleep(delay)
+        return "done"
+
+    bot.connect("127.0.0.1", server.port, threaded=threaded, max_inbound=max_inbound)
+    # don't let our own PINGs muddy the numbers
+    bot.conn.ping_server = lambda: True
+    start = time.perf_counter()
+    bot.run()
+    server.join()
+    wall = time.perf_counter() - start
+    dropped = bot.conn.io.inbound.dropped if threaded else 0
+    return wall, sorted(server.rtts), server.replies, dropped
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    p.add_argument("-n", "--lines", type=int, default=20000)
+    p.add_argument("-s", "--delay", type=float, default=0.0002)
+    p.add_argument("-p", "--ping-every", type=int, default=1000)
+    p.add_argument("-q", "--max-inbound", type=int, default=10000)
+    args = p.parse_args()
+    logging.getLogger("pbnj").setLevel(logging.ERROR)
+    lines = []
+    for i, line in enumerate(corpus.synthetic(args.lines)):
+        lines.append(":user!~u@h PRIVMSG #c :.slow" if i % 10 == 0 else line)
+    print(
+        "{:,} lines, a {:.1f}ms command on every tenth".format(
+            len(lines), args.delay * 1000
+        )
+    )
+    print(
+        "{:<10} {:>8} {:>14} {:>14} {:>8} {:>8}".format(
+            "", "wall s", "PONG p50 ms", "PONG max ms", "replies", "dropped"
+        )
+    )
+    for name, threaded in [("one", False), ("threaded", True)]:
+        wall, rtts, replies, dropped = run(
+            lines, args.ping_every, args.delay, threaded, args.max_inbound
+        )
+        print(
+            "{:<10} {:>8.2f} {:>14.1f} {:>14.1f} {:>8,} {:>8,}".format(
+                name,
+                wall,
+                rtts[len(rtts) // 2] * 1000,
+                rtts[-1] * 1000,
+                replies,
+                dropped,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
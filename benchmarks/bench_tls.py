@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""what a reconnect costs over TLS: connect, handshake and close a Connection
+to a local TLS server many times, once with a full handshake every time and
+once resuming the previous session. Needs the openssl command to make a
+throwaway certificate authority
+
+usage: python benchmarks/bench_tls.py [-n CONNECTIONS]"""
+import os
+import ssl
+import time
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import corpus
+from pbnj import tls
+from pbnj.connection import Connection
+
+
+def make_certs(d):
+    """a CA and a certificate for localhost signed by it"""
+
+    def openssl(args):
+        subprocess.run(
+            ["openssl"] + args.split(),
+            cwd=d,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    ec = "-newkey ec -pkeyopt ec_paramgen_curve:prime256v1 -nodes"
+    openssl(
+        "req -x509 {} -keyout ca.key -out ca.pem -days 1 -subj /CN=bench-CA "
+        "-addext basicConstraints=critical,CA:TRUE".format(ec)
+    )
+    with open(os.path.join(d, "server.ext"), "w") as f:
+        f.write("subjectAltName=DNS:localhost\n")
+    openssl("req {} -keyout server.key -out server.csr -subj /CN=localhost".format(ec))
+    openssl(
+        "x509 -req -in server.csr -CA ca.pem -CAkey ca.key -CAcreateserial "
+        "-days 1 -extfile server.ext -out server.pem"
+    )
+    return [os.path.join(d, name) for name in ("ca.pem", "server.pem", "server.key")]
+
+
+def serve(listener, context):
+    """handshake with everyone who connects, send them a line and hang up
+    once they do"""
+    while True:
+        try:
+            client, _ = listener.accept()
+        except OSError:
+            return
+        # the session tickets and the welcome are separate little writes
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            client = context.wrap_socket(client, server_side=True)
+            client.sendall(b":irc.example.net 001 foo :Welcome\r\n")
+            while client.recv(4096):
+                pass
+        except OSError:
+            pass
+        finally:
+            client.close()
+
+
+def reconnect(port, cafile, count, resume):
+    """connect count times, with one Connection which resumes its sessions or
+    a new one every time"""
+    conns = []
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for _ in range(count):
+        if not conns or not resume:
+            conns.append(Connection("localhost", port, use_ssl=True, cafile=cafile))
+        conn = conns[-1]
+        conn.nick = "foo"
+        conn._connect()
+        # reading the welcome also takes in the server's session tickets
+        conn._recv()
+        conn.reset()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    return wall / count, cpu / count, sum(c.tls_resumed for c in conns)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    p.add_argument("-n", "--connections", type=int, default=300)
+    args = p.parse_args()
+    logging.getLogger("pbnj").setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as d:
+        cafile, certfile, keyfile = make_certs(d)
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(certfile, keyfile)
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(16)
+        server = threading.Thread(target=serve, args=(listener, context), daemon=True)
+        server.start()
+        port = listener.getsockname()[1]
+        # the first context costs the most, loading the CA
+        started = time.perf_counter()
+        tls.context(cafile)
+        elapsed = time.perf_counter() - started
+        print("shared SSLContext made in {:.2f}ms".format(elapsed * 1000))
+        print("{:<10} {:>14} {:>14} {:>10}".format("", "wall ms", "CPU ms", "resumed"))
+        for name, resume in [("full", False), ("resumed", True)]:
+            wall, cpu, resumed = reconnect(port, cafile, args.connections, resume)
+            print(
+                "{:<10} {:>14.2f} {:>14.2f} {:>10,}".format(
+                    name, wall * 1000, cpu * 1000, resumed
+                )
+            )
+        listener.close()
+
+
+if __name__ == "__main__":
+    main()
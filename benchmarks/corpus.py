@@ -0,0 +1,94 @@
+"""helpers shared by the benchmark scripts: loading the IRC logs the tests use
+and scaling them up into something worth measuring"""
+import os
+import sys
+import random
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LOGS = os.path.join(HERE, "..", "tests", "logs")
+LOG_NAMES = ["ngircd.log", "InspIRCd-2.0.log", "command.log"]
+
+# make the checkout importable without installing it
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+
+def log_lines(names=LOG_NAMES, keep_termination=False):
+    """the lines of the test logs, minus anything that would make a
+    Connection hang up"""
+    lines = []
+    for name in names:
+        with open(os.path.join(LOGS, name)) as f:
+            for line in f.read().splitlines():
+                if not line:
+                    continue
+                if not keep_termination and (
+                    "Closing link" in line or "Server going down" in line
+                ):
+                    continue
+                lines.append(line)
+    return lines
+
+
+def replicate(lines, megabytes):
+    """repeat lines until they add up to at least this many megabytes of
+    \\r\\n terminated wire data"""
+    wire = b"".join(line.encode("utf-8") + b"\r\n" for line in lines)
+    copies = max(1, int(megabytes * 1024 * 1024 / len(wire)) + 1)
+    return wire * copies
+
+
+def synthetic(count):
+    """a busy channel: mostly chatter, some joins/parts/quits and numerics"""
+    random.seed(0)
+    words = "the quick brown fox jumps over a lazy dog .weather 12345 ++ lol".split()
+    templates = [
+        ":{n}!~{n}@host-{i}.example.com PRIVMSG #channel :{text}",
+        ":{n}!~{n}@host-{i}.example.com PRIVMSG #channel :{text}",
+        ":{n}!~{n}@host-{i}.example.com PRIVMSG #channel :{text}",
+        ":{n}!~{n}@host-{i}.example.com JOIN :#channel",
+        ":{n}!~{n}@host-{i}.example.com PART #channel :bye",
+        ":{n}!~{n}@host-{i}.example.com QUIT :Ping timeout",
+        ":irc.example.net 353 foo = #channel :{text}",
+        ":irc.example.net NOTICE foo :{text}",
+    ]
+    lines = []
+    for i in range(count):
+        text = " ".join(random.choice(words) for _ in range(random.randrange(1, 12)))
+        nick = "user{}".format(i % 5000)
+        lines.append(random.choice(templates).format(n=nick, i=i % 997, text=text))
+    return lines
+
+
+class ChunkingSocket:
+    """stands in for a socket, handing out a byte string up to bufsz bytes per
+    recv() like a real one would, then b"" once it runs out. Everything sent to
+    it is counted and thrown away"""
+
+    def __init__(self, data):
+        self.view = memoryview(data)
+        self.offset = 0
+        self.bytes_sent = 0
+
+    def recv(self, bufsz):
+        chunk = self.view[self.offset : self.offset + bufsz]
+        self.offset += len(chunk)
+        return bytes(chunk)
+
+    def send(self, data):
+        self.bytes_sent += len(data)
+        return len(data)
+
+    def sendall(self, data):
+        self.bytes_sent += len(data)
+
+    def connect(self, address):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def setblocking(self, flag):
+        pass
+
+    def close(self):
+        pass
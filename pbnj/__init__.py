@@ -93,6 +93,6 @@ def default_argparser(arguments=sys.argv[1:], docstring=None, override=None):
         override.username = args.username
         override.realname = args.realname
         override.ssl = args.ssl
-        override.connect(args.network, args.port)
-        override.channels = override._channelify(args.channels.split(","))
+        override.connect(args.network, args.port, ssl=args.ssl)
+        override.channels = list(override._channelify(args.channels.split(",")))
     return args
@@ -0,0 +1,273 @@
+"""asyncio flavoured versions of the Bot and Connection. The reader task only
+reads, answers PINGs and schedules work, so a slow command can't stall the
+rest of the bot: async def callbacks run as tasks, everything else runs on a
+bounded pool of threads"""
+import time
+import asyncio
+import inspect
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from types import AsyncGeneratorType, GeneratorType
+
+from pbnj.bot import Bot
+from pbnj.connection import Connection, ConnectionException
+from pbnj.models import Message
+from pbnj.workers import WorkerPool
+from pbnj import __version__
+
+log = logging.getLogger("pbnj")
+
+# handed back by next() when a generator running on the pool is exhausted
+_EXHAUSTED = object()
+
+
+class AsyncConnection(Connection):
+    """a Connection on top of asyncio streams. send() stays a plain method so
+    the helpers inherited from Connection (join, part, message, register) keep
+    working, and it's safe to call from the threads running sync callbacks.
+    It takes the same keyword arguments as Connection, except that replies are
+    written straight to the stream's buffer, so there's no send_queue or
+    threaded, and registering can't wait for the server, so no SASL"""
+
+    def __init__(self, addr, port, version="-1", **kwargs):
+        for name in ("send_queue", "threaded", "sasl_external"):
+            if kwargs.get(name):
+                raise ValueError("AsyncConnection doesn't support {}".format(name))
+        super().__init__(addr, port, version, **kwargs)
+        self.ssl = self.ssl or port == 6697
+        self.sasl_external = False
+        self.reader = None
+        self.writer = None
+        self._loop = None
+
+    def _make_socket(self):
+        # the streams are opened by _connect()
+        return None
+
+    async def __aenter__(self):
+        await self._connect()
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        if self._connected:
+            await self._cleanup()
+
+    async def _connect(self):
+        """open the streams to the server"""
+        self._loop = asyncio.get_running_loop()
+        context = None
+        if self.ssl:
+            from pbnj import tls
+
+            context = self.ssl_context or tls.context(
+                self.cafile, self.certfile, self.keyfile
+            )
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.addr, self.port, ssl=context, limit=self.recv_bufsz * 16
+            ),
+            self.timeout,
+        )
+        self._connected = True
+        if context is not None:
+            self.tls_handshakes += 1
+
+    async def _cleanup(self):
+        """say goodbye and close the streams"""
+        self.send("QUIT :{0}/{1}".format(self.nick, self.version))
+        log.warning("Closing socket and IRC connections")
+        self._connected = False
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+        if self.recorder is not None:
+            self.recorder.flush()
+
+    async def _recv(self):
+        """recieve only one line from the stream"""
+        return self._decode(await self._recv_line())
+
+    async def _recv_line(self):
+        """recieve only one line from the stream, as bytes"""
+        try:
+            line = await self.reader.readuntil(self.linesep)
+        except asyncio.IncompleteReadError:
+            log.warning("Server closed the connection")
+            raise ConnectionException("Connection closed")
+        except asyncio.LimitOverrunError:
+            log.warning("Got a line longer than our read limit")
+            raise ConnectionException("Line too long")
+        self.stats.received(len(line), 1)
+        line = line[: -len(self.linesep)]
+        if self.recorder is not None:
+            self.recorder.received([line])
+        return line
+
+    async def recieve(self):
+        """recieve lines of text from the stream as an async generator, replying
+        to PINGs as soon as they're read"""
+        while True:
+            try:
+                line = await self._recv_line()
+                if not self._wanted(line):
+                    continue
+                message = self._decode(line)
+            except ConnectionException:
+                return
+            if self._ping_token is None or not self._our_pong(message):
+                yield message
+
+    def _in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def _write(self, data):
+        """queue a line on the stream, from the event loop or any other thread"""
+        try:
+            self.stats.sent(len(data))
+            if self._in_loop():
+                self.writer.write(data)
+            else:
+                self._loop.call_soon_threadsafe(self.writer.write, data)
+            if self.recorder is not None:
+                self.recorder.sent(data)
+            if log.isEnabledFor(logging.INFO):
+                log.info("SEND %s", data[:-2].decode("utf-8", "replace"))
+            return True
+        except Exception:
+            log.error("Hit an exception while trying to send %r", data)
+            return False
+
+    async def drain(self):
+        """wait until the stream's write buffer is below its high water mark"""
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+
+
+class AsyncBot(Bot):
+    """a Bot which runs on an asyncio event loop. Commands are registered the
+    same way, with @bot.command(...), and may be either plain functions or
+    coroutine functions (which may also be async generators). At most
+    max_workers sync callbacks run at once"""
+
+    def __init__(self, nick, *args, max_workers=4, **kwargs):
+        super().__init__(nick, *args, **kwargs)
+        self.max_workers = max_workers
+        self._executor = None
+        self._slots = None
+        self._tasks = set()
+
+    def connect(self, addr, port=6667, ssl=False, **kwargs):
+        """create a connection to an address, or return one if it already exists.
+        Any other keyword arguments (like recorder) are handed to
+        AsyncConnection"""
+        if not self._is_connected():
+            self.conn = AsyncConnection(addr, port, __version__, use_ssl=ssl, **kwargs)
+        return self.conn
+
+    def run(self, shutdown=True):
+        """set up and connect the bot, start looping on a fresh event loop"""
+        return asyncio.run(self.start(shutdown))
+
+    async def start(self, shutdown=True):
+        """set up and connect the bot, loop until the server goes away. See
+        Bot.run for shutdown"""
+        if self.use_builtin:
+            self._enable_builtin_commands()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="pbnj"
+        )
+        self._slots = asyncio.Semaphore(self.max_workers)
+        try:
+            async with self.conn:
+                self.state.clear()
+                self.conn.prefilter = self._prefilter()
+                self.conn.max_msg_len = self.max_msg_len
+                self.conn.register(
+                    self.username, self.nick, self.conn.addr, self.realname
+                )
+                await asyncio.sleep(self.connect_wait)
+                if self.channels:
+                    log.info("Joining initial channels")
+                    for channel in self.channels:
+                        self.conn.join(channel)
+                async for raw_message in self.conn.recieve():
+                    msg = Message(raw_message)
+                    if self._should_handle(msg):
+                        self.handle(msg)
+                # let whatever is still running finish replying
+                if self._tasks:
+                    await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            self._executor.shutdown(wait=False)
+            if shutdown:
+                self._shutdown()
+
+    def handle(self, message):
+        """find the command matching a message and schedule it as a task on the
+        running loop, return the task or False if nothing matched. Commands
+        registered with an executor run on the bot's worker pools instead, as
+        they do with a Bot"""
+        command = self._find_command(message)
+        if command is None:
+            log.debug("No matches found.")
+            return False
+        if not self._allowed(command, message):
+            return False
+        if command.executor is not None:
+            if self.workers is None:
+                self.workers = WorkerPool()
+            return self.workers.submit(command, message, self._deliver)
+        task = asyncio.ensure_future(self._run_command(command, message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _offload(self, function, *args):
+        """run a blocking function on the bounded pool"""
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, function, *args
+            )
+
+    async def _run_command(self, command, message):
+        """call a command without blocking the loop and deliver its replies"""
+        started = time.perf_counter()
+        try:
+            if inspect.isasyncgenfunction(command.callback):
+                resp = command(message)
+            elif asyncio.iscoroutinefunction(command.callback):
+                resp = await command(message)
+            else:
+                resp = await self._offload(command, message)
+            log.info("Called command method %s", command.name)
+            if isinstance(resp, AsyncGeneratorType):
+                success = True
+                async for reply in resp:
+                    command.stats.replied(reply)
+                    success = success and self.conn.message(message.reply_dest, reply)
+            elif isinstance(resp, GeneratorType):
+                # generators may block between items, so step them on the pool
+                success = True
+                while True:
+                    reply = await self._offload(next, resp, _EXHAUSTED)
+                    if reply is _EXHAUSTED:
+                        break
+                    command.stats.replied(reply)
+                    success = success and self.conn.message(message.reply_dest, reply)
+            else:
+                success = self._deliver(command, message, resp)
+            await self.conn.drain()
+            return success
+        except Exception:
+            command.stats.errors += 1
+            log.exception("Command %s raised an exception", command.name)
+            return False
+        finally:
+            command.stats.latency.observe(time.perf_counter() - started)
@@ -1,43 +1,92 @@
 import time
-import inspect
 import logging
 from types import GeneratorType
 
-from pbnj.connection import Connection
+from pbnj.connection import Connection, MAX_LINE
 from pbnj.models import Message, Command, _builtin_command
+from pbnj.dispatch import CommandIndex, HelpIndex
+from pbnj.workers import WorkerPool
+from pbnj.metrics import Metrics
+from pbnj.state import State, NUMERICS
+from pbnj.prefilter import Prefilter
+from pbnj.ratelimit import limiter
 from pbnj import __version__
 
 log = logging.getLogger("pbnj")
 
 
+def _collect_builtins(cls):
+    """(method name, filterspec) of every _builtin_command decorated method
+    of a class, sorted by name. Methods overridden without the decorator
+    don't count"""
+    builtins = {}
+    seen = set()
+    for klass in cls.__mro__:
+        for name, attr in vars(klass).items():
+            if name in seen:
+                continue
+            seen.add(name)
+            if getattr(attr, "_command", False):
+                builtins[name] = attr._filterspec
+    return tuple(sorted(builtins.items()))
+
+
 class Bot:
+    # (method name, filterspec) of the builtin commands, worked out once for
+    # every class rather than by looking through each bot's attributes
+    _builtins = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._builtins = _collect_builtins(cls)
+
     def __init__(
         self,
         nick,
-        initial_channels=[],
+        initial_channels=None,
         username=None,
         realname=None,
         use_builtin=True,
         builtin_prefix="^\.",
         connect_wait=0,
         follow_invite=True,
-        ignore={},
+        ignore=None,
+        rate_limit=None,
     ):
         self.nick = nick
         self.username = username or nick
         self.realname = realname or nick
-        self.channels = initial_channels
+        self.channels = list(initial_channels or [])
+        # the most bytes of text in one PRIVMSG, longer replies are split up
         self.max_msg_len = 300
         self.commands = []
+        self._index = CommandIndex(self.commands)
+        self._help = HelpIndex(self.commands)
         self.use_builtin = use_builtin
+        self._builtins_enabled = False
         self.builtin_prefix = builtin_prefix
         self.connect_wait = connect_wait
         self.follow_invite = follow_invite
         # Gives control over nicknames & message substrings to discard
         # Setting ignore['nicks'] is useful for ignoring messages from other bots
-        self.ignore = ignore
+        # ignore['hosts'] can hold hostnames too, *.example.com for a domain
+        self.ignore = ignore if ignore is not None else {}
+        self._ignored_nicks = frozenset(self.ignore.get("nicks", ()))
+        # how many commands each nick and host may run, as a (calls, seconds)
+        # pair or a pbnj.ratelimit.RateLimiter, None for as many as they like
+        self.rate_limit = limiter(rate_limit)
         # Will be setup after self.connect() is called
         self.conn = None
+        # other networks this bot is connected to by a pbnj.runtime.Runtime
+        self.networks = {}
+        # runs commands registered with an executor, created when first needed
+        self.workers = None
+        # counters for every command and connection, see pbnj.metrics
+        self.metrics = Metrics(self)
+        # who is in which channel, see pbnj.state
+        self.state = State(nick)
+        # called whenever run() finishes, see on_shutdown
+        self._shutdown_hooks = []
 
     def __str__(self):
         return "pbnj.Bot {}".format(self.nick)
@@ -50,6 +99,13 @@ class Bot:
     def _is_connected(self):
         return self.conn is not None
 
+    def _network_for(self, name):
+        """the network a message came from, which is the bot itself for messages
+        from its own connection. Both have a conn, nick and channels"""
+        if name is None:
+            return self
+        return self.networks[name]
+
     def _channelify(self, text_stream):
         """ensure an iterable of channels start with #"""
         for ch_name in text_stream:
@@ -65,29 +121,58 @@ class Bot:
 
     def _enable_builtin_commands(self):
         """check for _builtin_command decorated commands, insert them"""
-        log.debug("Checking methods for builtin commands")
-        for m_name, method in inspect.getmembers(self, inspect.ismethod):
-            if "_command" in dir(method):
-                log.debug("{} is a command!".format(m_name))
-                self.commands.append(
-                    Command(self.builtin_prefix + method._filterspec, method)
-                )
-        log.debug(str(self.commands))
+        if self._builtins_enabled:
+            return
+        self._builtins_enabled = True
+        for name, filterspec in self._builtins:
+            log.debug("%s is a command!", name)
+            self.commands.append(
+                Command(self.builtin_prefix + filterspec, getattr(self, name))
+            )
+        log.debug("%s", self.commands)
 
-    def connect(self, addr, port=6667, ssl=False):
-        """create a connection to an address, or return one if it already exists"""
+    def connect(self, addr, port=6667, ssl=False, **kwargs):
+        """create a connection to an address, or return one if it already exists.
+        Any other keyword arguments (like send_queue) are handed to Connection"""
         if not self._is_connected():
-            self.conn = Connection(addr, port, __version__, use_ssl=ssl)
+            self.conn = Connection(addr, port, __version__, use_ssl=ssl, **kwargs)
         return self.conn
 
-    def command(self, filterspec):
+    def command(
+        self,
+        filterspec=None,
+        executor=None,
+        max_concurrency=None,
+        timeout=None,
+        cache_ttl=None,
+        cache_size=128,
+        cache_key=None,
+        on=None,
+        rate_limit=None,
+        user_rate_limit=None,
+    ):
         """the decorator which marks an external function as a Command in the
-        bot's context
+        bot's context. Pass executor="thread" or "process" to run it on a
+        worker pool, cache_ttl to reuse its replies, on=["JOIN", 353] to
+        only hear about those types of message, or rate_limit=(5, 60) to run
+        it at most 5 times a minute, see pbnj.models.Command
         """
 
         def real_decorator(function):
-            log.debug("Creating command for function {}".format(function))
-            c = Command(filterspec, function)
+            log.debug("Creating command for function %s", function)
+            c = Command(
+                filterspec,
+                function,
+                executor,
+                max_concurrency,
+                timeout,
+                cache_ttl,
+                cache_size,
+                cache_key,
+                on,
+                rate_limit,
+                user_rate_limit,
+            )
             self.commands.append(c)
             log.debug("Added to self.commands")
             return function
@@ -95,125 +180,315 @@ class Bot:
         log.debug("Exiting command() decorator")
         return real_decorator
 
-    def joinall(self, channels):
+    def joinall(self, channels, network=None):
         """joins a bunch of channels"""
+        net = self._network_for(network)
+        fold = net.state.fold
+        known = {fold(channel) for channel in net.channels}
         success = True
         for channel in self._channelify(channels):
-            self.channels.append(channel)
-            success = success and self.conn.join(channel)
+            if fold(channel) not in known:
+                known.add(fold(channel))
+                net.channels.append(channel)
+            success = success and net.conn.join(channel)
         return success
 
-    def part(self, channels):
+    def part(self, channels, network=None):
         """leaves a bunch of channels :( """
+        net = self._network_for(network)
+        fold = net.state.fold
         for channel in self._channelify(channels):
-            self.channels.remove(channel)
-            self.conn.part(channel)
+            key = fold(channel)
+            net.channels[:] = [c for c in net.channels if fold(c) != key]
+            net.conn.part(channel)
+
+    def broadcast(self, targets, message, network=None):
+        """send the same message to a bunch of channels or nicks, with as many
+        targets to a PRIVMSG as the server's TARGMAX allows"""
+        net = self._network_for(network)
+        per_line = net.state.targmax("PRIVMSG")
+        success = True
+        batch = []
+        for target in targets:
+            # keep at least half of each line for the message itself
+            joined = len(target) + sum(len(t) + 1 for t in batch)
+            if batch and (len(batch) == per_line or joined > MAX_LINE // 2):
+                success = net.conn.message(",".join(batch), message) and success
+                batch = []
+            batch.append(target)
+        if batch:
+            success = net.conn.message(",".join(batch), message) and success
+        return success
+
+    def _prefilter(self):
+        """a Prefilter for the lines this bot doesn't need to see: messages
+        from ignored nicks and hosts, and numerics which neither the channel
+        state nor any command subscribes to. A command with a callable filterspec
+        and no subscription could be looking for any numeric, so then they're
+        all kept"""
+        self._ignored_nicks = frozenset(self.ignore.get("nicks", ()))
+        keep = set(NUMERICS)
+        for c in self.commands:
+            if c.on is not None:
+                keep.update(kind for kind in c.on if isinstance(kind, int))
+            elif callable(c.filterspec):
+                keep = None
+                break
+        return Prefilter(self._ignored_nicks, self.ignore.get("hosts", ()), keep)
+
+    def on_shutdown(self, callback):
+        """call callback() whenever the bot stops running, like to flush a
+        pbnj.store.Store"""
+        self._shutdown_hooks.append(callback)
+        return callback
+
+    def _shutdown(self):
+        """stop the worker pools, close the recorders and run the shutdown
+        hooks"""
+        if self.workers is not None:
+            self.workers.shutdown()
+        conns = [self.conn] + [network.conn for network in self.networks.values()]
+        for conn in conns:
+            recorder = getattr(conn, "recorder", None)
+            if recorder is not None:
+                recorder.close()
+        for hook in self._shutdown_hooks:
+            try:
+                hook()
+            except Exception:
+                log.exception("Shutdown hook %s failed", hook)
 
     def raw_send(self, message):
         """deliver a message directly to the connection- useful for doing things
         like MODE"""
         return self.conn.send(message)
 
-    def run(self):
-        """set up and connect the bot, start looping!"""
-        invitation = "INVITE " + self.nick
-        ignored_nicks = self.ignore.get("nicks", [])
+    def run(self, shutdown=True):
+        """set up and connect the bot, start looping! With shutdown=False the
+        worker pools, recorders and shutdown hooks are left running for a
+        caller which runs the bot again, like pbnj.supervisor.Supervisor"""
         if self.use_builtin:
             self._enable_builtin_commands()
-        # start the connection
-        with self.conn:
-            # make sure we're registered to the irc network
-            self.conn.register(self.username, self.nick, self.conn.addr, self.realname)
-            time.sleep(self.connect_wait)
-            # handle any channels the user asked us to join
-            if self.channels:
-                log.info("Joining initial channels")
-                for channel in self.channels:
-                    self.conn.join(channel)
-            for msg in self._messageify(self.conn.recieve()):
-                # Handle invitations to other channels
-                if self.follow_invite and invitation in msg.raw_msg:
-                    destination = msg.raw_msg.split(":")[-1]
-                    self.joinall([destination])
-                    continue
-                # Check if we should ignore this message based on the content
-                if msg.nick is not None and msg.nick in ignored_nicks:
-                    log.debug(
-                        "Skipping message from {} as it's in the ignored nicklist".format(
-                            msg.nick
-                        )
-                    )
-                    continue
-                self.handle(msg)
+        # start the connection, and shut down once it's closed (and its QUIT
+        # recorded)
+        try:
+            with self.conn:
+                self.state.clear()
+                self.conn.prefilter = self._prefilter()
+                self.conn.max_msg_len = self.max_msg_len
+                # make sure we're registered to the irc network
+                self.conn.register(
+                    self.username, self.nick, self.conn.addr, self.realname
+                )
+                time.sleep(self.connect_wait)
+                # handle any channels the user asked us to join
+                if self.channels:
+                    log.info("Joining initial channels")
+                    for channel in self.channels:
+                        self.conn.join(channel)
+                for msg in self._messageify(self.conn.recieve()):
+                    if self._should_handle(msg):
+                        self.handle(msg)
+        finally:
+            if shutdown:
+                self._shutdown()
+
+    def _should_handle(self, msg):
+        """keep track of channel state, deal with invitations and ignored nicks
+        before a message gets to handle(), return whether it should be
+        dispatched"""
+        net = self._network_for(msg.network)
+        net.state.update(msg)
+        if msg.type in ("JOIN", "NICK") and msg.nick is not None:
+            self._track_source(net, msg)
+        # Handle invitations to other channels, commands can still hear about
+        # them with on=["INVITE"]
+        if self.follow_invite and msg.type == "INVITE" and len(msg.params) > 1:
+            if net.state.fold(msg.params[0]) == net.state.fold(net.nick):
+                self.joinall([msg.params[1]], msg.network)
+        # Check if we should ignore this message based on the content
+        if msg.nick is not None and msg.nick in self._ignored_nicks:
+            log.debug(
+                "Skipping message from %s as it's in the ignored nicklist", msg.nick
+            )
+            return False
+        return True
+
+    def _track_source(self, net, msg):
+        """note the nick!user@host the server puts in front of our messages,
+        from our own JOINs and nick changes"""
+        fold, me = net.state.fold, net.state.fold(net.state.nick or "")
+        if msg.type == "JOIN" and fold(msg.nick) == me:
+            net.conn.source = msg.prefix
+        elif msg.type == "NICK" and msg.params and fold(msg.params[0]) == me:
+            net.conn.source = msg.params[0] + msg.prefix[len(msg.nick) :]
+
+    def _find_command(self, message):
+        """return the first registered command which matches the message"""
+        # this runs for every command on every message, so don't even build the
+        # arguments for debug logging unless someone is listening
+        debug = log.isEnabledFor(logging.DEBUG)
+        for command in self._index.candidates(message):
+            if debug:
+                log.debug("Checking command %s", command.name)
+            command.stats.attempts += 1
+            if command.match(message):  # the call
+                log.info("%s matched!", command.name)
+                command.stats.hits += 1
+                return command
+            elif debug:
+                log.debug("%s failed to match %r", command.name, message)
+        return None
+
+    def _deliver(self, command, message, resp):
+        """hand the return value of a command back to whoever sent the message"""
+        if not resp:
+            return False
+        conn = self._network_for(message.network).conn
+        log.info("Got a reply: %s", resp)
+        # we have something to hand back
+        if type(resp) == str:
+            log.debug("Response is a string, sending...")
+            command.stats.replied(resp)
+            return conn.message(message.reply_dest, resp)
+        elif isinstance(resp, GeneratorType):
+            log.debug("Response is a generator, giving back the contents")
+            return conn.messages(message.reply_dest, command.stats.counted(resp))
+        elif isinstance(resp, bool):
+            log.debug("The function handed back a boolean, returning it")
+            return resp
+        else:
+            log.warning("Got back a weird type from command %s", command.name)
+            log.warning(resp)
+            return False
+
+    def _allowed(self, command, message):
+        """check a message against the bot's rate limits and the command's,
+        counting it against all of them only if every one lets it through"""
+        limits = [self.rate_limit, command.user_limiter]
+        if limits == [None, None] and command.limiter is None:
+            return True
+        keys = ()
+        if message.nick is not None:
+            fold = self._network_for(message.network).state.fold
+            # nicks can't have an @ in them, so hosts can share the limiters
+            keys = [(message.network, fold(message.nick))]
+            if message.host:
+                keys.append((message.network, "@" + message.host.lower()))
+        checks = [(limit, key) for limit in limits if limit is not None for key in keys]
+        if command.limiter is not None:
+            checks.append((command.limiter, None))
+        if not all(limit.allow(key, count=False) for limit, key in checks):
+            command.stats.limited += 1
+            log.debug("Rate limited %s from %s", command.name, message.nick)
+            return False
+        for limit, key in checks:
+            limit.allow(key)
+        return True
 
     def handle(self, message):
-        """Iterates through the registered commands and attempts to find a
-        command which matches the incoming Message. Does this by calling
-        command.match() for each.
+        """Looks up the registered commands which could match the incoming
+        Message and attempts to find one which does. Does this by calling
+        command.match() for each candidate, in the order they were registered.
+        Candidates come from a dictionary of message type to the commands
+        subscribed to it, see pbnj.dispatch.CommandIndex
         """
-        for command in self.commands:
-            log.debug("Checking command {}".format(command.name))
-            if command.match(message):  # the call
-                log.info("{} matched!".format(command.name))
-                resp = command(message)
-                log.info("Called command method {0}".format(command.name))
-                if resp:
-                    log.info("Got a reply: {}".format(resp))
-                    # we have something to hand back
-                    if type(resp) == str:
-                        log.debug("Response is a string, sending...")
-                        return self.conn.message(message.reply_dest, resp)
-                    elif isinstance(resp, GeneratorType):
-                        log.debug("Response is a generator, giving back the contents")
-                        success = True
-                        for reply in resp:
-                            success = success and self.conn.message(
-                                message.reply_dest, reply
-                            )
-                        return success
-                    elif isinstance(resp, bool):
-                        log.debug("The function handed back a boolean, returning it")
-                        return resp
-                    else:
-                        log.warning(
-                            "Got back a weird type from command {}".format(command.name)
-                        )
-                        log.warning(resp)
-                        return False
-                break  # don't check any more methods
-            else:
-                log.debug("{0} failed to match {1}".format(command.name, message))
-        log.debug("No matches found.")
-        return False  # couldn't find a match for the command at all
+        command = self._find_command(message)
+        if command is None:
+            log.debug("No matches found.")
+            return False  # couldn't find a match for the command at all
+        if not self._allowed(command, message):
+            return False
+        if command.executor is not None:
+            if self.workers is None:
+                self.workers = WorkerPool()
+            return self.workers.submit(command, message, self._deliver)
+        started = time.perf_counter()
+        try:
+            resp = command(message)
+            log.info("Called command method %s", command.name)
+            return self._deliver(command, message, resp)
+        except Exception:
+            command.stats.errors += 1
+            raise
+        finally:
+            command.stats.latency.observe(time.perf_counter() - started)
 
     @_builtin_command("version")
     def version(self, message):
         """display the library version"""
-        return "{}: {} version {}".format(message.nick, self.nick, __version__)
+        nick = self._network_for(message.network).nick
+        return "{}: {} version {}".format(message.nick, nick, __version__)
 
     @_builtin_command("ping")
     def ping(self, message):
         """pong"""
         return "{}: pong".format(message.nick)
 
+    @_builtin_command("stats")
+    def stats(self, message):
+        """show the busiest commands, or how one command is doing"""
+        snapshot = self.metrics.snapshot()
+        commands = snapshot["commands"]
+        if message.args:
+            name = message.args[0]
+            if name not in commands:
+                return "{}: no command called {}".format(message.nick, name)
+            c = commands[name]
+            latency = c["latency"]
+            mean = latency["sum"] / latency["count"] if latency["count"] else 0.0
+            return "{}: {} matched {}/{}, {} errors, {} replies, {:.1f}ms avg".format(
+                message.nick,
+                name,
+                c["hits"],
+                c["attempts"],
+                c["errors"],
+                c["replies"],
+                mean * 1000,
+            )
+        conn = snapshot["connections"].get(message.network or "default", {})
+        busiest = sorted(commands.items(), key=lambda i: i[1]["hits"], reverse=True)
+        calls = ", ".join(
+            "{} {}".format(name, c["hits"]) for name, c in busiest[:3] if c["hits"]
+        )
+        rtt = conn.get("ping_rtt")
+        return "{}: {} lines in, {} out, ping {}. Busiest: {}".format(
+            message.nick,
+            conn.get("lines_in", 0),
+            conn.get("lines_out", 0),
+            "{:.0f}ms".format(rtt * 1000) if rtt is not None else "unknown",
+            calls or "nothing yet",
+        )
+
     @_builtin_command("join")
     def join(self, message):
         """join a number of channels"""
         if len(message.args) < 1:
             return "Usage: {}join #channelname".format(self.builtin_prefix)
         else:
-            log.debug("We got channels: {}".format(message.args))
-            return self.joinall(message.args)
+            log.debug("We got channels: %s", message.args)
+            return self.joinall(message.args, message.network)
 
     @_builtin_command("help")
     def help(self, message):
-        """return name and description of all commands"""
-        if len(message.args) == 2:
-            # we want detailed help for a specific command
-            for command in self.commands:
-                if command.name == message.args[1]:
-                    return "{}: {} - {}".format(
-                        message.nick, command.name, str(command)
+        """list the commands a page at a time, or describe one"""
+        page = 1
+        if message.args:
+            if not message.args[0].isdecimal():
+                command = self._help.find(message.args[0])
+                if command is None:
+                    return "{}: no command called {}".format(
+                        message.nick, message.args[0]
                     )
-        else:
-            return "Available commands: " + " ".join(c.name for c in self.commands)
+                return "{}: {} - {}".format(message.nick, command.name, str(command))
+            page = int(message.args[0])
+        conn = self._network_for(message.network).conn
+        pages = self._help.pages(conn._budget("PRIVMSG", message.reply_dest))
+        if not 1 <= page <= len(pages):
+            return "{}: there are {} pages of commands".format(
+                message.nick, len(pages)
+            )
+        return pages[page - 1]
+
+
+Bot._builtins = _collect_builtins(Bot)
@@ -0,0 +1,169 @@
+"""remembers the replies of commands which give the same answer to the same
+question for a while, like a weather lookup, so repeating one doesn't call
+the slow API behind it again"""
+import time
+import logging
+import threading
+from types import GeneratorType
+from collections import OrderedDict
+
+log = logging.getLogger("pbnj")
+
+
+def default_key(message):
+    """the same text to the same place gets the same reply, whoever asked"""
+    return (message.network, message.reply_dest, message.message or message.raw_msg)
+
+
+def nick_key(message):
+    """like default_key, but kept apart for each nick, for commands whose
+    replies mention who asked"""
+    return default_key(message) + (message.nick,)
+
+
+class _Flight:
+    """a call of the callback which others asking the same thing wait on"""
+
+    __slots__ = ("done", "value", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        # called with (value, error) once it's done
+        self.waiters = []
+
+
+class ResponseCache:
+    """keeps the replies of a command for ttl seconds, at most size of them,
+    evicting the least recently used first. Generators are run to the end and
+    their replies kept as a list. Calls asking the same thing while the
+    callback is already running wait for its answer instead of calling it
+    again. key is a function from a Message to what identifies the question"""
+
+    def __init__(self, ttl, size=128, key=None, clock=time.monotonic):
+        if ttl <= 0 or size < 1:
+            raise ValueError("ResponseCache needs a positive ttl and size")
+        self.ttl = ttl
+        self.size = size
+        self.key = key or default_key
+        self.clock = clock
+        # key -> (expiry, value), least recently used first
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """(True, value) if there's a fresh reply for key, else (False, None)"""
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] <= self.clock():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._put(key, value)
+
+    def _put(self, key, value):
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def freeze(resp):
+        """turn a reply into something that can be handed out more than once"""
+        if isinstance(resp, GeneratorType):
+            return list(resp)
+        return resp
+
+    @staticmethod
+    def thaw(value):
+        """the reply again, with lists of replies turned back into generators"""
+        if isinstance(value, list):
+            return (reply for reply in value)
+        return value
+
+    def lookup(self, key, waiter=None):
+        """the first step of answering the question key: ("hit", value) if
+        there's a fresh reply, ("wait", flight) if somebody is already calling
+        the callback for it, or ("lead", flight) if it's up to us, and finish()
+        has to be called with the answer. waiter(value, error) is called when
+        the flight we'd wait on is done, for callers which can't block"""
+        with self._lock:
+            found, value = self._get(key)
+            if found:
+                return "hit", value
+            flight = self._inflight.get(key)
+            if flight is None:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+                return "lead", flight
+            self.coalesced += 1
+            if waiter is not None:
+                flight.waiters.append(waiter)
+            return "wait", flight
+
+    def finish(self, key, flight, value=None, error=None):
+        """the answer (frozen) or exception of a flight we lead, which is kept
+        and handed to everyone waiting on it"""
+        flight.value = value
+        flight.error = error
+        with self._lock:
+            if error is None:
+                self._put(key, value)
+            del self._inflight[key]
+        flight.done.set()
+        for waiter in flight.waiters:
+            waiter(value, error)
+
+    def call(self, callback, message):
+        """the cached reply for a message, calling callback(message) for it only
+        if nobody else is already doing so"""
+        key = self.key(message)
+        state, found = self.lookup(key)
+        if state == "hit":
+            return self.thaw(found)
+        flight = found
+        if state == "wait":
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return self.thaw(flight.value)
+        try:
+            value = self.freeze(callback(message))
+        except Exception as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, value)
+        return self.thaw(value)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
@@ -1,34 +1,159 @@
-import ssl
+import time
 import socket
 import logging
+import threading
+from collections import deque
+
+from pbnj.metrics import ConnectionStats
+from pbnj.models import parse_line
 
 log = logging.getLogger("pbnj")
 
+# the longest line a server takes, \r\n included
+MAX_LINE = 512
+# how long the user@host a server puts in front of our messages can be, for
+# when we haven't seen it yet
+_SOURCE_ESTIMATE = 1 + 10 + 1 + 63
+
+
+def split_text(text, limit):
+    """split text into pieces of at most limit bytes of UTF-8, breaking at the
+    last space which fits or else between two characters. Every line of the
+    text starts a new piece and empty ones are skipped. The text is only
+    encoded once, each piece is decoded from its slice"""
+    limit = max(limit, 4)
+    for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        data = line.encode()
+        start, length = 0, len(data)
+        while length - start > limit:
+            end = start + limit
+            cut = data.rfind(b" ", start + 1, end + 1)
+            if cut > start:
+                yield data[start:cut].decode()
+                start = cut + 1
+                continue
+            # no space to break at, so don't break a character in two
+            while data[end] & 0xC0 == 0x80:
+                end -= 1
+            yield data[start:end].decode()
+            start = end
+        if start < length:
+            yield data[start:].decode()
+
 
 class Connection:
     """sets up the bots connection on a socket level.
     The only *magic* this class does is respond to PING messages with PONG
-    messages, which I see as an essential part of maintaining a Connection
+    messages, which I see as an essential part of maintaining a Connection.
+    With threaded=True recieve() reads and writes on threads of their own,
+    with up to max_inbound lines waiting to be dispatched, see pbnj.threaded.
+    TLS connections use the shared context from pbnj.tls.context(cafile,
+    certfile, keyfile) unless given an ssl_context, and log in with SASL
+    EXTERNAL when there's a client certificate (unless sasl_external=False).
+    Messages too long for one line are split, see message(). Every line
+    received and sent is handed to the recorder, if there is one (see
+    pbnj.recorder)
     """
 
     def __init__(
-        self, addr, port, version="-1", timeout=10.0, recv_bufsz=4096, use_ssl=False
+        self,
+        addr,
+        port,
+        version="-1",
+        timeout=10.0,
+        recv_bufsz=4096,
+        use_ssl=False,
+        max_line_len=16384,
+        send_queue=None,
+        threaded=False,
+        max_inbound=10000,
+        overflow="drop-oldest",
+        ssl_context=None,
+        cafile=None,
+        certfile=None,
+        keyfile=None,
+        sasl_external=None,
+        recorder=None,
     ):
-        conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        if use_ssl or port == 6697:
-            self.conn = ssl.wrap_socket(conn, cert_reqs=ssl.CERT_REQUIRED)
-        else:
-            self.conn = conn
         self.ssl = use_ssl
         self.addr = addr
         self.port = port
         self.version = version
-        self.conn.settimeout(timeout)
-        self.conn.setblocking(1)  # will block
+        self.timeout = timeout
+        # what a failed TLS handshake raises, nothing until TLS is used
+        self._tls_errors = ()
+        self.ssl_context = ssl_context
+        self.cafile = cafile
+        self.certfile = certfile
+        self.keyfile = keyfile
+        if sasl_external is None:
+            sasl_external = certfile is not None
+        self.sasl_external = sasl_external
+        # the session of the last TLS connection, resumed by the next one
+        self._tls_session = None
+        self.tls_handshakes = 0
+        self.tls_resumed = 0
+        self.conn = self._make_socket()
         self.recv_bufsz = recv_bufsz
-        self.read = b""
         self.linesep = b"\r\n"
+        self.framer = LineBuffer(self.linesep, max_line_len)
+        # complete lines from the last recv() that haven't been handed out yet
+        self.pending = deque()
+        # an optional pbnj.flood.SendQueue that PRIVMSGs wait in
+        self.queue = send_queue
+        # commands on worker threads send too, one writer at a time
+        self._send_lock = threading.RLock()
+        # time.monotonic() of the last successful connect
+        self.connected_at = None
         self._connected = False
+        self.stats = ConnectionStats()
+        # the token and time.monotonic() of our PING waiting for its PONG
+        self._ping_token = None
+        self._ping_sent = None
+        # an optional pbnj.prefilter.Prefilter for lines not worth decoding
+        self.prefilter = None
+        self.threaded = threaded
+        self.max_inbound = max_inbound
+        self.overflow = overflow
+        # the pbnj.threaded.ThreadedIO while threaded recieve() is running, and
+        # the queue its writer thread sends everything from
+        self.io = None
+        self.outbox = None
+        # set by register()
+        self.nick = None
+        # the nick!user@host servers put in front of our messages, which
+        # counts against the length of every line, see _budget()
+        self.source = None
+        # the most bytes of text to send in one PRIVMSG, None for as many as fit
+        self.max_msg_len = None
+        self.recorder = recorder
+
+    def _make_socket(self):
+        conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.ssl or self.port == 6697:
+            # ssl takes a while to import, so only bots using it pay for that
+            from pbnj import tls
+
+            self._tls_errors = tls.ssl.SSLError
+            context = self.ssl_context or tls.context(
+                self.cafile, self.certfile, self.keyfile
+            )
+            conn = context.wrap_socket(
+                conn, server_hostname=self.addr, session=self._tls_session
+            )
+        conn.settimeout(self.timeout)
+        conn.setblocking(1)  # will block
+        return conn
+
+    def reset(self):
+        """close the connection if it's open and get a fresh socket and buffers,
+        so it can be opened again"""
+        if self._connected:
+            self._cleanup()
+        self.conn = self._make_socket()
+        self.framer = LineBuffer(self.linesep, self.framer.max_line_len)
+        self.pending.clear()
+        self._ping_token = None
 
     def __str__(self):
         return "pbnj.connection.Connection to {}:{}, ssl {}".format(
@@ -51,15 +176,27 @@ class Connection:
         self.send("QUIT :{0}/{1}".format(self.nick, self.version))
         log.warning("Closing socket and IRC connections")
         self._connected = False
+        # TLS 1.3 servers hand out sessions after the handshake, so by now
+        # there's one to resume next time
+        session = getattr(self.conn, "session", None)
+        if session is not None:
+            self._tls_session = session
         self.conn.close()
+        if self.recorder is not None:
+            self.recorder.flush()
 
     def _connect(self):
         """set up the socket connection and be ready for sending data"""
-        # TODO: add retry logic
+        # retrying is up to pbnj.supervisor.Supervisor
         try:
             self.conn.connect((self.addr, self.port))
             self._connected = True
-        except ssl.SSLError:
+            self.connected_at = time.monotonic()
+            if self._tls_errors:
+                self.tls_handshakes += 1
+                if self.conn.session_reused:
+                    self.tls_resumed += 1
+        except self._tls_errors:
             log.fatal("Failed to verify the connection to the server via SSL")
             raise
 
@@ -68,49 +205,215 @@ class Connection:
 
     def _recv(self):
         """recieve only one line from the socket"""
-        while self.linesep not in self.read:
-            self.read += self.conn.recv(self.recv_bufsz)
-        format_msg = lambda x: (str(x[0], "utf-8"), x[1])
-        message, read = format_msg(self.read.split(self.linesep, 1))
+        return self._decode(self._recv_line())
+
+    def _recv_line(self):
+        """recieve only one line from the socket, as bytes"""
+        if self.queue is not None and self.queue.depth:
+            self.flush()
+        while not self.pending:
+            data = self._recv_or_flush()
+            if not data:
+                log.warning("Server closed the connection")
+                raise ConnectionException("Connection closed")
+            lines = self.framer.feed(data)
+            self.stats.received(len(data), len(lines))
+            if self.recorder is not None:
+                self.recorder.received(lines)
+            self.pending.extend(lines)
+        return self.pending.popleft()
+
+    def _recv_or_flush(self):
+        """read from the socket, but if there are queued lines wake up in time to
+        send them while we wait"""
+        while self.queue is not None and self.queue.depth:
+            # a timeout of 0 would make recv() raise BlockingIOError instead
+            self.conn.settimeout(max(self.queue.wait_time(), 0.001))
+            try:
+                return self.conn.recv(self.recv_bufsz)
+            except socket.timeout:
+                self.flush()
+            finally:
+                self.conn.settimeout(None)
+        return self.conn.recv(self.recv_bufsz)
+
+    def _decode(self, line):
+        """turn one line of bytes off the wire into a message string, raising
+        ConnectionException if the server is telling us to go away"""
+        message = str(line, "utf-8")
         if "\x01" in message:
             message = message.replace("\x01", "")
-        log.debug("RECV {0}".format(message))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("RECV %s", message)
         if not message:
             log.warning("Got a null message from server")
             raise ConnectionException("Null message")
         elif self._is_termination_message(message):
             log.warning("Got a termination message from server")
             raise ConnectionException("Got a termination message")
-        else:
-            self.read = read
-            return message
+        return message
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    def poll(self):
+        """read whatever the socket has for us with a single recv and return the
+        complete messages, replying to PINGs on the way. For use once a selector
+        says the socket is readable. If the server hangs up the connection is
+        cleaned up and the messages before the goodbye are returned"""
+        messages = []
+        try:
+            data = self.conn.recv(self.recv_bufsz)
+            # TLS sockets can hold decrypted data the selector doesn't know about
+            while data and getattr(self.conn, "pending", None) and self.conn.pending():
+                data += self.conn.recv(self.recv_bufsz)
+            if not data:
+                log.warning("Server closed the connection")
+                raise ConnectionException("Connection closed")
+            lines = self.framer.feed(data)
+            self.stats.received(len(data), len(lines))
+            if self.recorder is not None:
+                self.recorder.received(lines)
+            for line in lines:
+                if not self._wanted(line):
+                    continue
+                message = self._decode(line)
+                if self._ping_token is None or not self._our_pong(message):
+                    messages.append(message)
+        except (ConnectionException, OSError) as e:
+            log.warning("Lost connection to %s: %s", self.addr, e)
+            self._cleanup()
+        return messages
+
+    def _wanted(self, line):
+        """look at a line before it's decoded: PINGs are answered straight from
+        the bytes, and the prefilter gets to throw away lines nobody wants.
+        Return whether the line should be decoded and handed on"""
+        if line.startswith(b"PING"):
+            self._pong(line)
+            return False
+        return self.prefilter is None or not self.prefilter.drop(line)
+
+    def _pong(self, line):
+        """answer a PING, and ping the server back to time the round trip. A
+        PING of ours that's had no PONG for timeout seconds is given up on"""
+        log.debug("Replying with PONG...")
+        self._write(b"PONG" + line[4:] + b"\r\n")
+        if (
+            self._ping_token is None
+            or time.monotonic() - self._ping_sent > self.timeout
+        ):
+            self.ping_server()
+
+    def ping_server(self):
+        """send the server a PING, its PONG sets stats.ping_rtt"""
+        self._ping_sent = time.monotonic()
+        self._ping_token = "pbnj-{:.0f}".format(self._ping_sent * 1000)
+        return self.send("PING :" + self._ping_token)
+
+    def _our_pong(self, message):
+        """whether a message is the PONG to our PING, noting the round trip"""
+        if not message.endswith(self._ping_token) or "PONG" not in message:
+            return False
+        self.stats.ping_rtt = time.monotonic() - self._ping_sent
+        self._ping_token = None
+        return True
 
     def recieve(self):
         """recieve lines of text from our socket and return them as a Generator
         """
+        if self.threaded:
+            from pbnj.threaded import ThreadedIO
+
+            self.io = ThreadedIO(self, self.max_inbound, self.overflow)
+            yield from self.io.messages()
+            return
         connected = True
+        # this is _wanted() inlined, it runs for every line
+        prefilter = self.prefilter
+        drop = prefilter.drop if prefilter is not None else None
         while connected:
             try:
-                message = self._recv()
-                if message.startswith("PING"):
-                    log.debug("Replying with PONG...")
-                    self.send("PONG" + message[4:])
-                else:
+                line = self._recv_line()
+                if line.startswith(b"PING"):
+                    self._pong(line)
+                    continue
+                if drop is not None and drop(line):
+                    continue
+                message = self._decode(line)
+                if self._ping_token is None or not self._our_pong(message):
                     yield message
             except ConnectionException:
                 connected = False
         self._cleanup()
 
     def send(self, message):
-        """helper method to convert the string, tack on a \r\n and log it"""
+        """helper method to convert the string, tack on a \r\n and log it.
+        This never waits on the send queue, but still spends its tokens"""
+        return self._write(message.encode() + b"\r\n")
+
+    def _write(self, data):
+        """send one encoded line, \r\n and all, or hand it to the writer
+        thread"""
+        if self.outbox is not None:
+            self.outbox.put(data)
+            return True
+        return self._write_now(data)
+
+    def _write_now(self, data):
         try:
-            self.conn.send(message.encode() + b"\r\n")
-            log.info("SEND " + message)
+            with self._send_lock:
+                self.conn.send(data)
+                self.stats.sent(len(data))
+                if self.recorder is not None:
+                    self.recorder.sent(data)
+                if self.queue is not None:
+                    self.queue.bucket.force()
+            if log.isEnabledFor(logging.INFO):
+                log.info("SEND %s", data[:-2].decode("utf-8", "replace"))
             return True
         except Exception as e:
-            log.error("Hit an exception while trying to send {}".format(message))
+            log.error("Hit an exception while trying to send %r", data)
             return False
 
+    def enqueue(self, target, message):
+        """send a line through the send queue if there is one, or right away"""
+        if self.queue is None:
+            return self.send(message)
+        with self._send_lock:
+            if not self.queue.put(target, message):
+                return False
+            return self.flush()
+
+    def flush(self):
+        """write every queued line the flood budget allows in one go"""
+        if self.outbox is not None:
+            self.io.flush()
+            return True
+        if self.queue is None:
+            return True
+        return self._flush_now()
+
+    def _flush_now(self):
+        with self._send_lock:
+            lines = self.queue.take_ready()
+            if not lines:
+                return True
+            data = b"".join(line.encode() + b"\r\n" for line in lines)
+            try:
+                self.conn.sendall(data)
+                self.stats.sent(len(data), len(lines))
+                if self.recorder is not None:
+                    self.recorder.sent(data)
+            except Exception as e:
+                log.error("Hit an exception while trying to send %d lines", len(lines))
+                self.queue.lost(len(lines))
+                return False
+        if log.isEnabledFor(logging.INFO):
+            for line in lines:
+                log.info("SEND %s", line)
+        return True
+
     def part(self, channel):
         return self.send("PART {}".format(channel))
 
@@ -123,20 +426,165 @@ class Connection:
             )
             return False
 
+    def _budget(self, command, target):
+        """how many bytes of text fit in a command to target, once the server
+        has put our source in front of it"""
+        if self.source is not None:
+            source = len(self.source.encode())
+        else:
+            source = len((self.nick or "").encode()) + _SOURCE_ESTIMATE
+        # ":source COMMAND target :text\r\n"
+        overhead = source + len(command) + len(target.encode()) + 7
+        budget = MAX_LINE - overhead
+        if self.max_msg_len:
+            budget = min(budget, self.max_msg_len)
+        return budget
+
+    def _pieces(self, target, message):
+        """the PRIVMSGs it takes to send message to target"""
+        limit = self._budget("PRIVMSG", target)
+        # even if it's all four byte characters it fits
+        if len(message) * 4 <= limit and "\n" not in message and "\r" not in message:
+            return (message,)
+        return split_text(message, limit)
+
     def message(self, channel, message):
-        return self.send("PRIVMSG {0} :{1}".format(channel, message))
+        """send a PRIVMSG, split up into as many as it takes to fit"""
+        success = True
+        for piece in self._pieces(channel, message):
+            line = "PRIVMSG {0} :{1}".format(channel, piece)
+            success = self.enqueue(channel, line) and success
+        return success
+
+    def messages(self, channel, messages):
+        """send an iterable of messages to one target. With a send queue they're
+        all queued before flushing, so they can share a single write"""
+        if self.queue is None:
+            success = True
+            for message in messages:
+                success = success and self.message(channel, message)
+            return success
+        queued = True
+        for message in messages:
+            for piece in self._pieces(channel, message):
+                line = "PRIVMSG {0} :{1}".format(channel, piece)
+                with self._send_lock:
+                    queued = self.queue.put(channel, line) and queued
+        return self.flush() and queued
 
     def register(self, user, nick, hostname, realname=None):
         """send the needed info to the IRC server after connecting"""
         realname = user if not realname else realname
         self.nick = nick
         log.info(
-            "Registering on network {0} with ({1}/{2}/{3})".format(
-                self.addr, user, realname, hostname
-            )
+            "Registering on network %s with (%s/%s/%s)",
+            self.addr,
+            user,
+            realname,
+            hostname,
         )
+        if self.sasl_external:
+            self.send("CAP REQ :sasl")
         n = self.send("NICK {0}".format(nick))
-        return n and self.send("USER {0} {0} {2} :{1}".format(user, realname, hostname))
+        n = n and self.send("USER {0} {0} {2} :{1}".format(user, realname, hostname))
+        if self.sasl_external:
+            self._authenticate_external()
+        return n
+
+    def _authenticate_external(self):
+        """log in with SASL EXTERNAL, which is the client certificate we
+        presented. The server holds off registering us until CAP END, so we
+        wait for it here; other lines that arrive meanwhile are kept for
+        recieve() if the prefilter wants them. The SASL numerics are looked at
+        before the prefilter, which a bot only has keep the numerics it uses.
+        Return whether we're logged in"""
+        kept = []
+        logged_in = False
+        self.conn.settimeout(self.timeout)
+        try:
+            while True:
+                line = self._recv_line()
+                _, _, command, params = parse_line(self._decode(line))
+                if command == "CAP" and "NAK" in params:
+                    log.warning("%s doesn't do SASL", self.addr)
+                    break
+                elif command == "CAP" and "ACK" in params:
+                    self.send("AUTHENTICATE EXTERNAL")
+                elif command == "AUTHENTICATE" and params == ["+"]:
+                    self.send("AUTHENTICATE +")
+                elif command == "903":
+                    logged_in = True
+                    break
+                elif command in ("902", "904", "905", "906", "907"):
+                    log.warning("SASL EXTERNAL failed: %s", params[-1])
+                    break
+                elif self._wanted(line):
+                    kept.append(line)
+        except socket.timeout:
+            log.warning("%s didn't finish SASL in time", self.addr)
+        finally:
+            self.conn.settimeout(None)
+            self.pending.extendleft(reversed(kept))
+        self.send("CAP END")
+        return logged_in
+
+
+class LineBuffer:
+    """splits a stream of bytes into lines. Data is appended to a bytearray and
+    only the newly arrived bytes are searched for a line separator, so feeding
+    a large burst or a long line in small pieces stays linear. Lines longer
+    than max_line_len are thrown away rather than buffered without end"""
+
+    def __init__(self, linesep=b"\r\n", max_line_len=None):
+        self.linesep = linesep
+        self.max_line_len = max_line_len
+        self.dropped = 0
+        self._buf = bytearray()
+        # how far into _buf we have already looked for a separator
+        self._scanned = 0
+        # set while we skip the rest of a line that was too long
+        self._discarding = False
+
+    def __len__(self):
+        return len(self._buf)
+
+    def feed(self, data):
+        """add some bytes to the buffer, return a list of every line completed
+        by them (without the separator)"""
+        buf = self._buf
+        buf += data
+        sep_len = len(self.linesep)
+        limit = self.max_line_len
+        lines = []
+        start = 0
+        end = buf.find(self.linesep, max(self._scanned - sep_len + 1, 0))
+        if end < 0 and not (limit and len(buf) > limit):
+            # still in the middle of a line
+            self._scanned = len(buf)
+            return lines
+        with memoryview(buf) as view:
+            while end >= 0:
+                if self._discarding:
+                    self._discarding = False
+                elif limit and end - start > limit:
+                    self._drop()
+                else:
+                    lines.append(bytes(view[start:end]))
+                start = end + sep_len
+                end = buf.find(self.linesep, start)
+        del buf[:start]
+        if limit and len(buf) > limit:
+            # no separator in sight, stop holding on to this line
+            if not self._discarding:
+                self._drop()
+            self._discarding = True
+            del buf[: len(buf) - sep_len + 1]
+        self._scanned = len(buf)
+        return lines
+
+    def _drop(self):
+        self.dropped += 1
+        log.warning("Dropping a line longer than %d bytes", self.max_line_len)
 
 
 class ConnectionException(Exception):
@@ -0,0 +1,187 @@
+"""indexes the commands registered on a bot so an incoming message is only
+checked against the commands that could possibly match it"""
+import logging
+
+log = logging.getLogger("pbnj")
+
+# characters that stop a regex from being read as literal text
+_REGEX_META = frozenset(".^$*+?{}[]()|\\")
+# quantifiers which make the character before them optional
+_OPTIONAL = frozenset("*?{")
+
+
+def literal_prefix(pattern):
+    """return the literal text every match of a regex string has to start with,
+    or an empty string if we can't be sure. This is conservative: anything we
+    don't understand ends the prefix"""
+    if "|" in pattern:
+        # alternation means more than one possible start
+        return ""
+    i = 1 if pattern.startswith("^") else 0
+    prefix = []
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            escaped = pattern[i + 1 : i + 2]
+            if not escaped or escaped.isalnum():
+                # \d, \w, \b, backreferences... none of these are literal
+                break
+            char, step = escaped, 2
+        elif char in _REGEX_META:
+            break
+        else:
+            step = 1
+        if pattern[i + step : i + step + 1] in _OPTIONAL:
+            break
+        prefix.append(char)
+        i += step
+    return "".join(prefix)
+
+
+class CommandIndex:
+    """a dispatch table over a list of Commands. Commands subscribed to
+    message types (Command.on) are only candidates for those types, and every
+    other type is looked up in a dictionary. String filterspecs are grouped by
+    their literal prefix so one dictionary lookup per prefix length picks the
+    candidates for a PRIVMSG, while callable filterspecs without a
+    subscription are candidates for everything. Candidates come back in
+    registration order, so the first matching command still wins.
+
+    The index watches the length of the list it was given and rebuilds itself
+    when commands are added, call invalidate() after any other modification"""
+
+    def __init__(self, commands):
+        self.commands = commands
+        self._size = None
+
+    def invalidate(self):
+        self._size = None
+
+    def _rebuild(self):
+        # (position, command) pairs which have to be checked for every PRIVMSG
+        self._general = []
+        # commands for any type of message other than PRIVMSG
+        self._callables = []
+        # message type -> [(position, command), ...] subscribed to it
+        subscribed = {}
+        # prefix length -> {prefix: [(position, command), ...]}
+        by_length = {}
+        for position, command in enumerate(self.commands):
+            entry = (position, command)
+            if command.on is not None:
+                for kind in command.on:
+                    if kind != "PRIVMSG" or not isinstance(command.filterspec, str):
+                        subscribed.setdefault(kind, []).append(entry)
+                if "PRIVMSG" not in command.on:
+                    continue
+            elif callable(command.filterspec):
+                self._general.append(entry)
+                self._callables.append(entry)
+                continue
+            if not isinstance(command.filterspec, str):
+                continue
+            prefix = literal_prefix(command.filterspec)
+            if prefix:
+                table = by_length.setdefault(len(prefix), {})
+                table.setdefault(prefix, []).append(entry)
+            else:
+                self._general.append(entry)
+        self._general.extend(subscribed.pop("PRIVMSG", ()))
+        self._general.sort(key=lambda entry: entry[0])
+        # message type -> its candidates, in registration order
+        self._routes = {}
+        for kind, entries in subscribed.items():
+            entries = sorted(self._callables + entries, key=lambda entry: entry[0])
+            self._routes[kind] = [command for _, command in entries]
+        self._callables = [command for _, command in self._callables]
+        self._by_length = sorted(by_length.items())
+        self._size = len(self.commands)
+        log.debug(
+            "Indexed %d commands under %d prefix lengths",
+            self._size,
+            len(self._by_length),
+        )
+
+    def candidates(self, message):
+        """return the commands which may match this message, in the order
+        they were registered"""
+        if self._size != len(self.commands):
+            self._rebuild()
+        if message.type != "PRIVMSG":
+            # string filterspecs only ever match PRIVMSGs
+            return self._routes.get(message.type, self._callables)
+        text = message.message
+        found = None
+        for length, table in self._by_length:
+            if length > len(text):
+                break
+            hits = table.get(text[:length])
+            if hits:
+                found = hits if found is None else found + hits
+        if found is None:
+            return [command for _, command in self._general]
+        found = self._general + found
+        found.sort(key=lambda entry: entry[0])
+        return [command for _, command in found]
+
+
+class HelpIndex:
+    """what the help builtin has to say about a list of Commands: a dictionary
+    of them by name (the first registered wins, as it does when dispatching)
+    and their names laid out on as many lines as it takes. Lines are worked
+    out once for each width asked for and kept until commands are added, or
+    invalidate() is called after any other modification"""
+
+    # reserves room for the page numbers on every page
+    PAGE_HEADER = "Available commands ({}/{}): "
+
+    def __init__(self, commands):
+        self.commands = commands
+        self._size = None
+
+    def invalidate(self):
+        self._size = None
+
+    def _rebuild(self):
+        self._by_name = {}
+        for command in self.commands:
+            self._by_name.setdefault(command.name, command)
+        # width -> pages of names
+        self._pages = {}
+        self._size = len(self.commands)
+
+    def find(self, name):
+        """the command called name, or None"""
+        if self._size != len(self.commands):
+            self._rebuild()
+        return self._by_name.get(name)
+
+    def pages(self, width):
+        """every command name, on lines of at most width bytes with their
+        header. The list is shared, don't change it"""
+        if self._size != len(self.commands):
+            self._rebuild()
+        pages = self._pages.get(width)
+        if pages is None:
+            pages = self._pages[width] = self._paginate(width)
+        return pages
+
+    def _paginate(self, width):
+        everything = "Available commands: " + " ".join(self._by_name)
+        if len(everything.encode()) <= width:
+            return [everything]
+        room = max(1, width - len(self.PAGE_HEADER.format(999, 999).encode()))
+        lines, line, size = [], [], 0
+        for name in self._by_name:
+            length = len(name.encode())
+            if line and size + 1 + length > room:
+                lines.append(" ".join(line))
+                line, size = [], 0
+            size += length + (1 if line else 0)
+            line.append(name)
+        if line:
+            lines.append(" ".join(line))
+        return [
+            self.PAGE_HEADER.format(n, len(lines)) + text
+            for n, text in enumerate(lines, 1)
+        ]
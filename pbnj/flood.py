@@ -0,0 +1,123 @@
+"""flood control for outgoing messages. IRC servers kick clients which send
+faster than they allow, so replies are queued per target and let out by a
+token bucket"""
+import time
+import logging
+from collections import deque, OrderedDict
+
+log = logging.getLogger("pbnj")
+
+
+class TokenBucket:
+    """holds up to burst tokens, refilled at rate tokens per second"""
+
+    def __init__(self, rate=1.0, burst=5, clock=time.monotonic):
+        if rate <= 0 or burst < 1:
+            raise ValueError(
+                "TokenBucket needs a positive rate and a burst of at least 1"
+            )
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.stamp = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def available(self):
+        self._refill()
+        return self.tokens
+
+    def take(self, n=1):
+        """spend n tokens if we have them, return whether we did"""
+        self._refill()
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    def force(self, n=1):
+        """spend n tokens whether we have them or not, for lines which can't wait"""
+        self._refill()
+        self.tokens -= n
+
+    def wait_time(self, n=1):
+        """seconds until n tokens will be available"""
+        self._refill()
+        return max(0.0, (n - self.tokens) / self.rate)
+
+
+class SendQueue:
+    """outgoing lines waiting for the token bucket. Each target (channel or
+    nick) has its own queue and targets take turns, so one long reply doesn't
+    starve everyone else. Once max_depth lines are waiting new ones are
+    dropped"""
+
+    def __init__(self, rate=1.0, burst=5, max_depth=1000, clock=time.monotonic):
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.max_depth = max_depth
+        # target -> deque of lines, in the order targets get their next turn
+        self._queues = OrderedDict()
+        self.depth = 0
+        self.sent = 0
+        self.dropped = 0
+        self.delayed = 0
+
+    def __len__(self):
+        return self.depth
+
+    def put(self, target, line):
+        """queue a line for a target, return False if it had to be dropped"""
+        if self.depth >= self.max_depth:
+            self.dropped += 1
+            log.warning("Send queue is full, dropping a line for %s", target)
+            return False
+        if self.bucket.available() < self.depth + 1:
+            # everything ahead of it has to go first, it'll wait for a token
+            self.delayed += 1
+        lines = self._queues.get(target)
+        if lines is None:
+            lines = self._queues[target] = deque()
+        lines.append(line)
+        self.depth += 1
+        return True
+
+    def take_ready(self):
+        """pop every line the bucket has tokens for, one target at a time"""
+        ready = []
+        queues = self._queues
+        while queues and self.bucket.take():
+            target, lines = next(iter(queues.items()))
+            ready.append(lines.popleft())
+            if lines:
+                queues.move_to_end(target)
+            else:
+                del queues[target]
+        self.depth -= len(ready)
+        self.sent += len(ready)
+        return ready
+
+    def lost(self, n):
+        """n lines from take_ready() couldn't be written after all, count them
+        as dropped rather than sent. How much of a failed write got through
+        can't be known, so they aren't tried again"""
+        self.sent -= n
+        self.dropped += n
+
+    def wait_time(self):
+        """seconds until the next line can go out, None if nothing is waiting"""
+        if not self.depth:
+            return None
+        return self.bucket.wait_time()
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "targets": len(self._queues),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "delayed": self.delayed,
+        }
@@ -31,8 +31,10 @@ class ColorFormatter(logging.Formatter):
         self.color_enabled = color_enabled
 
     def format(self, record):
+        """color the whole formatted line. The record itself is left alone, so
+        %-style args keep working and other handlers see the original"""
+        formatted = logging.Formatter.format(self, record)
         level = record.levelname
         if self.color_enabled and level in Colors.level_map:
-            color_msg = Colors.level_map[level] + record.msg + Colors.reset
-            record.msg = color_msg
-        return logging.Formatter.format(self, record)
+            return Colors.level_map[level] + formatted + Colors.reset
+        return formatted
@@ -0,0 +1,335 @@
+"""counters and latency histograms for commands and connections, so you can
+tell which command is hot or slow. Read them with Metrics.snapshot(), the
+.stats builtin command or a PrometheusExporter"""
+import time
+import logging
+import threading
+from bisect import bisect_left
+
+log = logging.getLogger("pbnj")
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10)
+
+
+class Histogram:
+    """counts observations into fixed buckets, the way prometheus does"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # one more than there are buckets, for everything above the last bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        # commands on worker threads finish at the same time as the main loop
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def snapshot(self):
+        """count, sum and (upper bound, observations at or below it) pairs"""
+        with self._lock:
+            counts = list(self.counts)
+            total, buckets = 0, []
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                total += n
+                buckets.append((bound, total))
+            return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class CommandStats:
+    """what one Command has been up to. attempts counts the messages it was
+    tried against, hits the ones it matched, limited the ones of those
+    dropped by rate limits and rejected the ones a busy worker pool dropped"""
+
+    __slots__ = (
+        "attempts",
+        "hits",
+        "limited",
+        "rejected",
+        "errors",
+        "replies",
+        "reply_bytes",
+        "latency",
+    )
+
+    def __init__(self):
+        self.attempts = 0
+        self.hits = 0
+        self.limited = 0
+        self.rejected = 0
+        self.errors = 0
+        self.replies = 0
+        self.reply_bytes = 0
+        self.latency = Histogram()
+
+    def replied(self, reply):
+        self.replies += 1
+        self.reply_bytes += len(reply.encode())
+
+    def counted(self, replies):
+        """pass a generator's replies through, counting them on the way"""
+        for reply in replies:
+            self.replied(reply)
+            yield reply
+
+    def snapshot(self):
+        return {
+            "attempts": self.attempts,
+            "hits": self.hits,
+            "limited": self.limited,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "replies": self.replies,
+            "reply_bytes": self.reply_bytes,
+            "latency": self.latency.snapshot(),
+        }
+
+
+class ConnectionStats:
+    """traffic on one Connection. ping_rtt is the round trip of the last PING we
+    sent the server, None until one has come back"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started = clock()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lines_in = 0
+        self.lines_out = 0
+        self.ping_rtt = None
+
+    def received(self, nbytes, nlines):
+        self.bytes_in += nbytes
+        self.lines_in += nlines
+
+    def sent(self, nbytes, nlines=1):
+        self.bytes_out += nbytes
+        self.lines_out += nlines
+
+    def lines_per_sec(self):
+        """lines received per second since the connection was created"""
+        elapsed = self.clock() - self.started
+        return self.lines_in / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self):
+        return {
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "lines_in": self.lines_in,
+            "lines_out": self.lines_out,
+            "lines_per_sec": self.lines_per_sec(),
+            "ping_rtt": self.ping_rtt,
+        }
+
+
+class Metrics:
+    """the stats of a bot's commands and connections in one place. Anything
+    else with numbers to report (a Supervisor, say) can be added as a source:
+    a name and a function returning a dict of them"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.sources = {}
+
+    def add_source(self, name, stats):
+        self.sources[name] = stats
+
+    def _connection(self, conn):
+        stats = conn.stats.snapshot()
+        if conn.queue is not None:
+            for key, value in conn.queue.stats().items():
+                stats["queue_" + key] = value
+        if conn.prefilter is not None:
+            stats["prefiltered"] = conn.prefilter.dropped
+        if getattr(conn, "io", None) is not None:
+            stats.update(conn.io.stats())
+        if conn.tls_handshakes:
+            stats["tls_handshakes"] = conn.tls_handshakes
+            stats["tls_resumed"] = conn.tls_resumed
+        return stats
+
+    def snapshot(self):
+        """a dict of plain numbers, safe to keep or serialize"""
+        bot = self.bot
+        commands = {}
+        for c in bot.commands:
+            # names aren't unique (every lambda is <lambda>), later commands
+            # with the same one get their position among them added
+            name, n = c.name, 1
+            while name in commands:
+                n += 1
+                name = "{}#{}".format(c.name, n)
+            commands[name] = stats = c.stats.snapshot()
+            if c.cache is not None:
+                for key, value in c.cache.stats().items():
+                    stats["cache_" + key] = value
+        connections = {}
+        if bot.conn is not None:
+            connections["default"] = self._connection(bot.conn)
+        for name, network in bot.networks.items():
+            connections[name] = self._connection(network.conn)
+        sources = {name: stats() for name, stats in self.sources.items()}
+        if bot.workers is not None:
+            sources["workers"] = bot.workers.stats()
+        if bot.rate_limit is not None:
+            sources["rate_limit"] = bot.rate_limit.stats()
+        return {"commands": commands, "connections": connections, "sources": sources}
+
+
+# snapshot key -> (prometheus name, type, help)
+_COMMAND_METRICS = {
+    "attempts": ("match_attempts_total", "counter", "messages tried against"),
+    "hits": ("match_hits_total", "counter", "messages matched"),
+    "limited": ("rate_limited_total", "counter", "matches dropped by rate limits"),
+    "rejected": ("rejected_total", "counter", "calls dropped by a busy pool"),
+    "errors": ("errors_total", "counter", "calls which raised an exception"),
+    "replies": ("replies_total", "counter", "lines sent back"),
+    "reply_bytes": ("reply_bytes_total", "counter", "bytes sent back"),
+    "cache_hits": ("cache_hits_total", "counter", "replies served from the cache"),
+    "cache_misses": ("cache_misses_total", "counter", "calls made for the cache"),
+    "cache_coalesced": ("cache_coalesced_total", "counter", "calls saved by waiting"),
+    "cache_evictions": ("cache_evictions_total", "counter", "replies evicted"),
+    "cache_size": ("cache_entries", "gauge", "replies in the cache"),
+}
+_CONNECTION_METRICS = {
+    "bytes_in": ("received_bytes_total", "counter", "bytes read from the server"),
+    "bytes_out": ("sent_bytes_total", "counter", "bytes sent to the server"),
+    "lines_in": ("received_lines_total", "counter", "lines read from the server"),
+    "lines_out": ("sent_lines_total", "counter", "lines sent to the server"),
+    "lines_per_sec": ("received_lines_per_second", "gauge", "average line rate"),
+    "ping_rtt": ("ping_rtt_seconds", "gauge", "round trip of the last PING"),
+    "prefiltered": ("prefiltered_lines_total", "counter", "lines nobody wanted"),
+    "queue_depth": ("send_queue_lines", "gauge", "lines waiting to be sent"),
+    "inbound_depth": ("inbound_queue_lines", "gauge", "lines waiting for dispatch"),
+    "inbound_high_water": ("inbound_queue_max_lines", "gauge", "most lines waiting"),
+    "inbound_dropped": ("inbound_dropped_total", "counter", "PRIVMSGs dropped"),
+    "inbound_blocked": ("inbound_blocked_total", "counter", "reader waits"),
+    "outbound_depth": ("outbound_queue_lines", "gauge", "lines waiting to write"),
+    "tls_handshakes": ("tls_handshakes_total", "counter", "TLS handshakes made"),
+    "tls_resumed": ("tls_resumed_total", "counter", "TLS sessions resumed"),
+}
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+def _family(lines, name, kind, doc, samples):
+    """add one metric family, samples being (labels, value) pairs"""
+    if not samples:
+        return
+    lines.append("# HELP {} {}".format(name, doc))
+    lines.append("# TYPE {} {}".format(name, kind))
+    for labels, value in samples:
+        lines.append("{}{} {}".format(name, labels, _number(value)))
+
+
+def render_prometheus(snapshot):
+    """turn a Metrics.snapshot() into the prometheus text exposition format"""
+    lines = []
+    commands = snapshot["commands"]
+    for key, (name, kind, doc) in _COMMAND_METRICS.items():
+        samples = [
+            ('{{command="{}"}}'.format(_label(c)), stats[key])
+            for c, stats in commands.items()
+            if key in stats
+        ]
+        _family(lines, "pbnj_command_" + name, kind, doc, samples)
+    if commands:
+        name = "pbnj_command_latency_seconds"
+        lines.append("# HELP {} time spent calling and replying".format(name))
+        lines.append("# TYPE {} histogram".format(name))
+        for c, stats in commands.items():
+            label, latency = _label(c), stats["latency"]
+            for bound, n in latency["buckets"]:
+                lines.append(
+                    '{}_bucket{{command="{}",le="{}"}} {}'.format(
+                        name, label, _number(bound), n
+                    )
+                )
+            lines.append(
+                '{}_sum{{command="{}"}} {!r}'.format(name, label, latency["sum"])
+            )
+            lines.append(
+                '{}_count{{command="{}"}} {}'.format(name, label, latency["count"])
+            )
+    connections = snapshot["connections"]
+    keys = {key for stats in connections.values() for key in stats}
+    for key in sorted(keys):
+        name, kind, doc = _CONNECTION_METRICS.get(key, (key, "gauge", key))
+        samples = [
+            ('{{network="{}"}}'.format(_label(n)), stats[key])
+            for n, stats in connections.items()
+            if stats.get(key) is not None
+        ]
+        _family(lines, "pbnj_connection_" + name, kind, doc, samples)
+    for source, stats in snapshot["sources"].items():
+        for key, value in stats.items():
+            # only numbers make sense here, drop things like last_error
+            if isinstance(value, (int, float)):
+                name = "pbnj_{}_{}".format(source, key)
+                doc = "{} {}".format(source, key)
+                _family(lines, name, "gauge", doc, [("", value)])
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusExporter:
+    """serves a bot's metrics for prometheus to scrape, from a daemon thread.
+    Listens on localhost unless told otherwise; port 0 picks a free one"""
+
+    def __init__(self, metrics, port, addr="127.0.0.1"):
+        self.metrics = metrics
+        self.addr = addr
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = render_prometheus(metrics.snapshot()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug("metrics: " + format, *args)
+
+        self.server = ThreadingHTTPServer((self.addr, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="pbnj-metrics", daemon=True
+        )
+        self.thread.start()
+        log.info("Serving metrics on http://%s:%d/metrics", self.addr, self.port)
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
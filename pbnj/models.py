@@ -1,26 +1,111 @@
 import re
+import inspect
 import logging
+from operator import attrgetter
+
+from pbnj.metrics import CommandStats
+from pbnj.cache import ResponseCache
+from pbnj.ratelimit import limiter
 
 log = logging.getLogger("pbnj")
 
-attr_filter = lambda x: {
-    a: getattr(x, a) for a in dir(x) if not "__" in a and not callable(getattr(x, a))
-}
+
+# the fields which decide whether two messages are the same
+_message_key = attrgetter(
+    "raw_msg", "type", "nick", "realname", "host", "dest", "message", "network"
+)
+
+# how IRCv3 escapes special characters in tag values
+_TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+def parse_line(line):
+    """split a raw IRC line into (tags, prefix, command, params) following
+    RFC 1459/2812 with IRCv3 message tags. Each piece is peeled off the front of
+    the line once. tags is the raw tag string without the leading @ (or None),
+    prefix is None if the line has none, and the trailing parameter is the last
+    item of params"""
+    tags, prefix, command, rest = _peel(line)
+    return tags, prefix, command, _split_params(rest)
+
+
+def _peel(line):
+    """the tags, prefix and command off the front of a line, and the
+    unsplit parameters after them"""
+    tags = prefix = None
+    if line.startswith("@"):
+        tags, _, line = line[1:].partition(" ")
+        line = line.lstrip(" ")
+    if line.startswith(":"):
+        prefix, _, line = line[1:].partition(" ")
+        line = line.lstrip(" ")
+    command, _, rest = line.partition(" ")
+    return tags, prefix, command, rest.lstrip(" ")
+
+
+def _split_params(rest):
+    """the parameters after the command as a list"""
+    if rest.startswith(":"):
+        return [rest[1:]]
+    # a parameter starting with : is the trailing one, and may contain spaces
+    middle, has_trailing, trailing = rest.partition(" :")
+    params = middle.split()
+    if has_trailing:
+        params.append(trailing)
+    return params
+
+
+def parse_tags(tags):
+    """turn a raw IRCv3 tag string into a dictionary, unescaping values. Tags
+    without a value map to an empty string"""
+    parsed = {}
+    if not tags:
+        return parsed
+    for item in tags.split(";"):
+        key, _, value = item.partition("=")
+        if "\\" in value:
+            unescaped = []
+            chars = iter(value)
+            for char in chars:
+                if char == "\\":
+                    char = _TAG_ESCAPES.get(next(chars, ""), "")
+                unescaped.append(char)
+            value = "".join(unescaped)
+        if key:
+            parsed[key] = value
+    return parsed
 
 
 class Message:
     """object to get passed between Bot class and its command methods. Separates
-    the logic of parsing a string from the socket into more actionable objects
+    the logic of parsing a string from the socket into more actionable objects.
+    Messages have no per-instance __dict__, and the fields which are only
+    sometimes needed (params, args, reply_dest, tags) are worked out on first
+    access.
+    network is the name of the network the message came from, None for the
+    bot's own connection
     """
 
-    def __init__(self, raw_msg):
+    __slots__ = (
+        "raw_msg",
+        "prefix",
+        "type",
+        "nick",
+        "realname",
+        "host",
+        "dest",
+        "message",
+        "network",
+        "_tags",
+        "_rest",
+        "_params",
+        "_args",
+        "_reply_dest",
+    )
+
+    def __init__(self, raw_msg, network=None):
         self.raw_msg = raw_msg
-        self.message = None
-        # These three are filled out by the parser unless the message misses our regex
-        # Having a default None value is useful to see whether we can perform operations that use the nick
-        self.nick = None
-        self.realname = None
-        self.host = None
+        self.network = network
         self.parse()
 
     def __str__(self):
@@ -30,52 +115,102 @@ class Message:
         return self.raw_msg
 
     def __eq__(self, other):
-        self_attr = attr_filter(self)
-        for item, val in self_attr.items():
-            if val != getattr(other, item, False):
-                return False
-        return True
+        if not isinstance(other, Message):
+            return NotImplemented
+        return _message_key(self) == _message_key(other)
+
+    def __hash__(self):
+        return hash(self.raw_msg)
+
+    @property
+    def tags(self):
+        """the IRCv3 message tags as a dictionary"""
+        if not isinstance(self._tags, dict):
+            self._tags = parse_tags(self._tags)
+        return self._tags
+
+    @property
+    def params(self):
+        """the parameters after the command, with the trailing one last"""
+        if self._params is None:
+            self._params = _split_params(self._rest)
+        return self._params
+
+    @property
+    def args(self):
+        """everything but the first word of the message"""
+        if self._args is None:
+            self._args = self.message.split()[1:] if self.message else []
+        return self._args
+
+    @property
+    def reply_dest(self):
+        """where replies should go: the channel it came from, or the sender of a
+        private message"""
+        if self._reply_dest is None:
+            dest = self.dest
+            self._reply_dest = dest if dest and "#" in dest else self.nick
+        return self._reply_dest
 
     def parse(self):
         """ Parse the message
         TODO handle all the numeric ones
-        TODO remove dependence on regular expressions
         """
-        sp = self.raw_msg.split()
-        host = sp[0]
-        if "@" in host:
-            hostmask = host[1:] if host.startswith(":") else host
-            re_matches = re.match(
-                "^([a-zA-Z0-9_\-\|`\[\]]+)!~?([a-zA-Z0-9\ _]+)@(.*)", hostmask
-            )
-            try:
-                re_groups = re_matches.groups()
-                self.nick = re_groups[0]
-                self.realname = re_groups[1]
-                self.host = re_groups[2]
-            except Exception as e:
-                log.error("The regex fucked up! On this input for the hostmask")
-                log.error(hostmask)
-                raise
-            self.type = sp[1]
+        line = self.raw_msg
+        self._params = self.dest = self.message = self._args = None
+        self._reply_dest = self._tags = None
+        parts = line.split(" ", 2) if line[:1] == ":" else ()
+        if len(parts) == 3 and parts[1]:
+            # nearly every line is just a prefix, a command and parameters,
+            # which one split takes apart
+            prefix, command, self._rest = parts
+            prefix = prefix[1:]
+        else:
+            self._tags, prefix, command, self._rest = _peel(line)
+        self.prefix = prefix
+        # nick, realname and host are filled out when the message has a hostmask
+        # Having a default None value is useful to see whether we can perform operations that use the nick
+        if prefix is not None and ("!" in prefix or "@" in prefix):
+            # nick!user@host, though both the user and host are optional
+            rest, _, host = prefix.partition("@")
+            nick, _, user = rest.partition("!")
+            self.nick = nick
+            self.realname = user[1:] if user.startswith("~") else user or None
+            self.host = host or None
         else:
             # this is a server directly sending us something
-            self.host = host
-            code = sp[1]
-            self.type = int(code) if code.isdigit() else code
-        if self.type == "PRIVMSG":
-            self.dest = sp[2]
-            if "#" in self.dest:
-                self.reply_dest = self.dest
+            self.nick = self.realname = None
+            self.host = prefix
+        if command.isdecimal():
+            self.type = int(command)
+            return
+        self.type = command
+        if command == "PRIVMSG":
+            dest, _, msg = self._rest.partition(" :")
+            if dest and not dest.startswith(":") and " " not in dest:
+                self.dest = dest
             else:
-                self.reply_dest = self.nick
-            m = " ".join(sp[3:])
-            msg = m[1:] if m.startswith(":") else m
+                params = self.params
+                self.dest = params[0] if params else None
+                msg = params[1] if len(params) > 1 else ""
             if msg.startswith("ACTION"):
                 self.type = "ACTION"
                 msg = msg[7:]  # actions are privmsgs, why
             self.message = msg
-            self.args = msg.split()[1:]
+
+
+def _message_types(types):
+    """normalise the message types a command subscribes to: commands are
+    uppercase strings and numerics are ints, like Message.type"""
+    if types is None:
+        return None
+    if isinstance(types, (str, int)):
+        types = [types]
+    normalised = set()
+    for kind in types:
+        kind = str(kind).upper()
+        normalised.add(int(kind) if kind.isdecimal() else kind)
+    return frozenset(normalised)
 
 
 class _builtin_command:
@@ -101,17 +236,65 @@ class _builtin_command:
 class Command:
     """holds the message filtering specification of a command registered with
     the bot (a callable or string regex) as well as the callback to hit if a
-    message is matched"""
+    message is matched.
+    executor can be "thread" or "process" to run the callback on a worker pool
+    instead of the receive loop, with at most max_concurrency calls waiting or
+    running at once and replies after timeout seconds thrown away.
+    cache_ttl keeps replies for that many seconds (see pbnj.cache), for up to
+    cache_size questions told apart by cache_key(message).
+    on subscribes the command to a list of message types, like ["JOIN", 366],
+    and it's never offered anything else. The filterspec can then be None to
+    take every one of them, and a string filterspec is matched against the last
+    parameter of messages other than PRIVMSGs (the channel of a JOIN).
+    rate_limit is a (calls, seconds) pair capping how often the command runs
+    at all, user_rate_limit the same for each nick and host, see
+    pbnj.ratelimit. Messages over either are dropped before the callback"""
 
-    def __init__(self, filterspec, callback):
-        if not (callable(filterspec) or isinstance(filterspec, str)):
+    def __init__(
+        self,
+        filterspec,
+        callback,
+        executor=None,
+        max_concurrency=None,
+        timeout=None,
+        cache_ttl=None,
+        cache_size=128,
+        cache_key=None,
+        on=None,
+        rate_limit=None,
+        user_rate_limit=None,
+    ):
+        self.on = _message_types(on)
+        if filterspec is None and self.on is None:
+            raise ValueError("a Command without a filterspec needs to subscribe to on")
+        if not (
+            filterspec is None or callable(filterspec) or isinstance(filterspec, str)
+        ):
             raise ValueError(
                 "filterspec arg for Command classes must be callable or a string (valid regex)!"
             )
+        if executor not in (None, "thread", "process"):
+            raise ValueError('executor must be None, "thread" or "process"')
+        if cache_ttl:
+            if inspect.iscoroutinefunction(callback) or inspect.isasyncgenfunction(
+                callback
+            ):
+                raise ValueError("only plain functions and generators can be cached")
+        self.executor = executor
+        self.cache = None
+        if cache_ttl:
+            self.cache = ResponseCache(cache_ttl, cache_size, cache_key)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.limiter = limiter(rate_limit)
+        self.user_limiter = limiter(user_rate_limit)
         self.filterspec = filterspec
+        # compile string filterspecs once rather than on every message
+        self._regex = re.compile(filterspec) if isinstance(filterspec, str) else None
         self.callback = callback
         self.name = callback.__name__
         self.__doc__ = callback.__doc__
+        self.stats = CommandStats()
 
     def __str__(self):
         return self.__doc__ or "This triggers it: {}".format(self.filterspec)
@@ -120,6 +303,8 @@ class Command:
         return self.name
 
     def __call__(self, *args):
+        if self.cache is not None:
+            return self.cache.call(self.callback, *args)
         return self.callback(*args)
 
     def __eq__(self, other):
@@ -133,15 +318,20 @@ class Command:
     def match(self, message):
         """try to match an incoming message (quickly) return something falsey if
         not"""
+        if self.on is not None and message.type not in self.on:
+            return None
+        if self.filterspec is None:
+            return True
         if callable(self.filterspec):
             return self.filterspec(message)
         else:
             """we only support the naive regex format for privmsg types"""
             if message.type == "PRIVMSG":
-                log.debug(
-                    "Trying to match {} with {}".format(
-                        message.message, self.filterspec
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug(
+                        "Trying to match %s with %s", message.message, self.filterspec
                     )
-                )
-                return re.match(self.filterspec, message.message)
+                return self._regex.match(message.message)
+            if self.on is not None:
+                return self._regex.match(message.params[-1] if message.params else "")
             return None
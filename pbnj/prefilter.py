@@ -0,0 +1,65 @@
+"""throws away lines nobody is going to look at before they're decoded and
+parsed into Messages. Busy channels are mostly chatter a bot ignores, so the
+cheaper a line can be rejected the better"""
+import re
+import logging
+
+log = logging.getLogger("pbnj")
+
+
+def _alternation(words):
+    return b"|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+
+class Prefilter:
+    """decides from the raw bytes of a line whether it's worth decoding.
+    PRIVMSGs and NOTICEs from ignored nicks or hosts are dropped (their JOINs,
+    PARTs and so on still go through, so the channel state stays right), as
+    are numerics which aren't in keep_numerics, unless it's None. Hosts
+    starting with *. match every host under them.
+    Everything is compiled into one regular expression, so checking a line is
+    a single match() however many nicks are ignored"""
+
+    def __init__(self, nicks=(), hosts=(), keep_numerics=None):
+        self.nicks = frozenset(nick.encode() for nick in nicks)
+        self.hosts = frozenset(
+            host.lower().encode() for host in hosts if not host.startswith("*.")
+        )
+        # the "example.com" of "*.example.com"
+        self.domains = frozenset(
+            host[2:].lower().encode() for host in hosts if host.startswith("*.")
+        )
+        self.numerics = None
+        if keep_numerics is not None:
+            self.numerics = frozenset(b"%03d" % int(n) for n in keep_numerics)
+        self.dropped = 0
+        self._match = self._compile()
+
+    def _compile(self):
+        silenced = b" +(?:PRIVMSG|NOTICE) "
+        branches = []
+        if self.nicks:
+            branches.append(
+                b"(?:" + _alternation(self.nicks) + b")(?:[!@][^ ]*)?" + silenced
+            )
+        if self.hosts:
+            hosts = _alternation(self.hosts)
+            branches.append(b"[^ @]*@(?i:" + hosts + b")" + silenced)
+        if self.domains:
+            domains = _alternation(self.domains)
+            branches.append(b"[^ @]*@[^ ]*\\.(?i:" + domains + b")" + silenced)
+        if self.numerics is not None:
+            keep = _alternation(self.numerics) or b"(?!)"
+            branches.append(b"[^ ]* +(?!(?:" + keep + b")(?: |$))[0-9]{3}(?: |$)")
+        if not branches:
+            return None
+        # the line may start with IRCv3 tags, then it has to have a prefix
+        pattern = b"(?:@[^ ]* +)?:(?:" + b"|".join(branches) + b")"
+        return re.compile(pattern).match
+
+    def drop(self, line):
+        """whether a line (without its \\r\\n) can be thrown away"""
+        if self._match is not None and self._match(line):
+            self.dropped += 1
+            return True
+        return False
@@ -0,0 +1,94 @@
+"""rate limits on who can make the bot do things, so one user spamming a
+command can't run up work for it (or the APIs behind it) and eat into the
+flood budget everyone else's replies share"""
+import time
+import logging
+from collections import OrderedDict
+
+log = logging.getLogger("pbnj")
+
+
+class RateLimiter:
+    """lets each key through at most limit times per window seconds. Counts
+    are kept for the current fixed window and the one before it, and the
+    previous one is weighted by how much of it still overlaps the sliding
+    window ending now, so every key costs the same few numbers however busy it
+    is. Keys idle for two windows have nothing left to count and are evicted,
+    as is the longest idle one once there are max_keys"""
+
+    def __init__(self, limit, window=60.0, max_keys=10000, clock=time.monotonic):
+        if limit < 1 or window <= 0:
+            raise ValueError("RateLimiter needs a limit of at least 1 and a window")
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.clock = clock
+        # key -> [start of its current window, count in it, count in the last
+        # one, when it was last seen], longest idle first
+        self._keys = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def allow(self, key, count=True):
+        """count a hit for key and return whether it's under the limit. Hits
+        over the limit aren't counted, so a key that keeps trying still gets
+        let through again as its earlier hits slide out of the window. With
+        count=False it only checks, so several limits can all be asked before
+        any of them is charged"""
+        now = self.clock()
+        window = self.window
+        self._evict(now - 2 * window, self.max_keys)
+        entry = self._keys.get(key)
+        if entry is None:
+            if not count:
+                return True
+            self._evict(now - 2 * window, self.max_keys - 1)
+            entry = self._keys[key] = [now, 0, 0, now]
+        else:
+            self._keys.move_to_end(key)
+            entry[3] = now
+            elapsed = now - entry[0]
+            if elapsed >= 2 * window:
+                entry[0], entry[1], entry[2] = now, 0, 0
+            elif elapsed >= window:
+                entry[0], entry[1], entry[2] = entry[0] + window, 0, entry[1]
+        overlap = (window - (now - entry[0])) / window
+        if entry[2] * overlap + entry[1] + 1 > self.limit:
+            self.limited += 1
+            return False
+        if not count:
+            return True
+        entry[1] += 1
+        self.allowed += 1
+        return True
+
+    def _evict(self, idle, room):
+        """drop keys last seen at or before idle, and the longest idle ones
+        until there are at most room"""
+        keys = self._keys
+        while keys:
+            entry = next(iter(keys.values()))
+            if entry[3] > idle and len(keys) <= room:
+                break
+            keys.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self):
+        return {
+            "keys": len(self._keys),
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "evicted": self.evicted,
+        }
+
+
+def limiter(spec):
+    """a RateLimiter from a (limit, window) pair, or None for no limit"""
+    if spec is None or isinstance(spec, RateLimiter):
+        return spec
+    limit, window = spec
+    return RateLimiter(limit, window)
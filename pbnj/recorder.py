@@ -0,0 +1,182 @@
+"""keeps every line a connection receives and sends, so what happened can be
+looked at (and played back through a bot) after the fact. A recording is a
+plain text file with one line per IRC line:
+
+    <microseconds since the recording started> <"<" received or ">" sent> <line>
+
+Each file starts with a "#" header giving the wall clock time and the offset
+it starts at; recording again to the same path appends another one, and its
+times carry on from the end of the last. Once the file passes max_bytes it's
+rotated like a log file, to path.1, path.2 and so on, and those can be
+gzipped in the background. See pbnj.replay for playing one back"""
+import os
+import time
+import gzip
+import logging
+import threading
+
+log = logging.getLogger("pbnj")
+
+RECEIVED = b"<"
+SENT = b">"
+
+
+class Recorder:
+    """appends lines to a recording at path. Writes are buffered and flushed
+    at least every flush_interval seconds, and on close(). At most backups
+    rotated files are kept, gzipped if compress is set. The bot closes it
+    whenever it stops, and a line after that opens the file again, so a
+    supervised bot which reconnects carries on recording"""
+
+    def __init__(
+        self,
+        path,
+        max_bytes=64 * 1024 * 1024,
+        backups=5,
+        compress=False,
+        flush_interval=1.0,
+        clock=time.monotonic,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.started = clock()
+        self.lines = 0
+        self.rotations = 0
+        self._lock = threading.Lock()
+        self._file = None
+        # gzips the last file rotated out
+        self._compressing = None
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+        self._flushed = self.clock()
+        header = "# pbnj recording {} offset {:.0f}\n".format(
+            time.strftime("%Y-%m-%dT%H:%M:%S%z"), (self._flushed - self.started) * 1e6
+        )
+        self._write(header.encode())
+
+    def _write(self, data):
+        self._file.write(data)
+        self._size += len(data)
+
+    def received(self, lines):
+        """note a batch of lines (without their \\r\\n) that just arrived"""
+        self._record(RECEIVED, lines)
+
+    def sent(self, data):
+        """note what was just written to the socket, \\r\\n and all"""
+        self._record(SENT, data.split(b"\r\n")[:-1])
+
+    def _record(self, direction, lines):
+        if not lines:
+            return
+        now = self.clock()
+        stamp = b"%d " % ((now - self.started) * 1e6) + direction + b" "
+        data = b"".join([stamp + line + b"\n" for line in lines])
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._write(data)
+            self.lines += len(lines)
+            if self._size >= self.max_bytes:
+                self._rotate()
+            elif now - self._flushed >= self.flush_interval:
+                self._file.flush()
+                self._flushed = now
+
+    def _name(self, n):
+        name = "{}.{}".format(self.path, n)
+        return name + ".gz" if self.compress else name
+
+    def _rotate(self):
+        self._file.close()
+        if self._compressing is not None:
+            self._compressing.join()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(self._name(n)):
+                os.replace(self._name(n), self._name(n + 1))
+        if self.backups:
+            rotated = "{}.1".format(self.path)
+            os.replace(self.path, rotated)
+            if self.compress:
+                # gzipping a whole file takes a while, don't hold up the bot
+                self._compressing = threading.Thread(
+                    target=_gzip, args=(rotated,), name="pbnj-recorder", daemon=True
+                )
+                self._compressing.start()
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+        self._open()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._flushed = self.clock()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._compressing is not None:
+                self._compressing.join()
+
+    def stats(self):
+        return {"lines": self.lines, "rotations": self.rotations}
+
+
+def _gzip(path):
+    try:
+        with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+            while True:
+                chunk = src.read(1024 * 1024)
+                if not chunk:
+                    break
+                dst.write(chunk)
+        os.remove(path)
+    except OSError:
+        log.exception("Couldn't compress %s", path)
+
+
+def recording_files(path):
+    """the files of a recording, oldest first: the rotated ones, then path"""
+    files = []
+    n = 1
+    while True:
+        for name in ("{}.{}".format(path, n), "{}.{}.gz".format(path, n)):
+            if os.path.exists(name):
+                files.append(name)
+                break
+        else:
+            break
+        n += 1
+    files.reverse()
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def records(path):
+    """(seconds since the recording started, direction, line) for every line
+    of a recording, rotated files and all. direction is RECEIVED or SENT"""
+    # a recorder started again begins at 0, so its times go after the last
+    base = last = 0
+    for name in recording_files(path):
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(name, "rb") as f:
+            for record in f:
+                if record.startswith(b"#"):
+                    if int(record.rsplit(b" ", 1)[1]) + base < last:
+                        base = last
+                    continue
+                stamp, direction, line = record.rstrip(b"\n").split(b" ", 2)
+                last = int(stamp) + base
+                yield last / 1e6, direction, line
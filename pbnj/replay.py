@@ -0,0 +1,153 @@
+"""plays a recording made by pbnj.recorder.Recorder back through a Bot without
+a server: the lines the bot received are handed to it again, either at the
+pace they first arrived (or some multiple of it) or as fast as the bot can
+take them, and whatever it sends is kept instead of going anywhere
+
+    python -m pbnj.replay mybot:bot recording.log --speed 10 --profile"""
+import sys
+import time
+import logging
+import argparse
+import importlib
+
+from pbnj.connection import Connection
+from pbnj.recorder import RECEIVED, records
+
+
+class ReplaySocket:
+    """stands in for a socket, recv() returns the received lines of a
+    recording and send() keeps what's sent to it. With speed set a line isn't
+    handed out until its time in the recording divided by speed has passed
+    since the first recv(), without it lines come as quickly as they're asked
+    for"""
+
+    def __init__(self, records, speed=None, clock=time.monotonic, sleep=time.sleep):
+        self._lines = (
+            (at, line) for at, direction, line in records if direction == RECEIVED
+        )
+        self._next = next(self._lines, None)
+        self.speed = speed
+        self.clock = clock
+        self.sleep = sleep
+        # clock() when the first line of the recording is due
+        self._start = None
+        self.sent = []
+
+    def connect(self, address):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def setblocking(self, flag):
+        pass
+
+    def recv(self, bufsz):
+        if self._next is None:
+            return b""
+        if self.speed is None:
+            due = float("inf")
+        else:
+            if self._start is None:
+                self._start = self.clock() - self._next[0] / self.speed
+            wait = self._start + self._next[0] / self.speed - self.clock()
+            if wait > 0:
+                self.sleep(wait)
+            due = (self.clock() - self._start) * self.speed
+        # everything that's due by now, in one go like a real socket would
+        data = []
+        size = 0
+        while self._next is not None and self._next[0] <= due and size < bufsz:
+            data.append(self._next[1] + b"\r\n")
+            size += len(data[-1])
+            self._next = next(self._lines, None)
+        return b"".join(data)
+
+    def send(self, data):
+        self.sent.append(data)
+        return len(data)
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+    def fileno(self):
+        return -1
+
+
+class ReplayConnection(Connection):
+    """a Connection that reads from a recording instead of a server, see
+    ReplaySocket. Any other keyword arguments are handed to Connection"""
+
+    def __init__(self, path, speed=None, **kwargs):
+        self.path = path
+        self.speed = speed
+        super().__init__("replay", 6667, **kwargs)
+
+    def _make_socket(self):
+        return ReplaySocket(records(self.path), self.speed)
+
+    def sent_lines(self):
+        """every line the bot sent during the replay, without \\r\\n"""
+        return b"".join(self.conn.sent).decode("utf-8", "replace").split("\r\n")[:-1]
+
+
+def replay(bot, path, speed=None, **kwargs):
+    """run bot against the recording at path, at speed times its original
+    pace or as fast as possible if speed is None. Returns how long it took
+    and how many lines went in and out"""
+    bot.conn = ReplayConnection(path, speed, **kwargs)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    bot.run()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    lines = bot.conn.stats.lines_in
+    return {
+        "lines_in": lines,
+        "lines_out": len(bot.conn.sent_lines()),
+        "seconds": wall,
+        "cpu_seconds": cpu,
+        "lines_per_second": lines / wall if wall else 0.0,
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    p.add_argument("bot", help="module:attribute of the Bot to replay into")
+    p.add_argument("recording", help="path of the recording")
+    p.add_argument(
+        "--speed", type=float, help="multiple of the original pace, default as fast"
+    )
+    p.add_argument("--profile", action="store_true", help="profile the handlers")
+    p.add_argument("--sent", action="store_true", help="print what the bot sent")
+    args = p.parse_args(argv)
+    logging.getLogger("pbnj").setLevel(logging.ERROR)
+    module, _, attribute = args.bot.partition(":")
+    bot = getattr(importlib.import_module(module), attribute or "bot")
+    if args.profile:
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        result = profiler.runcall(replay, bot, args.recording, args.speed)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    else:
+        result = replay(bot, args.recording, args.speed)
+    if args.sent:
+        for line in bot.conn.sent_lines():
+            print(line)
+    print(
+        "{lines_in:,} lines in, {lines_out:,} out in {seconds:.2f}s "
+        "({cpu_seconds:.2f}s CPU, {lines_per_second:,.0f} lines/s)".format(**result)
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
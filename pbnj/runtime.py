@@ -0,0 +1,134 @@
+"""drive one Bot on many IRC networks from a single thread. Every Connection
+is watched by a selector, so an idle runtime sleeps in select() no matter how
+many networks it's on"""
+import logging
+import selectors
+
+from pbnj.connection import Connection
+from pbnj.models import Message
+from pbnj.state import State
+from pbnj import __version__
+
+log = logging.getLogger("pbnj")
+
+
+class Network:
+    """one IRC network a bot is on, with its own connection, nick, channels and
+    channel state. Has the same conn, nick, channels and state attributes as a
+    Bot"""
+
+    def __init__(self, name, conn, nick, channels=(), username=None, realname=None):
+        self.name = name
+        self.conn = conn
+        self.nick = nick
+        self.username = username or nick
+        self.realname = realname or nick
+        self.channels = list(channels)
+        self.state = State(nick)
+
+    def __repr__(self):
+        return "pbnj.runtime.Network {} ({}:{} as {})".format(
+            self.name, self.conn.addr, self.conn.port, self.nick
+        )
+
+
+class Runtime:
+    """runs a Bot's commands on any number of networks at once. Messages are
+    tagged with the name of their network, and the bot sends replies, joins
+    and parts back through that network's connection"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.selector = selectors.DefaultSelector()
+
+    @property
+    def networks(self):
+        return self.bot.networks
+
+    def add(
+        self,
+        name,
+        addr,
+        port=6667,
+        ssl=False,
+        nick=None,
+        channels=(),
+        username=None,
+        realname=None,
+        **kwargs
+    ):
+        """set up a connection to another network. nick, username and realname
+        default to the bot's own, extra keyword arguments go to Connection"""
+        if name in self.networks:
+            raise ValueError("There's already a network called {}".format(name))
+        conn = Connection(addr, port, __version__, use_ssl=ssl, **kwargs)
+        network = Network(
+            name,
+            conn,
+            nick or self.bot.nick,
+            self.bot._channelify(channels),
+            username or self.bot.username,
+            realname or self.bot.realname,
+        )
+        self.networks[name] = network
+        return network
+
+    def _start(self, network):
+        """connect, register and join the initial channels of a network"""
+        conn = network.conn
+        conn._connect()
+        network.state.clear()
+        conn.prefilter = self.bot._prefilter()
+        conn.max_msg_len = self.bot.max_msg_len
+        conn.register(network.username, network.nick, conn.addr, network.realname)
+        for channel in network.channels:
+            conn.join(channel)
+        self.selector.register(conn, selectors.EVENT_READ, network)
+        log.info("Started network %s", network.name)
+
+    def _stop(self, network):
+        self.selector.unregister(network.conn)
+        if network.conn._connected:
+            network.conn._cleanup()
+        log.warning("Stopped network %s", network.name)
+
+    def _timeout(self):
+        """how long select() may sleep before a send queue needs flushing"""
+        waits = [
+            n.conn.queue.wait_time()
+            for n in self.networks.values()
+            if n.conn.queue is not None and n.conn.queue.depth
+        ]
+        return min(waits) if waits else None
+
+    def poll(self, timeout=None):
+        """wait for at least one network to have something for us, and handle
+        every message that arrived"""
+        for key, events in self.selector.select(timeout):
+            network = key.data
+            for raw_message in network.conn.poll():
+                msg = Message(raw_message, network.name)
+                if self.bot._should_handle(msg):
+                    self.bot.handle(msg)
+            if not network.conn._connected:
+                self._stop(network)
+        for network in self.networks.values():
+            if network.conn.queue is not None and network.conn.queue.depth:
+                network.conn.flush()
+
+    def run(self):
+        """start every network, loop until none of them are left"""
+        if self.bot.use_builtin:
+            self.bot._enable_builtin_commands()
+        for network in list(self.networks.values()):
+            try:
+                self._start(network)
+            except OSError as e:
+                log.error("Couldn't connect to %s: %s", network.name, e)
+        try:
+            while self.selector.get_map():
+                self.poll(self._timeout())
+        finally:
+            for key in list(self.selector.get_map().values()):
+                self._stop(key.data)
+            self.bot._shutdown()
@@ -0,0 +1,308 @@
+"""keeps track of the channels the bot is in and who else is in them, from the
+JOIN, PART, KICK, QUIT, NICK and NAMES messages the server sends anyway, so
+commands can answer "who's here" without asking the server again"""
+import logging
+
+log = logging.getLogger("pbnj")
+
+
+def _fold_table(upper="", lower=""):
+    """a str.translate table lowercasing ASCII letters plus the given extras"""
+    table = {c: c + 32 for c in range(ord("A"), ord("Z") + 1)}
+    table.update(zip(map(ord, upper), map(ord, lower)))
+    return table
+
+
+# the CASEMAPPING values servers advertise in ISUPPORT
+CASEMAPPINGS = {
+    "ascii": _fold_table(),
+    "rfc1459": _fold_table("[]\\~", "{}|^"),
+    "strict-rfc1459": _fold_table("[]\\", "{}|"),
+}
+
+
+# the numerics State looks at
+NUMERICS = (1, 5, 353, 366)
+
+
+class User:
+    """someone sharing a channel with the bot. channels holds the casefolded
+    names of those channels"""
+
+    __slots__ = ("nick", "user", "host", "channels")
+
+    def __init__(self, nick, user=None, host=None):
+        self.nick = nick
+        self.user = user
+        self.host = host
+        self.channels = set()
+
+    def __repr__(self):
+        return "pbnj.state.User {}".format(self.nick)
+
+
+class Channel:
+    """a channel the bot is in. members holds casefolded nicks, synced is set
+    once the server has finished sending us the NAMES list"""
+
+    __slots__ = ("name", "members", "synced")
+
+    def __init__(self, name):
+        self.name = name
+        self.members = set()
+        self.synced = False
+
+    def __repr__(self):
+        return "pbnj.state.Channel {} ({} members)".format(self.name, len(self.members))
+
+
+class State:
+    """channel -> members and nick -> channels indexes for one connection,
+    keyed by names casefolded the way the server says it compares them
+    (CASEMAPPING in ISUPPORT, rfc1459 until told otherwise). Feed it every
+    message with update(); isupport holds everything else the server
+    advertised"""
+
+    def __init__(self, nick=None):
+        self.isupport = {}
+        self.casemapping = "rfc1459"
+        self._table = CASEMAPPINGS[self.casemapping]
+        # the nick prefixes in NAMES replies for channel operators, voice...
+        self._prefixes = "@+"
+        self.channels = {}
+        self.users = {}
+        self.nick = nick
+        self._handlers = {
+            "JOIN": self._on_join,
+            "PART": self._on_part,
+            "KICK": self._on_kick,
+            "QUIT": self._on_quit,
+            "NICK": self._on_nick,
+            1: self._on_welcome,
+            5: self._on_isupport,
+            353: self._on_names,
+            366: self._on_end_of_names,
+        }
+
+    @property
+    def nick(self):
+        return self._nick
+
+    @nick.setter
+    def nick(self, nick):
+        self._nick = nick
+        self._me = self.fold(nick) if nick else None
+
+    def fold(self, name):
+        """the key name is stored under, so #Foo and #foo are the same"""
+        return name.translate(self._table)
+
+    def clear(self):
+        """forget every channel and user, for a new connection"""
+        self.channels.clear()
+        self.users.clear()
+
+    def update(self, message):
+        """take note of a message if it changes who is where"""
+        handler = self._handlers.get(message.type)
+        if handler is not None:
+            handler(message)
+
+    def channel(self, name):
+        return self.channels.get(self.fold(name))
+
+    def user(self, nick):
+        return self.users.get(self.fold(nick))
+
+    def members(self, channel):
+        """the nicks in a channel, an empty list if we're not in it"""
+        chan = self.channels.get(self.fold(channel))
+        if chan is None:
+            return []
+        users = self.users
+        return [users[key].nick for key in chan.members]
+
+    def channels_of(self, nick):
+        """the channels we share with someone"""
+        user = self.users.get(self.fold(nick))
+        if user is None:
+            return []
+        channels = self.channels
+        return [channels[key].name for key in user.channels]
+
+    def is_on(self, nick, channel):
+        chan = self.channels.get(self.fold(channel))
+        return chan is not None and self.fold(nick) in chan.members
+
+    def targmax(self, command="PRIVMSG"):
+        """how many targets the server takes in one command, None if there's
+        no limit. From TARGMAX, or the older MAXTARGETS, and one if it didn't
+        say"""
+        targmax = self.isupport.get("TARGMAX")
+        if targmax is not None:
+            for item in targmax.split(","):
+                name, _, limit = item.partition(":")
+                if name.upper() == command:
+                    return int(limit) if limit else None
+            return 1
+        maxtargets = self.isupport.get("MAXTARGETS")
+        return int(maxtargets) if maxtargets else 1
+
+    def _add(self, chan_key, channel, nick, user=None, host=None):
+        key = self.fold(nick)
+        known = self.users.get(key)
+        if known is None:
+            if key == nick:
+                # most nicks are lowercase already, don't keep two copies
+                key = nick
+            known = self.users[key] = User(nick, user, host)
+        elif host is not None:
+            known.user, known.host = user, host
+        known.channels.add(chan_key)
+        channel.members.add(key)
+
+    def _remove(self, chan_key, channel, key):
+        channel.members.discard(key)
+        user = self.users.get(key)
+        if user is not None:
+            user.channels.discard(chan_key)
+            if not user.channels:
+                del self.users[key]
+
+    def _leave(self, chan_key):
+        """we're not in a channel any more, nor are its members as far as we
+        can tell"""
+        channel = self.channels.pop(chan_key, None)
+        if channel is None:
+            return
+        for key in channel.members:
+            user = self.users.get(key)
+            if user is not None:
+                user.channels.discard(chan_key)
+                if not user.channels:
+                    del self.users[key]
+
+    def _on_join(self, message):
+        if message.nick is None or not message.params:
+            return
+        name = message.params[0]
+        chan_key = self.fold(name)
+        channel = self.channels.get(chan_key)
+        if self.fold(message.nick) == self._me:
+            if channel is None:
+                channel = self.channels[chan_key] = Channel(name)
+        if channel is not None:
+            self._add(chan_key, channel, message.nick, message.realname, message.host)
+
+    def _on_part(self, message):
+        if message.nick is None or not message.params:
+            return
+        self._gone(message.params[0], message.nick)
+
+    def _on_kick(self, message):
+        if len(message.params) >= 2:
+            self._gone(message.params[0], message.params[1])
+
+    def _gone(self, name, nick):
+        chan_key = self.fold(name)
+        key = self.fold(nick)
+        if key == self._me:
+            self._leave(chan_key)
+            return
+        channel = self.channels.get(chan_key)
+        if channel is not None:
+            self._remove(chan_key, channel, key)
+
+    def _on_quit(self, message):
+        if message.nick is None:
+            return
+        key = self.fold(message.nick)
+        user = self.users.pop(key, None)
+        if user is None:
+            return
+        for chan_key in user.channels:
+            self.channels[chan_key].members.discard(key)
+
+    def _on_nick(self, message):
+        if message.nick is None or not message.params:
+            return
+        new = message.params[0]
+        old_key, new_key = self.fold(message.nick), self.fold(new)
+        if old_key == self._me:
+            self.nick = new
+        user = self.users.pop(old_key, None)
+        if user is None:
+            return
+        user.nick = new
+        self.users[new_key] = user
+        if old_key != new_key:
+            for chan_key in user.channels:
+                members = self.channels[chan_key].members
+                members.discard(old_key)
+                members.add(new_key)
+
+    def _on_welcome(self, message):
+        # the server tells us which nick we ended up with
+        if message.params:
+            self.nick = message.params[0]
+
+    def _on_isupport(self, message):
+        # the first parameter is our nick, the last one is "are supported..."
+        for token in message.params[1:-1]:
+            if token.startswith("-"):
+                self.isupport.pop(token[1:], None)
+                continue
+            key, _, value = token.partition("=")
+            self.isupport[key] = value
+        prefix = self.isupport.get("PREFIX")
+        if prefix and ")" in prefix:
+            self._prefixes = prefix.partition(")")[2]
+        mapping = self.isupport.get("CASEMAPPING", "rfc1459")
+        if mapping != self.casemapping:
+            self._set_casemapping(mapping)
+
+    def _set_casemapping(self, mapping):
+        if mapping not in CASEMAPPINGS:
+            log.warning("Unknown casemapping %s, comparing names as ascii", mapping)
+        self.casemapping = mapping
+        self._table = CASEMAPPINGS.get(mapping, CASEMAPPINGS["ascii"])
+        self.nick = self.nick
+        # everything we already know has to be filed under its new key, which
+        # comes from the name as it was given to us rather than the old key
+        chan_keys = {key: self.fold(c.name) for key, c in self.channels.items()}
+        user_keys = {key: self.fold(u.nick) for key, u in self.users.items()}
+        for channel in self.channels.values():
+            channel.members = {user_keys[key] for key in channel.members}
+        for user in self.users.values():
+            user.channels = {chan_keys[key] for key in user.channels}
+        self.channels = {chan_keys[k]: c for k, c in self.channels.items()}
+        self.users = {user_keys[k]: u for k, u in self.users.items()}
+
+    def _on_names(self, message):
+        # [our nick, channel type (not sent by every server), channel, names]
+        if len(message.params) < 3:
+            return
+        chan_key = self.fold(message.params[-2])
+        channel = self.channels.get(chan_key)
+        if channel is None:
+            # someone asked for the NAMES of a channel we're not in
+            return
+        if channel.synced:
+            # a fresh NAMES list replaces what we had
+            for key in list(channel.members):
+                self._remove(chan_key, channel, key)
+            channel.synced = False
+        prefixes = self._prefixes
+        for name in message.params[-1].split():
+            # with userhost-in-names these are whole nick!user@host masks
+            name = name.lstrip(prefixes)
+            rest, _, host = name.partition("@")
+            nick, _, user = rest.partition("!")
+            if nick:
+                self._add(chan_key, channel, nick, user or None, host or None)
+
+    def _on_end_of_names(self, message):
+        if len(message.params) >= 2:
+            channel = self.channels.get(self.fold(message.params[1]))
+            if channel is not None:
+                channel.synced = True
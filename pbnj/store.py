@@ -0,0 +1,185 @@
+"""counters for bots which keep score, held in memory and written to sqlite
+behind the bot's back. Commands read and bump them without touching the
+disk; a thread writes the changes out every so often in one transaction"""
+import re
+import atexit
+import sqlite3
+import logging
+import threading
+
+log = logging.getLogger("pbnj")
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class Store:
+    """integer counters in a sqlite table, one row per key with a column for
+    each of fields. Every row is loaded when the store is opened and reads are
+    served from memory. incr() only notes the change; every flush_interval
+    seconds the changes are upserted in one transaction (in WAL mode), and
+    flush() writes them right away. Call close() when you're done with it,
+    which also happens at exit"""
+
+    def __init__(
+        self, path, table="counters", key="key", fields=("value",), flush_interval=1.0
+    ):
+        for name in (table, key) + tuple(fields):
+            if not _IDENTIFIER.match(name):
+                raise ValueError("{!r} can't be used as a sqlite name".format(name))
+        self.path = path
+        self.table = table
+        self.key = key
+        self.fields = tuple(fields)
+        self.flush_interval = flush_interval
+        # key -> list of values, in the order of fields
+        self._rows = {}
+        # key -> list of changes not written yet
+        self._pending = {}
+        # protects _rows and _pending, _db_lock the sqlite connection
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._setup()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._flush_loop, name="pbnj-store", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _setup(self):
+        db = self._db
+        db.execute("pragma journal_mode=wal")
+        db.execute("pragma synchronous=normal")
+        columns = ", ".join(
+            "{} integer not null default 0".format(f) for f in self.fields
+        )
+        db.execute(
+            "create table if not exists {} ({} text not null, {})".format(
+                self.table, self.key, columns
+            )
+        )
+        # upserts need a unique key to conflict on
+        db.execute(
+            "create unique index if not exists {0}_{1} on {0}({1})".format(
+                self.table, self.key
+            )
+        )
+        db.commit()
+        query = "select {}, {} from {}".format(
+            self.key, ", ".join(self.fields), self.table
+        )
+        for row in db.execute(query):
+            self._rows[row[0]] = list(row[1:])
+        adds = ", ".join("{0} = {0} + excluded.{0}".format(f) for f in self.fields)
+        self._upsert = (
+            "insert into {} ({}, {}) values (?, {}) "
+            "on conflict({}) do update set {}".format(
+                self.table,
+                self.key,
+                ", ".join(self.fields),
+                ", ".join("?" for _ in self.fields),
+                self.key,
+                adds,
+            )
+        )
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def _field(self, field):
+        if field is None:
+            return 0
+        try:
+            return self.fields.index(field)
+        except ValueError:
+            raise KeyError(field) from None
+
+    def incr(self, key, field=None, amount=1):
+        """add amount to a counter (the first field unless told otherwise) and
+        return its new value"""
+        i = self._field(field)
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                row = self._rows[key] = [0] * len(self.fields)
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = [0] * len(self.fields)
+            row[i] += amount
+            pending[i] += amount
+            return row[i]
+
+    def get(self, key, default=None):
+        """the counters of a key as a dictionary of field -> value"""
+        row = self._rows.get(key)
+        if row is None:
+            return default
+        return dict(zip(self.fields, row))
+
+    def value(self, key, field=None):
+        """one counter, 0 if it was never bumped"""
+        row = self._rows.get(key)
+        return row[self._field(field)] if row is not None else 0
+
+    def items(self):
+        """(key, counters dictionary) for every key, in no particular order"""
+        with self._lock:
+            rows = list(self._rows.items())
+        return [(key, dict(zip(self.fields, row))) for key, row in rows]
+
+    def flush(self):
+        """write every change made so far, return how many keys were written"""
+        with self._db_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                with self._db:
+                    self._db.executemany(
+                        self._upsert, [(k,) + tuple(v) for k, v in pending.items()]
+                    )
+            except sqlite3.Error:
+                self.failures += 1
+                log.exception("Couldn't write %d keys to %s", len(pending), self.path)
+                # keep the changes for next time
+                with self._lock:
+                    for key, changes in pending.items():
+                        merged = self._pending.setdefault(key, [0] * len(self.fields))
+                        for i, change in enumerate(changes):
+                            merged[i] += change
+                return 0
+            self.flushes += 1
+            self.written += len(pending)
+            return len(pending)
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """stop the flushing thread, write what's left and close the database"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+        atexit.unregister(self.close)
+
+    def stats(self):
+        return {
+            "keys": len(self._rows),
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "written": self.written,
+            "failures": self.failures,
+        }
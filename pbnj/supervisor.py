@@ -0,0 +1,105 @@
+"""keeps a bot on its network. When the connection drops the bot is connected
+again after a backoff, registers again and rejoins every channel it was in,
+without restarting the process"""
+import time
+import random
+import logging
+
+from pbnj.connection import ConnectionException
+
+log = logging.getLogger("pbnj")
+
+
+class Supervisor:
+    """runs a Bot until stop() is called, reconnecting whenever Bot.run ends.
+    Waits between attempts grow exponentially from base_delay up to
+    max_delay, with full jitter so a fleet of bots doesn't come back all at
+    once. A connection that stayed up for stable_after seconds resets the
+    backoff. After max_attempts failed attempts in a row it gives up"""
+
+    def __init__(
+        self,
+        bot,
+        base_delay=1.0,
+        max_delay=300.0,
+        stable_after=60.0,
+        max_attempts=None,
+        sleep=time.sleep,
+    ):
+        self.bot = bot
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stable_after = stable_after
+        self.max_attempts = max_attempts
+        self.sleep = sleep
+        self.stopped = False
+        # how many attempts have failed since the last good connection
+        self.failures = 0
+        self.reconnects = 0
+        self.downtime = 0.0
+        self.last_error = None
+        self._down_since = None
+
+    def stop(self):
+        """don't reconnect after the current connection ends"""
+        self.stopped = True
+
+    def backoff(self, failures):
+        """seconds to wait after this many failures in a row"""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** failures)
+        return random.uniform(0, ceiling)
+
+    def stats(self):
+        downtime = self.downtime
+        if self._down_since is not None:
+            downtime += time.monotonic() - self._down_since
+        return {
+            "reconnects": self.reconnects,
+            "failures": self.failures,
+            "downtime": downtime,
+            "connected": self._down_since is None,
+            "last_error": repr(self.last_error) if self.last_error else None,
+        }
+
+    def _run_once(self):
+        """run the bot until it disconnects, return whether the connection was
+        good: it connected and stayed up for at least stable_after seconds"""
+        conn = self.bot.conn
+        before = conn.connected_at
+        try:
+            self.bot.run(shutdown=False)
+        except (OSError, ConnectionException) as e:
+            log.error("Lost connection to %s: %s", conn.addr, e)
+            self.last_error = e
+        now = time.monotonic()
+        if conn.connected_at is None or conn.connected_at == before:
+            # never got connected
+            if self._down_since is None:
+                self._down_since = now
+            return False
+        if self._down_since is not None:
+            self.downtime += conn.connected_at - self._down_since
+        self._down_since = now
+        return now - conn.connected_at >= self.stable_after
+
+    def run(self):
+        """keep the bot running, return once stopped or out of attempts. The
+        bot's shutdown hooks only run then, not on every reconnect"""
+        try:
+            while not self.stopped:
+                if self._run_once():
+                    self.failures = 0
+                else:
+                    self.failures += 1
+                if self.stopped:
+                    break
+                if self.max_attempts is not None and self.failures >= self.max_attempts:
+                    log.error("Giving up after %s failed attempts", self.failures)
+                    break
+                delay = self.backoff(self.failures)
+                log.warning("Reconnecting to %s in %.1fs", self.bot.conn.addr, delay)
+                self.sleep(delay)
+                self.bot.conn.reset()
+                self.reconnects += 1
+        finally:
+            self.bot._shutdown()
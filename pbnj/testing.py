@@ -0,0 +1,578 @@
+"""a small IRC server to run bots against without a network, and a load
+generator that plays a crowd of users talking to a bot through it.
+
+The server speaks enough of the protocol for a bot to get going: registration,
+PING, JOIN and PART, and PRIVMSG and NOTICE to channels and nicks, fanned out
+to everyone in the channel. It can hold back everything it sends by some
+latency, hand it out a few bytes at a time, and disconnect clients that send
+too much too quickly, like a real server would. It runs on an asyncio loop,
+either one that's already running (start() and close()) or its own on a
+thread (run_in_thread() and stop(), or a with block)"""
+import re
+import time
+import socket
+import asyncio
+import logging
+import threading
+from collections import deque
+
+from pbnj.models import parse_line
+
+log = logging.getLogger("pbnj")
+
+# what a client may send before it's registered
+_UNREGISTERED = frozenset(["CAP", "NICK", "USER", "PING", "PONG", "QUIT"])
+
+
+class _Client:
+    """one connection to a Server"""
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        peer = writer.get_extra_info("peername")
+        self.host = peer[0] if peer else "localhost"
+        self.nick = None
+        self.user = None
+        self.registered = False
+        self.channels = set()
+        # when its last lines arrived, for the flood limit
+        self.recent = deque()
+        # (time.monotonic() it's due, bytes), None when it's time to hang up
+        self.outbox = deque()
+        self.ready = asyncio.Event()
+        self.closing = False
+
+    @property
+    def source(self):
+        return "{}!{}@{}".format(self.nick, self.user, self.host)
+
+    def send(self, line):
+        if self.closing:
+            return
+        due = time.monotonic() + self.server._delay()
+        self.outbox.append((due, line.encode("utf-8", "replace") + b"\r\n"))
+        self.server.lines_out += 1
+        self.ready.set()
+
+    def reply(self, numeric, *params):
+        """a numeric from the server, addressed to this client"""
+        params = list(params)
+        params[-1] = ":" + params[-1]
+        self.send(
+            ":{} {} {} {}".format(
+                self.server.name, numeric, self.nick or "*", " ".join(params)
+            )
+        )
+
+    def close(self, reason):
+        if self.closing:
+            return
+        self.send("ERROR :Closing link: {} ({})".format(self.host, reason))
+        self.closing = True
+        self.outbox.append((time.monotonic() + self.server._delay(), None))
+        self.ready.set()
+
+
+class Server:
+    """an IRC server on host:port (any free port by default, see .port once
+    started). latency is the seconds every line it sends is held back for, or
+    a function returning that for each line, to add jitter. chunk_size sends
+    lines a few bytes at a time so clients get partial reads. A client that
+    sends more than flood_lines lines in flood_window seconds is disconnected
+    with an Excess Flood error"""
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        name="irc.example.net",
+        latency=0.0,
+        chunk_size=None,
+        flood_lines=None,
+        flood_window=1.0,
+        targmax=4,
+    ):
+        self.host = host
+        self.port = port
+        self.name = name
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.flood_lines = flood_lines
+        self.flood_window = flood_window
+        self.targmax = targmax
+        # folded nick: _Client, folded channel: {clients}
+        self.nicks = {}
+        self.channels = {}
+        self.clients = set()
+        self.connections = 0
+        self.lines_in = 0
+        self.lines_out = 0
+        self.flood_kicks = 0
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    def _delay(self):
+        return self.latency() if callable(self.latency) else self.latency
+
+    def stats(self):
+        return {
+            "clients": len(self.clients),
+            "connections": self.connections,
+            "lines_in": self.lines_in,
+            "lines_out": self.lines_out,
+            "flood_kicks": self.flood_kicks,
+        }
+
+    async def start(self):
+        """start listening on the running loop"""
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        log.debug("Test server listening on %s:%s", self.host, self.port)
+
+    async def close(self):
+        """stop listening and tell everyone still connected goodbye"""
+        self._server.close()
+        for client in list(self.clients):
+            client.close("Server going down")
+        deadline = time.monotonic() + 5
+        while self.clients and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        await self._server.wait_closed()
+
+    def run_in_thread(self):
+        """run the server on its own event loop on a thread, returning once it's
+        listening"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.close())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="pbnj-server", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        """close a server started with run_in_thread() and wait for it to finish"""
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.run_in_thread()
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    async def _serve(self, reader, writer):
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(self, reader, writer)
+        self.clients.add(client)
+        self.connections += 1
+        delivering = asyncio.ensure_future(self._deliver(client))
+        try:
+            while not client.closing:
+                try:
+                    line = await reader.readuntil(b"\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    client.close("Line too long")
+                    break
+                self.lines_in += 1
+                if self._flooding(client):
+                    self.flood_kicks += 1
+                    client.close("Excess Flood")
+                    break
+                self._handle(client, line[:-2].decode("utf-8", "replace"))
+        finally:
+            self._quit(client, "Connection closed")
+            client.close("Connection closed")
+            await delivering
+            self.clients.discard(client)
+
+    def _flooding(self, client):
+        if self.flood_lines is None or not client.registered:
+            return False
+        now = time.monotonic()
+        client.recent.append(now)
+        while client.recent[0] <= now - self.flood_window:
+            client.recent.popleft()
+        return len(client.recent) > self.flood_lines
+
+    async def _deliver(self, client):
+        """write what's been sent to a client once it's due, until it's closed"""
+        outbox = client.outbox
+        try:
+            while True:
+                if not outbox:
+                    client.ready.clear()
+                    await client.ready.wait()
+                    continue
+                wait = outbox[0][0] - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                now = time.monotonic()
+                batch = []
+                while outbox and outbox[0][0] <= now and outbox[0][1] is not None:
+                    batch.append(outbox.popleft()[1])
+                await self._write(client.writer, b"".join(batch))
+                if outbox and outbox[0][1] is None:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            client.writer.close()
+
+    async def _write(self, writer, data):
+        if self.chunk_size is None:
+            writer.write(data)
+            await writer.drain()
+            return
+        for i in range(0, len(data), self.chunk_size):
+            writer.write(data[i : i + self.chunk_size])
+            await writer.drain()
+            # give the client a chance to read each piece on its own
+            await asyncio.sleep(0)
+
+    def _peers(self, client):
+        """everyone who shares a channel with client, and client"""
+        peers = {client}
+        for channel in client.channels:
+            peers.update(self.channels[channel])
+        return peers
+
+    def _handle(self, client, line):
+        _, _, command, params = parse_line(line)
+        command = command.upper()
+        handler = getattr(self, "_on_" + command.lower(), None)
+        if not client.registered and command not in _UNREGISTERED:
+            client.reply("451", "You have not registered")
+            return
+        if handler is None:
+            client.reply("421", command, "Unknown command")
+            return
+        handler(client, params)
+
+    def _register(self, client):
+        if client.registered or client.nick is None or client.user is None:
+            return
+        client.registered = True
+        client.reply("001", "Welcome to the pbnj test network " + client.source)
+        client.reply(
+            "005",
+            "CHANTYPES=# CASEMAPPING=ascii NICKLEN=30",
+            "TARGMAX=PRIVMSG:{0},NOTICE:{0}".format(self.targmax),
+            "are supported by this server",
+        )
+        client.reply("422", "MOTD File is missing")
+
+    def _on_cap(self, client, params):
+        if params and params[0].upper() == "LS":
+            client.send(":{} CAP * LS :".format(self.name))
+        elif params and params[0].upper() == "REQ":
+            client.send(":{} CAP * NAK :{}".format(self.name, params[-1]))
+
+    def _on_nick(self, client, params):
+        if not params:
+            client.reply("431", "No nickname given")
+            return
+        nick = params[0]
+        owner = self.nicks.get(nick.lower())
+        if owner is not None and owner is not client:
+            client.reply("433", nick, "Nickname is already in use")
+            return
+        if client.nick is not None:
+            self.nicks.pop(client.nick.lower(), None)
+        self.nicks[nick.lower()] = client
+        if client.registered:
+            for peer in self._peers(client):
+                peer.send(":{} NICK :{}".format(client.source, nick))
+        client.nick = nick
+        self._register(client)
+
+    def _on_user(self, client, params):
+        if client.registered:
+            client.reply("462", "You may not reregister")
+        elif len(params) < 4:
+            client.reply("461", "USER", "Not enough parameters")
+        else:
+            client.user = params[0]
+            self._register(client)
+
+    def _on_ping(self, client, params):
+        token = params[-1] if params else self.name
+        client.send(":{0} PONG {0} :{1}".format(self.name, token))
+
+    def _on_pong(self, client, params):
+        pass
+
+    def _on_join(self, client, params):
+        if not params:
+            client.reply("461", "JOIN", "Not enough parameters")
+            return
+        for channel in params[0].split(","):
+            if not channel.startswith("#"):
+                client.reply("403", channel, "No such channel")
+                continue
+            folded = channel.lower()
+            if folded in client.channels:
+                continue
+            members = self.channels.setdefault(folded, set())
+            members.add(client)
+            client.channels.add(folded)
+            for member in members:
+                member.send(":{} JOIN {}".format(client.source, channel))
+            names = " ".join(sorted(m.nick for m in members))
+            client.reply("353", "=", channel, names)
+            client.reply("366", channel, "End of /NAMES list")
+
+    def _on_part(self, client, params):
+        if not params:
+            client.reply("461", "PART", "Not enough parameters")
+            return
+        reason = params[1] if len(params) > 1 else client.nick
+        for channel in params[0].split(","):
+            folded = channel.lower()
+            if folded not in client.channels:
+                client.reply("442", channel, "You're not on that channel")
+                continue
+            for member in self.channels[folded]:
+                member.send(":{} PART {} :{}".format(client.source, channel, reason))
+            self._leave(client, folded)
+
+    def _leave(self, client, folded):
+        client.channels.discard(folded)
+        members = self.channels[folded]
+        members.discard(client)
+        if not members:
+            del self.channels[folded]
+
+    def _on_privmsg(self, client, params, command="PRIVMSG"):
+        if not params:
+            client.reply("411", "No recipient given ({})".format(command))
+            return
+        if len(params) < 2:
+            client.reply("412", "No text to send")
+            return
+        targets = params[0].split(",")
+        if len(targets) > self.targmax:
+            client.reply("407", params[0], "Too many recipients")
+            return
+        prefix = ":{} {} ".format(client.source, command)
+        text = " :" + params[1]
+        for target in targets:
+            line = prefix + target + text
+            folded = target.lower()
+            if target.startswith("#"):
+                if folded not in self.channels:
+                    client.reply("403", target, "No such channel")
+                elif folded not in client.channels:
+                    client.reply("404", target, "Cannot send to channel")
+                else:
+                    for member in self.channels[folded]:
+                        if member is not client:
+                            member.send(line)
+            elif folded in self.nicks:
+                self.nicks[folded].send(line)
+            else:
+                client.reply("401", target, "No such nick/channel")
+
+    def _on_notice(self, client, params):
+        self._on_privmsg(client, params, "NOTICE")
+
+    def _on_quit(self, client, params):
+        reason = "Quit: " + params[0] if params else "Client Quit"
+        self._quit(client, reason)
+        client.close(reason)
+
+    def _quit(self, client, reason):
+        """tell everyone client is gone and forget about it"""
+        if client.nick is not None and self.nicks.get(client.nick.lower()) is client:
+            del self.nicks[client.nick.lower()]
+        peers = self._peers(client)
+        peers.discard(client)
+        for peer in peers:
+            peer.send(":{} QUIT :{}".format(client.source, reason))
+        for folded in list(client.channels):
+            self._leave(client, folded)
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LoadGenerator:
+    """users simulated users on channel, taking turns to send the bot command
+    followed by a token at rate messages a second (for all of them together)
+    for duration seconds. Every reply from bot_nick that contains a token
+    counts as the answer to that message; ones without an answer grace
+    seconds after the last was sent were dropped"""
+
+    TOKEN = re.compile(r"load(\d+)")
+
+    def __init__(
+        self,
+        host,
+        port,
+        bot_nick,
+        users=10,
+        rate=10.0,
+        duration=5.0,
+        channel="#load",
+        command=".echo",
+        grace=2.0,
+        timeout=10.0,
+    ):
+        self.host = host
+        self.port = port
+        self.bot_nick = bot_nick
+        self.users = users
+        self.rate = rate
+        self.duration = duration
+        self.channel = channel
+        self.command = command
+        self.grace = grace
+        self.timeout = timeout
+
+    def run(self):
+        """run the load on a fresh event loop and return the report"""
+        return asyncio.run(self.start())
+
+    async def start(self):
+        """connect the users, wait for the bot to be in the channel, send the
+        load and return a report of how the bot kept up"""
+        self._sent = {}
+        self._answered = {}
+        self._welcomed = [asyncio.Event() for _ in range(self.users)]
+        self._bot_here = asyncio.Event()
+        self.disconnected = 0
+        connections = [
+            await asyncio.open_connection(self.host, self.port)
+            for _ in range(self.users)
+        ]
+        readers = [
+            asyncio.ensure_future(self._read(i, reader))
+            for i, (reader, _) in enumerate(connections)
+        ]
+        writers = [writer for _, writer in connections]
+        try:
+            for i, writer in enumerate(writers):
+                writer.write(b"NICK loader%d\r\nUSER load 0 * :load\r\n" % i)
+            for welcomed in self._welcomed:
+                await asyncio.wait_for(welcomed.wait(), self.timeout)
+            for writer in writers:
+                writer.write("JOIN {}\r\n".format(self.channel).encode())
+            await asyncio.wait_for(self._bot_here.wait(), self.timeout)
+            started = time.monotonic()
+            await self._send(writers, started)
+            sending = time.monotonic() - started
+            deadline = time.monotonic() + self.grace
+            while len(self._answered) < len(self._sent):
+                if time.monotonic() > deadline:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            for writer in writers:
+                if not writer.is_closing():
+                    writer.write(b"QUIT :load over\r\n")
+                    writer.close()
+            for reader in readers:
+                reader.cancel()
+            await asyncio.gather(*readers, return_exceptions=True)
+        return self._report(sending)
+
+    async def _send(self, writers, started):
+        for seq in range(int(self.rate * self.duration)):
+            wait = started + seq / self.rate - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            writer = writers[seq % len(writers)]
+            if writer.is_closing():
+                continue
+            self._sent[seq] = time.monotonic()
+            writer.write(
+                "PRIVMSG {} :{} load{}\r\n".format(
+                    self.channel, self.command, seq
+                ).encode()
+            )
+            await writer.drain()
+
+    async def _read(self, i, reader):
+        bot = self.bot_nick.lower()
+        while True:
+            try:
+                line = await reader.readuntil(b"\r\n")
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self.disconnected += 1
+                return
+            now = time.monotonic()
+            line = line[:-2].decode("utf-8", "replace")
+            _, prefix, command, params = parse_line(line)
+            nick = prefix.split("!", 1)[0].lower() if prefix else None
+            if command == "PRIVMSG" and nick == bot and params:
+                for token in self.TOKEN.findall(params[-1]):
+                    seq = int(token)
+                    if seq in self._sent and seq not in self._answered:
+                        self._answered[seq] = now - self._sent[seq]
+            elif command == "001":
+                self._welcomed[i].set()
+            elif command == "JOIN" and nick == bot:
+                self._bot_here.set()
+            elif command == "353" and bot in params[-1].lower().split():
+                self._bot_here.set()
+            elif command == "ERROR":
+                log.warning("Load user %d was disconnected: %s", i, params[-1])
+
+    def _report(self, sending):
+        latencies = sorted(self._answered.values())
+        report = {
+            "users": self.users,
+            "sent": len(self._sent),
+            "answered": len(latencies),
+            "dropped": len(self._sent) - len(latencies),
+            "disconnected": self.disconnected,
+            "rate": len(self._sent) / sending if sending else 0.0,
+        }
+        for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            report[name] = _percentile(latencies, fraction)
+        report["max"] = latencies[-1] if latencies else None
+        return report
+
+
+def load_test(bot, users=10, rate=10.0, duration=5.0, channel="#load", **options):
+    """run bot against a Server on a thread and hit it with a LoadGenerator.
+    Options for the Server (latency, flood_lines...) and the generator
+    (command, grace...) can be given too. Returns the generator's report,
+    with the server's stats under the key server"""
+    generator_options = dict(users=users, rate=rate, duration=duration)
+    generator_options["channel"] = channel
+    for name in ("command", "grace", "timeout"):
+        if name in options:
+            generator_options[name] = options.pop(name)
+    with Server(**options) as server:
+        bot.connect(server.host, server.port)
+        if channel not in bot.channels:
+            bot.channels.append(channel)
+        running = threading.Thread(target=bot.run, name="pbnj-bot", daemon=True)
+        running.start()
+        generator = LoadGenerator(
+            server.host, server.port, bot.nick, **generator_options
+        )
+        report = generator.run()
+        report["server"] = server.stats()
+    running.join(5)
+    return report
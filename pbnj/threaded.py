@@ -0,0 +1,220 @@
+"""a connection run by three threads instead of one: a reader frames lines off
+the socket into a bounded queue, the bot's own thread parses and dispatches
+them, and a writer drains everything going out. A burst of replies then never
+holds up reading, so the server doesn't see us fall behind"""
+import re
+import socket
+import logging
+import threading
+from collections import deque
+from queue import SimpleQueue, Empty
+
+from pbnj.connection import ConnectionException
+
+log = logging.getLogger("pbnj")
+
+OVERFLOW_POLICIES = ("drop-oldest", "block")
+
+# a PRIVMSG, the only kind of line it's alright to lose
+_chatter = re.compile(rb"(?:@[^ ]* +)?:[^ ]* +PRIVMSG ").match
+
+# wakes up the writer to flush the send queue, and to stop it
+_FLUSH = object()
+_STOP = object()
+
+
+class InboundQueue:
+    """received lines waiting to be dispatched, at most max_depth of them.
+    When it's full the oldest PRIVMSG is thrown away to make room with the
+    "drop-oldest" policy; if there are no PRIVMSGs to throw away, or the policy
+    is "block", put() waits for the dispatcher, which stops us reading from the
+    socket and leaves the rest to TCP. Nothing but PRIVMSGs is ever dropped"""
+
+    def __init__(self, max_depth=10000, overflow="drop-oldest"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('overflow must be "drop-oldest" or "block"')
+        if max_depth < 1:
+            raise ValueError("an InboundQueue needs room for at least one line")
+        self.max_depth = max_depth
+        self.overflow = overflow
+        # [line, is it a PRIVMSG] cells, line is None once it's been dropped
+        self._lines = deque()
+        # the cells of _lines which are PRIVMSGs, oldest first
+        self._chatter = deque()
+        self._cond = threading.Condition()
+        self._waiting = 0
+        self.closed = False
+        self.depth = 0
+        self.high_water = 0
+        self.dropped = 0
+        self.blocked = 0
+
+    def __len__(self):
+        return self.depth
+
+    def put(self, line):
+        """queue a line, making room for it if we're allowed to"""
+        cell = [line, _chatter(line) is not None]
+        with self._cond:
+            while self.depth >= self.max_depth and not self.closed:
+                if self.overflow == "drop-oldest" and self._chatter:
+                    self._chatter.popleft()[0] = None
+                    self.depth -= 1
+                    self.dropped += 1
+                    if len(self._lines) > 2 * self.max_depth:
+                        # sweep out the dropped cells once they outnumber the
+                        # live ones, so memory stays bounded however many go
+                        self._lines = deque(c for c in self._lines if c[0] is not None)
+                    break
+                self.blocked += 1
+                self._waiting += 1
+                self._cond.wait()
+                self._waiting -= 1
+            self._lines.append(cell)
+            if cell[1]:
+                self._chatter.append(cell)
+            self.depth += 1
+            if self.depth > self.high_water:
+                self.high_water = self.depth
+            self._cond.notify()
+
+    def get(self):
+        """the oldest line, waiting for one if need be. None once the queue is
+        closed and empty"""
+        with self._cond:
+            while True:
+                while self._lines:
+                    line, is_chatter = self._lines.popleft()
+                    if line is None:
+                        continue
+                    if is_chatter:
+                        # PRIVMSGs leave in order, so it's the first of those
+                        self._chatter.popleft()
+                    self.depth -= 1
+                    if self._waiting:
+                        self._cond.notify_all()
+                    return line
+                if self.closed:
+                    return None
+                self._cond.wait()
+
+    def close(self):
+        """no more lines are coming, get() returns None when the rest are out"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "high_water": self.high_water,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+        }
+
+
+class ThreadedIO:
+    """the reader and writer threads of a Connection. PINGs are answered by
+    the reader the moment they arrive, and the prefilter runs there too, so
+    neither waits behind a busy dispatcher. Everything the connection sends
+    goes through the writer, which also lets out the send queue on time"""
+
+    def __init__(self, conn, max_depth=10000, overflow="drop-oldest"):
+        self.conn = conn
+        self.inbound = InboundQueue(max_depth, overflow)
+        self.outbox = SimpleQueue()
+        self._reader = threading.Thread(
+            target=self._read, name="pbnj-reader", daemon=True
+        )
+        self._writer = threading.Thread(
+            target=self._write, name="pbnj-writer", daemon=True
+        )
+
+    def start(self):
+        self.conn.outbox = self.outbox
+        self._writer.start()
+        self._reader.start()
+
+    def _read(self):
+        conn = self.conn
+        try:
+            while True:
+                data = conn.conn.recv(conn.recv_bufsz)
+                if not data:
+                    log.warning("Server closed the connection")
+                    break
+                lines = conn.framer.feed(data)
+                conn.stats.received(len(data), len(lines))
+                if conn.recorder is not None:
+                    conn.recorder.received(lines)
+                for line in lines:
+                    if conn._wanted(line):
+                        self.inbound.put(line)
+        except OSError as e:
+            log.warning("Lost connection to %s: %s", conn.addr, e)
+        finally:
+            self.inbound.close()
+
+    def _write(self):
+        conn = self.conn
+        while True:
+            wait = None
+            if conn.queue is not None:
+                with conn._send_lock:
+                    wait = conn.queue.wait_time()
+            try:
+                item = self.outbox.get(timeout=wait)
+            except Empty:
+                item = _FLUSH
+            if item is _STOP:
+                return
+            if item is not _FLUSH:
+                conn._write_now(item)
+            if conn.queue is not None and conn.queue.depth:
+                conn._flush_now()
+
+    def flush(self):
+        """have the writer let out whatever the send queue allows"""
+        self.outbox.put(_FLUSH)
+
+    def messages(self):
+        """decoded lines for the bot, until the connection goes away. The
+        threads are stopped and the connection cleaned up afterwards"""
+        conn = self.conn
+        self.start()
+        try:
+            while True:
+                line = self.inbound.get()
+                if line is None:
+                    return
+                try:
+                    message = conn._decode(line)
+                except ConnectionException as e:
+                    log.warning("Stopped reading from %s: %s", conn.addr, e)
+                    return
+                if conn._ping_token is None or not conn._our_pong(message):
+                    yield message
+        finally:
+            self.stop()
+
+    def stop(self):
+        """write out what's waiting, then say goodbye and stop both threads"""
+        conn = self.conn
+        if self._writer.is_alive():
+            self.outbox.put(_STOP)
+            self._writer.join(conn.timeout)
+        conn.outbox = None
+        try:
+            # wakes the reader up, but we can still send a QUIT
+            conn.conn.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+        self.inbound.close()
+        if conn._connected:
+            conn._cleanup()
+        self._reader.join(conn.timeout)
+
+    def stats(self):
+        stats = {"inbound_" + k: v for k, v in self.inbound.stats().items()}
+        stats["outbound_depth"] = self.outbox.qsize()
+        return stats
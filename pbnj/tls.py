@@ -0,0 +1,41 @@
+"""TLS for connections to IRC servers. Setting up an SSLContext means loading
+every trusted certificate, so one is made per set of options and shared by
+every connection in the process; sharing it also lets a reconnect resume the
+last session instead of doing a full handshake"""
+import ssl
+import threading
+
+_contexts = {}
+_lock = threading.Lock()
+
+
+def context(cafile=None, certfile=None, keyfile=None, verify=True):
+    """the SSLContext for connecting to servers with these options, made the
+    first time it's asked for. cafile is the certificate authorities to trust
+    (the system's own by default), certfile and keyfile a client certificate
+    to present, for SASL EXTERNAL. verify=False skips checking the server's
+    certificate and hostname, which is only ever a good idea for testing"""
+    key = (cafile, certfile, keyfile, verify)
+    with _lock:
+        ctx = _contexts.get(key)
+        if ctx is None:
+            ctx = _contexts[key] = _make_context(cafile, certfile, keyfile, verify)
+        return ctx
+
+
+def _make_context(cafile, certfile, keyfile, verify):
+    # TLS 1.2 or better, certificates and hostnames checked
+    ctx = ssl.create_default_context(cafile=cafile)
+    if not verify:
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    if certfile is not None:
+        ctx.load_cert_chain(certfile, keyfile)
+    return ctx
+
+
+def clear():
+    """forget the shared contexts, so the next connections load certificates
+    from scratch"""
+    with _lock:
+        _contexts.clear()
@@ -0,0 +1,187 @@
+"""runs command callbacks away from the receive loop, so one slow or CPU
+hungry command doesn't stop the bot reading from the server"""
+import time
+import logging
+import threading
+from types import GeneratorType
+
+log = logging.getLogger("pbnj")
+
+
+def _materialize(callback, message):
+    """call a command in a worker process. Generators can't be sent back to
+    us, so their replies are collected into a list first"""
+    resp = callback(message)
+    if isinstance(resp, GeneratorType):
+        return True, list(resp)
+    return False, resp
+
+
+class WorkerPool:
+    """a thread pool and a process pool (each started when first needed)
+    shared by every command registered with an executor. Each command can
+    have at most its max_concurrency calls (max_pending if it doesn't say)
+    queued or running, further calls are dropped rather than queued. Calls
+    still waiting for a worker when the command's timeout passes are dropped
+    too, and replies arriving after it are thrown away"""
+
+    def __init__(self, max_threads=4, max_processes=2, max_pending=16):
+        self.max_threads = max_threads
+        self.max_processes = max_processes
+        self.max_pending = max_pending
+        self.rejected = 0
+        self.timed_out = 0
+        self._threads = None
+        self._processes = None
+        # id(command) -> its semaphore. Names aren't unique (lambdas, one
+        # callback registered twice) and Commands aren't hashable
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        return {"rejected": self.rejected, "timed_out": self.timed_out}
+
+    def _pool(self, kind):
+        # concurrent.futures (and multiprocessing with it) is slow to import,
+        # and most bots never need a pool
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+        with self._lock:
+            if kind == "thread":
+                if self._threads is None:
+                    self._threads = ThreadPoolExecutor(
+                        self.max_threads, thread_name_prefix="pbnj-worker"
+                    )
+                return self._threads
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(self.max_processes)
+            return self._processes
+
+    def _limit(self, command):
+        with self._lock:
+            limit = self._limits.get(id(command))
+            if limit is None:
+                limit = self._limits[id(command)] = threading.BoundedSemaphore(
+                    command.max_concurrency or self.max_pending
+                )
+            return limit
+
+    def submit(self, command, message, deliver):
+        """start a command on its pool. deliver(command, message, resp) is
+        called with its replies, in order, once they're ready. Return False if
+        the command already has too many calls running"""
+        key = flight = None
+        if command.executor == "process" and command.cache is not None:
+            # the cache lives in this process, so look there before shipping
+            # the call off, and wait for the same question already shipped
+            key = command.cache.key(message)
+
+            def follow(value, error):
+                if error is None:
+                    deliver(command, message, command.cache.thaw(value))
+
+            state, found = command.cache.lookup(key, follow)
+            if state == "hit":
+                return deliver(command, message, command.cache.thaw(found))
+            if state == "wait":
+                return True
+            flight = found
+        limit = self._limit(command)
+        if not limit.acquire(blocking=False):
+            if flight is not None:
+                command.cache.finish(key, flight, error=RuntimeError("too busy"))
+            self.rejected += 1
+            command.stats.rejected += 1
+            log.warning(
+                "%s already has %s calls waiting or running, dropping this one",
+                command.name,
+                command.max_concurrency or self.max_pending,
+            )
+            return False
+        started = time.perf_counter()
+        deadline = time.monotonic() + command.timeout if command.timeout else None
+        try:
+            if command.executor == "thread":
+                future = self._pool("thread").submit(
+                    self._run_thread, command, message, deliver, deadline
+                )
+            else:
+                future = self._pool("process").submit(
+                    _materialize, command.callback, message
+                )
+                future.add_done_callback(
+                    lambda f: self._finish_process(
+                        f, command, message, deliver, started, deadline, key, flight
+                    )
+                )
+        except Exception as e:
+            if flight is not None:
+                command.cache.finish(key, flight, error=e)
+            limit.release()
+            raise
+        future.add_done_callback(lambda f: limit.release())
+        log.info("Submitted %s to its %s pool", command.name, command.executor)
+        return True
+
+    def _late(self, command, deadline):
+        if deadline is not None and time.monotonic() > deadline:
+            self.timed_out += 1
+            log.warning("%s took longer than %ss", command.name, command.timeout)
+            return True
+        return False
+
+    def _until(self, command, deadline, replies):
+        """hand out replies from a generator until the deadline passes"""
+        for reply in replies:
+            if self._late(command, deadline):
+                return
+            yield reply
+
+    def _run_thread(self, command, message, deliver, deadline):
+        if self._late(command, deadline):
+            # it waited in the queue for so long nobody wants the answer
+            return False
+        started = time.perf_counter()
+        try:
+            resp = command(message)
+            if isinstance(resp, GeneratorType):
+                # stream the replies out as they're produced
+                resp = self._until(command, deadline, resp)
+            elif self._late(command, deadline):
+                return False
+            return deliver(command, message, resp)
+        except Exception:
+            command.stats.errors += 1
+            log.exception("Command %s raised an exception", command.name)
+            return False
+        finally:
+            command.stats.latency.observe(time.perf_counter() - started)
+
+    def _finish_process(
+        self, future, command, message, deliver, started, deadline, key, flight
+    ):
+        # the latency of a process call includes shipping it there and back
+        command.stats.latency.observe(time.perf_counter() - started)
+        try:
+            generated, resp = future.result()
+        except Exception as e:
+            if flight is not None:
+                command.cache.finish(key, flight, error=e)
+            command.stats.errors += 1
+            log.exception("Command %s raised an exception", command.name)
+            return
+        if flight is not None:
+            command.cache.finish(key, flight, resp)
+        if self._late(command, deadline):
+            return
+        if generated:
+            resp = (reply for reply in resp)
+        deliver(command, message, resp)
+
+    def shutdown(self, wait=False):
+        """stop the pools, they'll be started again if they're needed"""
+        with self._lock:
+            for pool in (self._threads, self._processes):
+                if pool is not None:
+                    pool.shutdown(wait=wait, cancel_futures=True)
+            self._threads = self._processes = None
@@ -5,7 +5,7 @@ import sys
 sys.path.extend('.')
 from pbnj import __version__
 
-test_requirements = ['pytest>=2.8.0', 'pytest-cov']
+test_requirements = ['pytest>=8.0', 'pytest-cov']
 
 setup(
     name = 'pbnj',
@@ -18,6 +18,7 @@ setup(
     url = 'https://github.com/delucks/pbnj',
     download_url = 'https://github.com/delucks/pbnj/tarball/v{}'.format(__version__),
     tests_requirements=test_requirements,
+    python_requires='>=3.9',
     keywords = ['irc', 'chatbot', 'bot', 'portable', 'framework'],
     classifiers = [],
 )
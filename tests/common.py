@@ -11,6 +11,9 @@ SAMPLE_ACTION = ':delucks!~delucks@localhost.localdomain PRIVMSG #channel :ACTIO
 SAMPLE_SERVER = ':irc.example.net 366 foo #channel :End of NAMES list'
 
 import os
+import socket
+import threading
+import time
 
 
 class FakeSocket:
@@ -35,8 +38,12 @@ class FakeSocket:
         pass
     def close(self):
         pass
+    def shutdown(self, how):
+        pass
     def send(self, message):
         self.sent.append(message)
+    def sendall(self, message):
+        self.sent.append(message)
     def recv(self, bufsz):
         # TODO don't throw away bufsz and actually return that much of our corpus
         if self.messages:
@@ -47,6 +54,16 @@ class FakeSocket:
         self.recieved.append(curr_msg)
         return curr_msg
 
+class Clock:
+    '''a clock for the time based classes which only moves when it's told
+    to, by setting now or sleep()ing'''
+    def __init__(self, now=0.0):
+        self.now = now
+    def __call__(self):
+        return self.now
+    def sleep(self, seconds):
+        self.now += seconds
+
 def _wrap(message):
     '''as if it was sent/recieved over a socket'''
     return bytes('{}\r\n'.format(message).encode('utf-8'))
@@ -57,3 +74,70 @@ def _get_log(logname):
     log_path = os.path.join(logs_dir, logname)
     with open(log_path) as f:
         return f.read()
+
+
+class ScriptedServer(threading.Thread):
+    '''an IRC server on localhost in a thread, for one client connection per
+    script. Once the client has registered it sends the script, waits for the
+    expected replies, then says goodbye. Give it an SSLContext to speak TLS'''
+    def __init__(self, script, expect=(), *more, context=None):
+        super().__init__(daemon=True)
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.scripts = [(script, list(expect))]
+        for i in range(0, len(more), 2):
+            self.scripts.append((more[i], list(more[i + 1])))
+        self.expect = [e for _, expected in self.scripts for e in expected]
+        self.sent = []
+        self.connections = 0
+        self.context = context
+        # for TLS, whether each connection resumed a session and the subject
+        # of the client certificate it presented, if any
+        self.resumed = []
+        self.peers = []
+
+    def run(self):
+        try:
+            for script, expect in self.scripts:
+                client, _ = self.listener.accept()
+                self.connections += 1
+                try:
+                    if self.context is not None:
+                        client = self.context.wrap_socket(client, server_side=True)
+                        self.resumed.append(client.session_reused)
+                        cert = client.getpeercert()
+                        self.peers.append(dict(p[0] for p in cert['subject'])
+                                          if cert else None)
+                    self.serve(client, script, expect)
+                except OSError:
+                    pass
+                finally:
+                    client.close()
+        finally:
+            self.listener.close()
+
+    def serve(self, client, script, expect):
+        client.settimeout(5)
+        buf = b''
+        deadline = time.monotonic() + 5
+        sent = []
+        scripted = False
+        while time.monotonic() < deadline:
+            if scripted and all(e in sent for e in expect):
+                break
+            data = client.recv(4096)
+            if not data:
+                return
+            buf += data
+            while b'\r\n' in buf:
+                line, buf = buf.split(b'\r\n', 1)
+                sent.append(line.decode())
+                self.sent.append(line.decode())
+            if not scripted and any(l.startswith('USER') for l in sent):
+                client.sendall(b''.join(_wrap(l) for l in script))
+                scripted = True
+        client.sendall(_wrap(':irc.example.net NOTICE * :Closing link: bye'))
+        while client.recv(4096):
+            pass
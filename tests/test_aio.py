@@ -0,0 +1,172 @@
+import asyncio
+import time
+import pytest
+from pbnj.aio import AsyncBot, AsyncConnection
+from common import _wrap
+from common import *
+import logging
+log = logging.getLogger('pbnj')
+log.setLevel(logging.DEBUG)
+
+
+class FakeServer:
+    '''a tiny IRC server on localhost which plays back lines once a client
+    has registered, and remembers everything the client says'''
+    def __init__(self, script):
+        self.script = script
+        self.sent = []
+        self.got_line = asyncio.Event()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.client, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def client(self, reader, writer):
+        self.writer = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.sent.append(line.decode().rstrip('\r\n'))
+                self.got_line.set()
+                if line.startswith(b'USER'):
+                    self.playing = asyncio.ensure_future(self.play(writer))
+        finally:
+            writer.close()
+
+    async def play(self, writer):
+        for item in self.script:
+            if callable(item):
+                await item(self)
+            else:
+                writer.write(_wrap(item))
+                await writer.drain()
+
+    async def wait_for(self, line, timeout=5):
+        deadline = time.monotonic() + timeout
+        while line not in self.sent:
+            assert time.monotonic() < deadline, 'never got {}'.format(line)
+            self.got_line.clear()
+            await asyncio.wait_for(self.got_line.wait(), timeout)
+
+    def close(self):
+        self.server.close()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_async_connection_ping():
+    async def scenario():
+        server = await FakeServer([
+            'PING :irc.foo.bar.baz',
+            SAMPLE_PRIV,
+            ':irc.foo.bar.baz NOTICE foo :Closing link: bye',
+        ]).start()
+        conn = AsyncConnection('127.0.0.1', server.port)
+        gotten = []
+        async with conn:
+            conn.register(USER, NICK, HOSTNAME, REALNAME)
+            async for line in conn.recieve():
+                gotten.append(line)
+        server.close()
+        return server, gotten
+    server, gotten = run(scenario())
+    assert gotten == [SAMPLE_PRIV]
+    assert 'PONG :irc.foo.bar.baz' in server.sent
+    assert 'QUIT :{}/-1'.format(NICK) in server.sent
+
+
+def test_async_bot_slow_command_keeps_ponging():
+    bot = AsyncBot(NICK, max_workers=2)
+    release = asyncio.Event()
+
+    @bot.command('^\\.slow')
+    async def slow(message):
+        await release.wait()
+        return 'finally'
+
+    @bot.command('^\\.blocking')
+    def blocking(message):
+        time.sleep(0.2)
+        yield 'one'
+        yield 'two'
+
+    async def after_ping(server):
+        # the slow command hasn't finished, but the ping still gets answered
+        await server.wait_for('PONG :later')
+        assert 'PRIVMSG #channel :finally' not in server.sent
+        release.set()
+        await server.wait_for('PRIVMSG #channel :finally')
+        await server.wait_for('PRIVMSG #channel :two')
+
+    async def scenario():
+        server = await FakeServer([
+            ':a!~b@localhost PRIVMSG #channel :.slow',
+            ':a!~b@localhost PRIVMSG #channel :.blocking',
+            'PING :later',
+            after_ping,
+            ':irc.foo.bar.baz NOTICE foo :Closing link: bye',
+        ]).start()
+        bot.connect('127.0.0.1', server.port)
+        await asyncio.wait_for(bot.start(), 10)
+        server.close()
+        return server
+    server = run(scenario())
+    replies = [l for l in server.sent if l.startswith('PRIVMSG')]
+    assert replies.index('PRIVMSG #channel :one') < replies.index('PRIVMSG #channel :two')
+
+
+def test_async_bot_builtins():
+    bot = AsyncBot(NICK)
+
+    async def scenario():
+        server = await FakeServer([
+            ':a!~b@localhost PRIVMSG #channel :.ping',
+            ':a!~b@localhost PRIVMSG #channel :.join #other',
+            lambda s: s.wait_for('JOIN #other'),
+            ':irc.foo.bar.baz NOTICE foo :Closing link: bye',
+        ]).start()
+        bot.connect('127.0.0.1', server.port)
+        await asyncio.wait_for(bot.start(), 10)
+        server.close()
+        return server
+    server = run(scenario())
+    assert 'PRIVMSG #channel :a: pong' in server.sent
+    assert '#other' in bot.channels
+
+
+def test_async_connection_options():
+    conn = AsyncConnection('127.0.0.1', 6667, timeout=3, max_line_len=512)
+    assert conn.timeout == 3 and conn.framer.max_line_len == 512
+    # nothing is ever queued, so there's nothing to flush
+    assert conn.flush()
+    with pytest.raises(ValueError):
+        AsyncConnection('127.0.0.1', 6667, send_queue=object())
+
+
+def test_async_bot_executor():
+    bot = AsyncBot(NICK)
+
+    @bot.command('^\\.crunch', executor='thread', max_concurrency=1)
+    def crunch(message):
+        return 'crunched'
+
+    async def scenario():
+        server = await FakeServer([
+            ':a!~b@localhost PRIVMSG #channel :.crunch',
+            lambda s: s.wait_for('PRIVMSG #channel :crunched'),
+            ':irc.foo.bar.baz NOTICE foo :Closing link: bye',
+        ]).start()
+        bot.connect('127.0.0.1', server.port, timeout=3)
+        await asyncio.wait_for(bot.start(), 10)
+        server.close()
+        return server
+    server = run(scenario())
+    assert bot.conn.timeout == 3
+    # it ran on the worker pool rather than the bot's own threads
+    assert bot.workers is not None
+    assert 'PRIVMSG #channel :crunched' in server.sent
@@ -2,7 +2,7 @@ import pytest
 from random import choice
 from pbnj import default_argparser
 from pbnj.bot import Bot, __version__
-from pbnj.models import Message, Command
+from pbnj.models import Message, Command, _builtin_command
 from common import _get_log, _wrap
 from common import *
 import logging
@@ -141,6 +141,38 @@ def test_builtin_help(connected_bot):
         connected_bot._enable_builtin_commands()
         assert connected_bot.handle(m)
 
+def test_builtin_help_pages(connected_bot):
+    fs = connected_bot.conn.conn
+    connected_bot.conn.max_msg_len = 60
+    for i in range(12):
+        def cmd(message):
+            return 'ok'
+        cmd.__name__ = 'cmd%d' % i
+        connected_bot.command('^\\.' + cmd.__name__)(cmd)
+    connected_bot._enable_builtin_commands()
+    def help(args):
+        fs.sent.clear()
+        text = '.help ' + args if args else '.help'
+        assert connected_bot.handle(Message(
+            ':foo!~foo@irc.foo.bar PRIVMSG #defaultchannel :' + text))
+        return [l.decode().split(' :', 1)[1].rstrip('\r\n') for l in fs.sent]
+    first = help('')
+    assert len(first) == 1
+    assert first[0].startswith('Available commands (1/')
+    pages = int(first[0].split('/', 1)[1].split(')')[0])
+    assert pages > 1
+    assert help(str(pages))[0].startswith('Available commands ({0}/{0}): '.format(
+        pages))
+    assert help(str(pages + 1)) == ['foo: there are {} pages of commands'.format(
+        pages)]
+    assert help('cmd0') == ['foo: cmd0 - This triggers it: ^\\.cmd0']
+    # long descriptions are split like any other reply
+    assert help('help') == [
+        'foo: help - list the commands a page at a time, or describe', 'one']
+    assert help('nope') == ['foo: no command called nope']
+    # a digit, but not one int() can read
+    assert help('\u00b2') == ['foo: no command called \u00b2']
+
 def test_builtin_ping(connected_bot):
     log = ':foo!~somenick@irc.foo.bar.baz PRIVMSG #defaultchannel :.ping'
     reply = 'PRIVMSG #defaultchannel :foo: pong'
@@ -192,3 +224,81 @@ def test_parse_args(connected_bot, capsys):
     args = default_argparser(arguments=['-v'])
     out, err = capsys.readouterr() 
     assert 'pbnj version' in out
+
+def test_event_hooks(response_bot):
+    bot = response_bot
+    seen = []
+
+    @bot.command(on=['JOIN', 'INVITE'])
+    def joins(message):
+        seen.append((message.type, message.params[-1]))
+
+    @bot.command(on=[433])
+    def nick_taken(message):
+        seen.append(message.type)
+        return True
+
+    fs = bot.conn.conn
+    fs._set_reply_text('\n'.join([
+        ':a!~a@h JOIN #pbnj',
+        ':irc.example.net 372 foo :- motd',
+        ':irc.example.net 433 * foo :Nickname is already in use',
+        ':a!~a@h INVITE {} :#invited'.format(bot.nick),
+        ':a!~a@h INVITE someoneelse :#elsewhere',
+    ]))
+    bot.run()
+    assert seen == [
+        ('JOIN', '#pbnj'), 433, ('INVITE', '#invited'), ('INVITE', '#elsewhere'),
+    ]
+    assert _wrap('JOIN #invited') in fs.sent
+    assert _wrap('JOIN #elsewhere') not in fs.sent
+    # only the numerics somebody subscribed to get past the prefilter
+    assert bot.conn.prefilter.dropped == 1
+    assert b'433' in bot._prefilter().numerics
+
+def test_builtins_per_class(connected_bot):
+    class Quiet(Bot):
+        def ping(self, message):
+            return None
+
+        @_builtin_command('uptime')
+        def uptime(self, message):
+            return 'forever'
+
+    assert [name for name, _ in Bot._builtins] == [
+        'help', 'join', 'ping', 'stats', 'version']
+    assert [name for name, _ in Quiet._builtins] == [
+        'help', 'join', 'stats', 'uptime', 'version']
+    bot = Quiet(NICK)
+    bot._enable_builtin_commands()
+    assert [c.name for c in bot.commands] == [name for name, _ in Quiet._builtins]
+    assert bot.commands[3](Message(SAMPLE_PRIV)) == 'forever'
+
+
+def test_lazy_imports():
+    import os, subprocess, sys
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ('import sys, pbnj.bot; '
+            'print(sorted(m for m in ("ssl", "concurrent.futures") '
+            'if m in sys.modules))')
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                         text=True, check=True, cwd=root).stdout
+    assert out.strip() == '[]'
+
+
+def test_broadcast(connected_bot):
+    bot = connected_bot
+    fs = bot.conn.conn
+    channels = ['#c{}'.format(i) for i in range(7)]
+    assert bot.broadcast(channels, 'hi')
+    assert len(fs.sent) == 2 + 7
+    bot._should_handle(Message(':irc.example.net 005 foo TARGMAX=PRIVMSG:3 :ok'))
+    fs.sent.clear()
+    assert bot.broadcast(channels, 'hi')
+    assert fs.sent == [_wrap('PRIVMSG #c0,#c1,#c2 :hi'),
+                       _wrap('PRIVMSG #c3,#c4,#c5 :hi'), _wrap('PRIVMSG #c6 :hi')]
+    # the source the server gives our messages is picked up from our JOINs
+    bot._should_handle(Message(':{0}!~{0}@pbnj.example.net JOIN #c0'.format(NICK)))
+    assert bot.conn.source == '{0}!~{0}@pbnj.example.net'.format(NICK)
+    bot._should_handle(Message(':{0}!~{0}@pbnj.example.net NICK :{0}_'.format(NICK)))
+    assert bot.conn.source == '{0}_!~{0}@pbnj.example.net'.format(NICK)
@@ -0,0 +1,184 @@
+import time
+import threading
+import pytest
+from pbnj.cache import ResponseCache, nick_key
+from pbnj.models import Message, Command
+from pbnj.workers import WorkerPool
+from common import _wrap
+from common import *
+
+
+def weather(message):
+    '''module level, so it can be sent to a worker process'''
+    return 'sunny in ' + message.args[0]
+
+
+def slow_weather(message):
+    time.sleep(0.5)
+    return weather(message)
+
+
+def test_ttl_and_lru():
+    clock = Clock()
+    calls = []
+    def lookup(message):
+        calls.append(message.message)
+        return message.message.upper()
+    cache = ResponseCache(10, size=2, clock=clock)
+    a = Message(':a!~a@h PRIVMSG #c :.w a')
+    b = Message(':b!~b@h PRIVMSG #d :.w b')
+    c = Message(':c!~c@h PRIVMSG #c :.w c')
+    assert cache.call(lookup, a) == '.W A'
+    # asking again is answered from the cache
+    assert cache.call(lookup, Message(':a!~a@h PRIVMSG #c :.w a')) == '.W A'
+    cache.call(lookup, b)
+    cache.call(lookup, a)
+    cache.call(lookup, c)  # b was used least recently
+    assert calls == ['.w a', '.w b', '.w c']
+    cache.call(lookup, b)
+    assert calls[-1] == '.w b'
+    clock.now = 11
+    cache.call(lookup, c)
+    assert calls[-1] == '.w c'
+    assert cache.stats() == {
+        'hits': 2, 'misses': 5, 'coalesced': 0, 'evictions': 2, 'size': 2,
+    }
+    with pytest.raises(ValueError):
+        ResponseCache(0)
+
+
+def test_default_key():
+    calls = []
+    def weather(message):
+        calls.append(message.nick)
+        return 'Currently 83 degrees F'
+    cache = ResponseCache(60)
+    idler = Message(':idler!~i@h PRIVMSG #c :.weather')
+    assert cache.call(weather, idler) == 'Currently 83 degrees F'
+    # anybody asking the same thing in the same channel gets the same reply
+    bob = Message(':bob!~b@h PRIVMSG #c :.weather')
+    assert cache.call(weather, bob) == 'Currently 83 degrees F'
+    elsewhere = Message(':idler!~i@h PRIVMSG #other :.weather')
+    assert cache.call(weather, elsewhere) == 'Currently 83 degrees F'
+    assert calls == ['idler', 'idler']
+    assert cache.hits == 1
+
+
+def test_nick_key():
+    calls = []
+    def weather(message):
+        calls.append(message.nick)
+        return '{}: Currently 83 degrees F'.format(message.nick)
+    cache = ResponseCache(60, key=nick_key)
+    idler = Message(':idler!~i@h PRIVMSG #c :.weather')
+    assert cache.call(weather, idler) == 'idler: Currently 83 degrees F'
+    # somebody else doesn't get a reply meant for idler
+    bob = Message(':bob!~b@h PRIVMSG #c :.weather')
+    assert cache.call(weather, bob) == 'bob: Currently 83 degrees F'
+    assert cache.call(weather, bob) == 'bob: Currently 83 degrees F'
+    assert calls == ['idler', 'bob']
+    assert cache.hits == 1
+
+
+def test_generators_are_replayed():
+    def lines(message):
+        yield 'one'
+        yield 'two'
+    cache = ResponseCache(60)
+    m = Message(':a!~a@h PRIVMSG #c :.lines')
+    assert list(cache.call(lines, m)) == ['one', 'two']
+    assert list(cache.call(lines, m)) == ['one', 'two']
+    assert cache.hits == 1
+
+
+def test_coalescing():
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    def slow(message):
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'done'
+    cache = ResponseCache(60)
+    m = Message(':a!~a@h PRIVMSG #c :.slow')
+    replies = []
+    threads = [threading.Thread(target=lambda: replies.append(cache.call(slow, m)))
+               for _ in range(10)]
+    threads[0].start()
+    assert started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    while cache.coalesced < 9:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert calls == [1]
+    assert replies == ['done'] * 10
+    assert cache.misses == 1
+
+
+def test_errors_aren_t_cached():
+    def broken(message):
+        raise RuntimeError('api down')
+    cache = ResponseCache(60)
+    m = Message(':a!~a@h PRIVMSG #c :.x')
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            cache.call(broken, m)
+    assert len(cache) == 0 and cache.misses == 2
+
+
+def test_bot_command_cache(connected_bot):
+    bot = connected_bot
+    calls = []
+
+    @bot.command('^\\.weather', cache_ttl=60, cache_key=lambda m: tuple(m.args))
+    def forecast(message):
+        calls.append(message.nick)
+        return 'sunny in ' + message.args[0]
+
+    with bot.conn:
+        assert bot.handle(Message(':a!~a@h PRIVMSG #c :.weather 32490'))
+        assert bot.handle(Message(':b!~b@h PRIVMSG #d :.weather  32490'))
+    assert calls == ['a']
+    assert _wrap('PRIVMSG #d :sunny in 32490') in bot.conn.conn.sent
+    stats = bot.metrics.snapshot()['commands']['forecast']
+    assert stats['cache_hits'] == 1 and stats['cache_misses'] == 1
+    with pytest.raises(ValueError):
+        async def nope(message):
+            pass
+        Command('^\\.x', nope, cache_ttl=5)
+
+
+def test_process_pool_cache():
+    pool = WorkerPool(max_processes=1)
+    c = Command('^\\.weather', weather, executor='process', cache_ttl=60)
+    m = Message(':a!~b@c PRIVMSG #channel :.weather 12345')
+    replies = []
+    done = threading.Event()
+    def deliver(command, message, resp):
+        replies.append(resp)
+        done.set()
+        return True
+    assert pool.submit(c, m, deliver)
+    assert done.wait(30)
+    # the second one never leaves this process
+    assert pool.submit(c, m, deliver)
+    assert replies == ['sunny in 12345'] * 2
+    assert c.cache.stats()['hits'] == 1
+    # asking again while the first call is out waits for its answer
+    c = Command('^\\.weather', slow_weather, executor='process', cache_ttl=60)
+    both = threading.Event()
+    def deliver_both(command, message, resp):
+        replies.append(resp)
+        if len(replies) == 4:
+            both.set()
+        return True
+    assert pool.submit(c, m, deliver_both)
+    assert pool.submit(c, m, deliver_both)
+    assert both.wait(30)
+    assert replies == ['sunny in 12345'] * 4
+    stats = c.cache.stats()
+    assert (stats['misses'], stats['coalesced']) == (1, 1)
+    pool.shutdown(wait=True)
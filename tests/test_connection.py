@@ -1,5 +1,5 @@
 import pytest
-from pbnj.connection import Connection
+from pbnj.connection import ConnectionException, LineBuffer, split_text
 from common import _get_log, _wrap
 from common import *
 import logging
@@ -31,6 +31,41 @@ def test_message(registered_connection):
     registered_connection.conn = None
     assert not registered_connection.send(message)
 
+def test_split_text():
+    assert list(split_text('one two three', 7)) == ['one two', 'three']
+    assert list(split_text('abcdefgh ij', 4)) == ['abcd', 'efgh', 'ij']
+    assert list(split_text('first\r\nsecond\n\nthird', 100)) == [
+        'first', 'second', 'third']
+    # never cut a character in half
+    pieces = list(split_text('ünïcödé' * 10, 9))
+    assert ''.join(pieces) == 'ünïcödé' * 10
+    assert all(len(p.encode()) <= 9 for p in pieces)
+    assert list(split_text('🥜🥜🥜', 5)) == ['🥜', '🥜', '🥜']
+
+
+def test_message_splitting(registered_connection):
+    conn = registered_connection
+    fs = conn.conn
+    conn.max_msg_len = None
+    conn.message(CHANNEL, 'word ' * 200)
+    lines = [line for line in fs.sent if line.startswith(b'PRIVMSG')]
+    assert len(lines) == 3
+    # what the server relays to everyone else has to fit in 512 bytes
+    source = ':{}!{}@{} '.format(NICK, 'u' * 10, 'h' * 63).encode()
+    assert all(len(source + line) <= 512 for line in lines)
+    assert b''.join(lines).count(b'word') == 200
+    # once we know our real source, there's more room
+    conn.source = '{}!~{}@localhost'.format(NICK, USER)
+    fs.sent.clear()
+    conn.message(CHANNEL, 'word ' * 200)
+    assert len(fs.sent) == 3 and len(fs.sent[0]) > len(lines[0])
+    conn.max_msg_len = 100
+    fs.sent.clear()
+    conn.messages(CHANNEL, ['short', 'x' * 250, 'a\nb'])
+    assert [len(line) for line in fs.sent] == [
+        len('PRIVMSG #foo :short\r\n'), 116, 116, 66, 17, 17]
+
+
 def test_recv(registered_connection):
     fs = registered_connection.conn
     reply = 'this is some sample \x01 text'
@@ -73,3 +108,38 @@ def test_recieve(registered_connection):
     # the final line isn't recorded as it's the trigger for termination
     for line in inspired.splitlines()[:-1]:
         assert line.replace('\x01','') in gotten
+
+def test_line_buffer():
+    lb = LineBuffer()
+    assert lb.feed(b'PING :a\r\nPING :b\r\nPI') == [b'PING :a', b'PING :b']
+    assert len(lb) == 2
+    assert lb.feed(b'NG :c\r') == []
+    assert lb.feed(b'\n') == [b'PING :c']
+    assert len(lb) == 0
+    # a byte at a time still finds every line
+    lines = []
+    for byte in _wrap('one') + _wrap('two'):
+        lines.extend(lb.feed(bytes([byte])))
+    assert lines == [b'one', b'two']
+
+def test_line_buffer_limit():
+    lb = LineBuffer(max_line_len=10)
+    assert lb.feed(b'short\r\n' + b'x' * 20 + b'\r\nafter\r\n') == [b'short', b'after']
+    assert lb.dropped == 1
+    # a line that never ends doesn't get buffered forever
+    for i in range(100):
+        assert lb.feed(b'y' * 7) == []
+        assert len(lb) <= 10
+    assert lb.dropped == 2
+    assert lb.feed(b'\r') == []
+    assert lb.feed(b'\nnext\r\n') == [b'next']
+
+def test_recv_batch(registered_connection):
+    fs = registered_connection.conn
+    fs.messages = [_wrap('first') + _wrap('second') + b'thi', b'rd\r\n']
+    assert registered_connection._recv() == 'first'
+    assert registered_connection._recv() == 'second'
+    assert len(fs.recieved) == 1
+    assert registered_connection._recv() == 'third'
+    with pytest.raises(ConnectionException):
+        registered_connection._recv()
@@ -0,0 +1,109 @@
+import pytest
+from pbnj.dispatch import literal_prefix, CommandIndex, HelpIndex
+from pbnj.models import Message, Command
+from common import *
+
+def callback(message):
+    return message.message
+
+def test_literal_prefix():
+    prefixes = {
+        '^\\.weather [0-9]{5}': '.weather ',
+        '^\\.hello.*': '.hello',
+        '\\.votes': '.votes',
+        '^\\.ab?': '.a',
+        '^\\.a+b': '.a',
+        '^\\.a{2}': '.',
+        '^\\.test\\b': '.test',
+        '^\\.(foo|bar)': '',
+        '^(?i)\\.foo': '',
+        '.*': '',
+        'pattern': 'pattern',
+        '^\\.': '.',
+        '^\\d+': '',
+    }
+    for pattern, prefix in prefixes.items():
+        assert literal_prefix(pattern) == prefix, pattern
+
+def test_index_candidates(privmsg):
+    commands = []
+    index = CommandIndex(commands)
+    everything = lambda m: True
+    commands.extend([
+        Command('^\\.weather', callback),
+        Command(everything, callback),
+        Command('^hel+o', callback),
+        Command('.*', callback),
+        Command('^\\.help', callback),
+        Command('^hello there', callback),
+    ])
+    found = index.candidates(privmsg)
+    assert found == [commands[1], commands[2], commands[3]]
+    weather = Message(':a!~b@c PRIVMSG #channel :.weather 12345')
+    assert index.candidates(weather) == commands[:2] + [commands[3]]
+    server = Message(SAMPLE_SERVER)
+    assert index.candidates(server) == [commands[1]]
+    # the index picks up new registrations
+    commands.append(Command('^hello', callback))
+    assert index.candidates(privmsg)[-1] is commands[-1]
+
+def test_index_first_match(privmsg):
+    commands = [Command('^h', callback), Command(lambda m: True, callback)]
+    index = CommandIndex(commands)
+    matched = [c for c in index.candidates(privmsg) if c.match(privmsg)]
+    assert matched[0] is commands[0]
+    commands.reverse()
+    index.invalidate()
+    matched = [c for c in index.candidates(privmsg) if c.match(privmsg)]
+    assert matched[0] is commands[0]
+
+def test_index_subscriptions(privmsg):
+    commands = []
+    index = CommandIndex(commands)
+    commands.extend([
+        Command(None, callback, on=['join', 'PART']),
+        Command(lambda m: True, callback),
+        Command('^#pbnj', callback, on='JOIN'),
+        Command(None, callback, on=['353', 'PRIVMSG']),
+        Command('^\\.hi', callback, on=['PRIVMSG', 'NOTICE']),
+    ])
+    assert commands[3].on == {353, 'PRIVMSG'}
+    assert Command(None, callback, on='\u00b2').on == {'\u00b2'}
+    join = Message(':a!~b@c JOIN #pbnj')
+    assert index.candidates(join) == commands[:3]
+    assert [c for c in index.candidates(join) if c.match(join)] == commands[:3]
+    names = Message(':irc.example.net 353 foo = #pbnj :foo bar')
+    assert index.candidates(names) == [commands[1], commands[3]]
+    assert index.candidates(Message(SAMPLE_SERVER)) == [commands[1]]
+    hi = Message(':a!~b@c PRIVMSG #c :.hi')
+    assert index.candidates(hi) == commands[1:2] + commands[3:]
+    assert index.candidates(privmsg) == [commands[1], commands[3]]
+    # subscriptions are checked when matching outside the index too
+    assert not commands[0].match(privmsg)
+    with pytest.raises(ValueError):
+        Command(None, callback)
+
+def test_help_index():
+    def named(name):
+        def f(message):
+            '''does {}'''.format(name)
+        f.__name__ = name
+        return Command('^\\.' + name, f)
+    commands = [named('command%02d' % i) for i in range(30)]
+    index = HelpIndex(commands)
+    pages = index.pages(100)
+    assert len(pages) == 5
+    assert pages[0].startswith('Available commands (1/5): command00 command01')
+    assert all(len(p.encode()) <= 100 for p in pages)
+    names = ' '.join(p.split(': ', 1)[1] for p in pages).split()
+    assert names == [c.name for c in commands]
+    assert index.pages(100) is pages
+    assert index.pages(1000) == ['Available commands: ' + ' '.join(names)]
+    assert index.find('command07') is commands[7]
+    # the first command registered under a name is the one that runs
+    commands.append(named('command07'))
+    assert index.find('command07') is commands[7]
+    commands.append(named('zzz'))
+    assert index.find('zzz') is commands[-1]
+    assert index.pages(1000)[0].endswith('command29 zzz')
+    assert index.find('nothing') is None
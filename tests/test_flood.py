@@ -0,0 +1,103 @@
+import pytest
+from pbnj.flood import TokenBucket, SendQueue
+from common import _wrap
+from common import *
+from pbnj.models import Message
+
+
+def test_token_bucket():
+    clock = Clock(100.0)
+    with pytest.raises(ValueError):
+        TokenBucket(0, 1)
+    tb = TokenBucket(rate=2, burst=3, clock=clock)
+    assert tb.take() and tb.take() and tb.take()
+    assert not tb.take()
+    assert tb.wait_time() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert tb.take()
+    clock.now += 100
+    assert tb.available() == 3
+    tb.force(5)
+    assert tb.available() == -2
+    assert tb.wait_time() == pytest.approx(1.5)
+
+
+def test_send_queue_fairness():
+    clock = Clock(100.0)
+    q = SendQueue(rate=1, burst=2, max_depth=6, clock=clock)
+    for i in range(4):
+        assert q.put('#long', 'long {}'.format(i))
+    assert q.take_ready() == ['long 0', 'long 1']
+    assert q.put('#short', 'short 0')
+    assert q.wait_time() == pytest.approx(1)
+    clock.now += 2
+    # the short reply doesn't wait behind the rest of the long one
+    assert q.take_ready() == ['long 2', 'short 0']
+    assert len(q) == 1
+    for i in range(6):
+        q.put('#long', 'more')
+    stats = q.stats()
+    assert stats['depth'] == 6
+    assert stats['dropped'] == 1
+    assert stats['sent'] == 4
+    assert stats['delayed'] == 8
+    clock.now += 100
+    assert len(q.take_ready()) == 2
+
+
+def test_connection_send_queue(connected_bot):
+    clock = Clock(100.0)
+    conn = connected_bot.conn
+    fs = conn.conn
+    conn.queue = SendQueue(rate=1, burst=3, clock=clock)
+    @connected_bot.command('^\\.votes')
+    def votes(message):
+        for i in range(5):
+            yield 'topic{}'.format(i)
+    m = Message(':a!~b@c PRIVMSG #channel :.votes')
+    assert connected_bot.handle(m)
+    # the first three go out coalesced into one write
+    lines = [_wrap('PRIVMSG #channel :topic{}'.format(i)) for i in range(5)]
+    assert fs.sent[-1] == b''.join(lines[:3])
+    assert len(conn.queue) == 2
+    # control lines skip the queue but use up the budget
+    assert conn.send('PONG :server')
+    assert fs.sent[-1] == _wrap('PONG :server')
+    clock.now += 1
+    assert conn.flush()
+    assert fs.sent[-1] == _wrap('PONG :server')
+    clock.now += 2
+    fs._set_reply_text(SAMPLE_PRIV)
+    assert conn._recv() == SAMPLE_PRIV
+    assert fs.sent[-1] == b''.join(lines[3:])
+    assert conn.queue.stats()['sent'] == 5
+
+
+def test_failed_flush(connected_bot):
+    conn = connected_bot.conn
+    conn.queue = SendQueue(rate=1, burst=3, clock=Clock(100.0))
+    def broken(data):
+        raise OSError('connection reset')
+    conn.conn.sendall = broken
+    conn.queue.put('#channel', 'one')
+    conn.queue.put('#channel', 'two')
+    assert not conn.flush()
+    # they never made it out, so they're not reported as sent
+    stats = conn.queue.stats()
+    assert stats['sent'] == 0
+    assert stats['dropped'] == 2
+    assert stats['depth'] == 0
+
+
+def test_recv_timeout_never_zero(connected_bot):
+    conn = connected_bot.conn
+    fs = conn.conn
+    conn.queue = SendQueue(rate=1, burst=3, clock=Clock(100.0))
+    # the budget is there, it's just not been spent yet
+    conn.queue.put('#channel', 'one')
+    assert conn.queue.wait_time() == 0
+    timeouts = []
+    fs.settimeout = timeouts.append
+    fs._set_reply_text(SAMPLE_PRIV)
+    assert conn._recv_or_flush() == _wrap(SAMPLE_PRIV)
+    assert timeouts[0] > 0
@@ -0,0 +1,25 @@
+import logging
+from pbnj.logger import ColorFormatter, Colors
+
+
+def make_record(msg, *args, level=logging.INFO):
+    return logging.LogRecord('pbnj', level, __file__, 1, msg, args, None)
+
+
+def test_color_formatter_args():
+    f = ColorFormatter(msg='%(message)s')
+    record = make_record('SEND %s to %d', 'hello', 3)
+    assert f.format(record) == Colors.green + 'SEND hello to 3' + Colors.reset
+    # the record is left alone for everyone else
+    assert record.msg == 'SEND %s to %d'
+
+
+def test_color_formatter_no_stacking():
+    colored = ColorFormatter(msg='%(message)s')
+    plain = logging.Formatter('%(message)s')
+    record = make_record('oh jeez', level=logging.WARNING)
+    first = colored.format(record)
+    assert colored.format(record) == first
+    assert plain.format(record) == 'oh jeez'
+    colored.color_enabled = False
+    assert colored.format(record) == 'oh jeez'
@@ -0,0 +1,150 @@
+import urllib.request
+import pytest
+from pbnj.models import Message
+from pbnj.metrics import Histogram, PrometheusExporter, render_prometheus
+from common import _wrap
+from common import *
+
+
+def test_histogram_buckets():
+    h = Histogram([0.1, 1])
+    for value in (0.05, 0.1, 0.5, 3):
+        h.observe(value)
+    snap = h.snapshot()
+    assert snap['count'] == 4
+    assert snap['sum'] == pytest.approx(3.65)
+    assert snap['buckets'] == [(0.1, 2), (1, 3), (float('inf'), 4)]
+
+
+def test_command_stats(connected_bot):
+    bot = connected_bot
+
+    @bot.command('^\\.echo')
+    def echo(message):
+        return ' '.join(message.args)
+
+    @bot.command('^\\.lines')
+    def lines(message):
+        yield 'one'
+        yield 'two'
+
+    @bot.command('^\\.boom')
+    def boom(message):
+        raise RuntimeError('boom')
+
+    with bot.conn:
+        assert bot.handle(Message(':a!~b@c PRIVMSG #chan :.echo héllo'))
+        assert bot.handle(Message(':a!~b@c PRIVMSG #chan :.lines'))
+        assert not bot.handle(Message(':a!~b@c PRIVMSG #chan :nothing'))
+        with pytest.raises(RuntimeError):
+            bot.handle(Message(':a!~b@c PRIVMSG #chan :.boom'))
+    commands = bot.metrics.snapshot()['commands']
+    assert commands['echo']['hits'] == 1
+    assert commands['echo']['replies'] == 1
+    assert commands['echo']['reply_bytes'] == len('héllo'.encode())
+    assert commands['echo']['latency']['count'] == 1
+    assert commands['lines']['replies'] == 2
+    # .lines and .boom don't start with .echo, so the index never tried them
+    assert commands['lines']['attempts'] == 1
+    assert commands['boom']['errors'] == 1
+    assert commands['boom']['latency']['count'] == 1
+
+
+def test_connection_stats(connected_bot):
+    fs = connected_bot.conn.conn
+    fs._set_reply_text('PING :irc.foo.bar.baz\n:irc.foo.bar.baz NOTICE * :hi')
+    conn = connected_bot.conn
+    with conn:
+        received = list(conn.recieve())
+    stats = conn.stats
+    assert received == [':irc.foo.bar.baz NOTICE * :hi']
+    assert stats.lines_in == 2
+    assert stats.bytes_in == len(_wrap('PING :irc.foo.bar.baz')) + len(
+        _wrap(':irc.foo.bar.baz NOTICE * :hi')
+    )
+    assert stats.lines_out == len(fs.sent)
+    assert stats.bytes_out == sum(len(line) for line in fs.sent)
+    # we pinged back to time the round trip
+    assert _wrap('PONG :irc.foo.bar.baz') in fs.sent
+    assert conn._ping_token is not None
+    assert stats.ping_rtt is None
+
+
+def test_ping_rtt(mocked_connection):
+    conn = mocked_connection
+    conn.nick = NICK
+    assert conn.ping_server()
+    token = conn._ping_token
+    conn.conn._set_reply_text(':irc.foo.bar.baz PONG irc.foo.bar.baz :' + token)
+    with conn:
+        # our own PONG isn't handed to the bot
+        assert list(conn.recieve()) == []
+    assert conn.stats.ping_rtt is not None
+    assert conn._ping_token is None
+
+
+def test_lost_pong(mocked_connection):
+    conn = mocked_connection
+    conn.nick = NICK
+    conn.timeout = 0
+    assert conn.ping_server()
+    conn._ping_sent -= 1
+    lost = conn._ping_sent
+    # the server pinging us again is a chance to try again
+    conn._pong(b'PING :irc.foo.bar.baz')
+    assert conn._ping_sent > lost
+    assert len([l for l in conn.conn.sent if l.startswith(b'PING :pbnj-')]) == 2
+
+
+def test_same_named_commands(connected_bot):
+    bot = connected_bot
+    bot.command('^\\.a')(lambda m: 'a')
+    bot.command('^\\.b')(lambda m: 'b')
+    with bot.conn:
+        bot.handle(Message(':a!~b@c PRIVMSG #chan :.b'))
+    snapshot = bot.metrics.snapshot()
+    commands = snapshot['commands']
+    assert commands['<lambda>']['hits'] == 0
+    assert commands['<lambda>#2']['hits'] == 1
+    text = render_prometheus(snapshot)
+    assert 'pbnj_command_match_hits_total{command="<lambda>#2"} 1' in text
+
+
+def test_stats_command(connected_bot):
+    bot = connected_bot
+    bot._enable_builtin_commands()
+    with bot.conn:
+        bot.handle(Message(':a!~b@c PRIVMSG #chan :.ping'))
+        bot.handle(Message(':a!~b@c PRIVMSG #chan :.stats'))
+        bot.handle(Message(':a!~b@c PRIVMSG #chan :.stats ping'))
+        bot.handle(Message(':a!~b@c PRIVMSG #chan :.stats nope'))
+    sent = [line.decode() for line in bot.conn.conn.sent]
+    assert [l for l in sent if 'Busiest: ping 1' in l]
+    assert [l for l in sent if ':a: ping matched 1/' in l]
+    assert 'PRIVMSG #chan :a: no command called nope\r\n' in sent
+
+
+def test_prometheus_exporter(connected_bot):
+    bot = connected_bot
+
+    @bot.command('^\\.echo')
+    def echo(message):
+        return message.message
+
+    bot.metrics.add_source('supervisor', lambda: {'reconnects': 2, 'last_error': None})
+    with bot.conn:
+        bot.handle(Message(':a!~b@c PRIVMSG #chan :.echo'))
+    text = render_prometheus(bot.metrics.snapshot())
+    assert 'pbnj_command_match_hits_total{command="echo"} 1' in text
+    assert 'pbnj_command_latency_seconds_bucket{command="echo",le="+Inf"} 1' in text
+    assert 'pbnj_connection_sent_lines_total{network="default"}' in text
+    assert 'pbnj_supervisor_reconnects 2' in text
+    assert 'last_error' not in text
+    exporter = PrometheusExporter(bot.metrics, 0).start()
+    try:
+        url = 'http://127.0.0.1:{}/metrics'.format(exporter.port)
+        with urllib.request.urlopen(url, timeout=5) as resp:
+            assert resp.status == 200
+            assert 'pbnj_command_replies_total{command="echo"} 1' in resp.read().decode()
+    finally:
+        exporter.stop()
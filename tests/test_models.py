@@ -7,7 +7,7 @@ import logging
 log = logging.getLogger('pbnj')
 log.setLevel(logging.DEBUG)
 
-from pbnj.models import Message, Command, _builtin_command
+from pbnj.models import Message, Command, parse_line, parse_tags
 
 def test_message_types(privmsg, actionmsg, servermsg):
     # privmsg
@@ -39,10 +39,12 @@ def test_message_types(privmsg, actionmsg, servermsg):
     assert privmsg == privmsg_again, '__eq__ method of Message is broken'
     assert servermsg != privmsg_again, '__eq__ method of Message is broken'
     assert servermsg != actionmsg, '__eq__ method of Message is broken'
-    # a malformed hostmask will execute "regex fucked up" codepath
-    malformed_hm = ':invalid@localhost.localdomain PRIVMSG #channel :something'
-    with pytest.raises(AttributeError):
-        malformed = Message(malformed_hm)
+    # nick@host is a valid hostmask, even without a user
+    unusual = Message(':invalid@localhost.localdomain PRIVMSG #channel :something')
+    assert unusual.nick == 'invalid'
+    assert unusual.realname is None
+    assert unusual.host == 'localhost.localdomain'
+    assert unusual.message == 'something'
 
 def test_command(privmsg, actionmsg):
     filter_lambda = lambda m: m.type == 'PRIVMSG' and 'hello' in m.message
@@ -89,3 +91,72 @@ def test_command(privmsg, actionmsg):
     assert c2 != c3
     c0_again = Command(filter_lambda, callback_generator)
     assert c0 == c0_again
+
+def test_parse_line():
+    lines = {
+        'PING :irc.foo.bar.baz': (None, None, 'PING', ['irc.foo.bar.baz']),
+        ':irc.example.net 366 foo #channel :End of NAMES list':
+            (None, 'irc.example.net', '366', ['foo', '#channel', 'End of NAMES list']),
+        ':nick!~user@host JOIN #channel': (None, 'nick!~user@host', 'JOIN', ['#channel']),
+        ':nick!~user@host PRIVMSG #channel ::)  spaced  out ':
+            (None, 'nick!~user@host', 'PRIVMSG', ['#channel', ':)  spaced  out ']),
+        '@time=2018-01-01T00:00:00Z;account=nick :n!u@h PRIVMSG #c :hi':
+            ('time=2018-01-01T00:00:00Z;account=nick', 'n!u@h', 'PRIVMSG', ['#c', 'hi']),
+        '@a=b   :n  MODE  n  +i': ('a=b', 'n', 'MODE', ['n', '+i']),
+        ':n!u@h PART #channel :': (None, 'n!u@h', 'PART', ['#channel', '']),
+        'QUIT': (None, None, 'QUIT', []),
+        ':server.only': (None, 'server.only', '', []),
+        '': (None, None, '', []),
+    }
+    for line, parsed in lines.items():
+        assert parse_line(line) == parsed, line
+
+def test_parse_tags():
+    assert parse_tags(None) == {}
+    assert parse_tags('a=b;c;d=') == {'a': 'b', 'c': '', 'd': ''}
+    assert parse_tags('msg=semi\\:colon\\sspace\\\\back\\') == {'msg': 'semi;colon space\\back'}
+
+def test_message_unusual():
+    tagged = Message('@time=12:00;+draft/reply=x :we!ird|[]^{}@host/cloak PRIVMSG #c :\x02hi there')
+    assert tagged.tags == {'time': '12:00', '+draft/reply': 'x'}
+    assert tagged.nick == 'we'
+    assert tagged.realname == 'ird|[]^{}'
+    assert tagged.host == 'host/cloak'
+    assert tagged.args == ['there']
+    bare = Message(':nick MODE nick :+i')
+    assert bare.nick is None
+    assert bare.host == 'nick'
+    assert bare.type == 'MODE'
+    assert bare.params == ['nick', '+i']
+    noprefix = Message('NICK foo')
+    assert noprefix.type == 'NICK'
+    assert noprefix.host is None
+    private = Message(':a!b@c PRIVMSG foo :.help me')
+    assert private.reply_dest == 'a'
+    assert private.args == ['me']
+    # the shortcut for the usual PRIVMSG still gets the odd ones right
+    bare_text = Message(':a!b@c PRIVMSG #c hi')
+    assert (bare_text.dest, bare_text.message) == ('#c', 'hi')
+    extra = Message(':a!b@c PRIVMSG #c extra :words here')
+    assert (extra.dest, extra.message) == ('#c', 'extra')
+    assert extra.params == ['#c', 'extra', 'words here']
+    spaced = Message(':a!b@c  PRIVMSG  #c :x')
+    assert (spaced.prefix, spaced.type, spaced.dest) == ('a!b@c', 'PRIVMSG', '#c')
+    # only numerics int() can read are numerics
+    odd = Message(':irc.example.net \u00b2 foo :bar')
+    assert odd.type == '\u00b2'
+
+def test_message_slots(privmsg, servermsg):
+    with pytest.raises(AttributeError):
+        privmsg.some_attribute = True
+    assert not hasattr(privmsg, '__dict__')
+    assert privmsg.args == []
+    assert servermsg.args == []
+    assert servermsg.dest is None
+    assert servermsg.reply_dest is None
+    with_args = Message(':a!b@c PRIVMSG #c :.cmd one two')
+    assert with_args.args == ['one', 'two']
+    assert with_args.reply_dest == '#c'
+    # equal messages hash the same, so they can be deduplicated
+    assert len({privmsg, Message(SAMPLE_PRIV), servermsg}) == 2
+    assert privmsg != SAMPLE_PRIV
@@ -0,0 +1,63 @@
+from pbnj.prefilter import Prefilter
+from common import _wrap
+from common import *
+
+
+def test_prefilter():
+    p = Prefilter(['relaybot'], ['Spam.example.net', '*.bots.org'], [1, 353])
+    dropped = [
+        b':relaybot!~r@h PRIVMSG #c :<someone> hi',
+        b':relaybot NOTICE #c :hi',
+        b'@time=2018-01-01T00:00:00Z :relaybot!~r@h PRIVMSG #c :hi',
+        b':x!~x@spam.EXAMPLE.net PRIVMSG #c :buy things',
+        b':y!~y@a.b.bots.org PRIVMSG #c :beep',
+        b':irc.example.net 372 foo :- message of the day',
+        b':irc.example.net 433 * foo',
+    ]
+    kept = [
+        b':relaybot!~r@h JOIN #c',
+        b':relaybotx!~r@h PRIVMSG #c :not the same nick',
+        b':someone!~s@h PRIVMSG #c :relaybot PRIVMSG',
+        b':z!~z@notspam.example.net PRIVMSG #c :fine',
+        b':z!~z@bots.org PRIVMSG #c :the domain itself',
+        b':irc.example.net 001 foo :Welcome',
+        b':irc.example.net 353 foo = #c :foo bar',
+        b'PING :irc.example.net',
+        b'ERROR :Closing link',
+        b'',
+    ]
+    for line in dropped:
+        assert p.drop(line), line
+    for line in kept:
+        assert not p.drop(line), line
+    assert p.dropped == len(dropped)
+    # no configuration, nothing dropped
+    everything = Prefilter()
+    assert not any(everything.drop(line) for line in dropped)
+
+
+def test_bot_prefilter(response_bot):
+    bot = response_bot
+    bot.ignore = {'nicks': ['relaybot']}
+    seen = []
+
+    @bot.command('^\\.echo')
+    def echo(message):
+        seen.append(message.nick)
+        return message.message
+
+    fs = bot.conn.conn
+    fs._set_reply_text('\n'.join([
+        ':relaybot!~r@h PRIVMSG #c :.echo one',
+        'PING :irc.example.net',
+        ':irc.example.net 372 foo :- motd',
+        ':someone!~s@h PRIVMSG #c :.echo two',
+    ]))
+    bot.run()
+    assert seen == ['someone']
+    assert _wrap('PONG :irc.example.net') in fs.sent
+    assert bot.conn.prefilter.dropped == 2
+    assert bot.metrics.snapshot()['connections']['default']['prefiltered'] == 2
+    # a callable filterspec might want any numeric
+    bot.command(lambda m: m.type == 372)(echo)
+    assert bot._prefilter().numerics is None
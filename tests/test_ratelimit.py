@@ -0,0 +1,92 @@
+import pytest
+from pbnj.metrics import render_prometheus
+from pbnj.models import Message
+from pbnj.ratelimit import RateLimiter
+from common import *
+
+
+def test_sliding_window():
+    clock = Clock()
+    limiter = RateLimiter(4, 10, clock=clock)
+    assert [limiter.allow('a') for _ in range(5)] == [True] * 4 + [False]
+    assert limiter.allow('b')
+    # a new window, but the last one still covers all of the sliding window
+    clock.now = 10
+    assert not limiter.allow('a')
+    # half of it has slid out, so half the hits in it still count
+    clock.now = 15
+    assert [limiter.allow('a') for _ in range(3)] == [True, True, False]
+    clock.now = 35
+    assert [limiter.allow('a') for _ in range(5)] == [True] * 4 + [False]
+    assert limiter.stats() == {
+        'keys': 1, 'allowed': 11, 'limited': 4, 'evicted': 2}
+    with pytest.raises(ValueError):
+        RateLimiter(0, 10)
+
+
+def test_eviction():
+    clock = Clock()
+    limiter = RateLimiter(1, 10, max_keys=3, clock=clock)
+    for key in 'abc':
+        assert limiter.allow(key)
+    clock.now = 5
+    assert not limiter.allow('a')
+    # b has been idle the longest, so it makes room
+    assert limiter.allow('d')
+    assert len(limiter) == 3 and limiter.evicted == 1
+    assert limiter.allow('b')
+    assert not limiter.allow('a')
+    # nothing seen for two windows is worth keeping
+    clock.now = 30
+    assert limiter.allow('e')
+    assert len(limiter) == 1 and limiter.evicted == 5
+
+
+def test_bot_limits(connected_bot):
+    clock = Clock()
+    connected_bot.rate_limit = RateLimiter(4, 60, clock=clock)
+    calls = []
+
+    @connected_bot.command('^\\.cheap')
+    def cheap(message):
+        calls.append('cheap')
+        return 'ok'
+
+    @connected_bot.command('^\\.costly', rate_limit=(2, 60), user_rate_limit=(1, 60))
+    def costly(message):
+        calls.append('costly')
+        return 'ok'
+
+    def say(source, text):
+        return connected_bot.handle(
+            Message(':{} PRIVMSG #c :{}'.format(source, text)))
+
+    assert say('a!~a@one', '.costly')
+    assert not say('a!~a@one', '.costly')
+    # a new nick from the same host is the same user
+    assert not say('b!~b@one', '.costly')
+    assert say('c!~c@two', '.costly')
+    # only two calls of it at all
+    assert not say('d!~d@three', '.costly')
+    assert say('A!~a@one', '.cheap')
+    assert say('a!~a@elsewhere', '.cheap')
+    # the calls of costly which were dropped didn't use up any of a's four
+    assert say('a!~a@elsewhere', '.cheap')
+    assert not say('a!~a@elsewhere', '.cheap')
+    assert calls == ['costly', 'costly', 'cheap', 'cheap', 'cheap']
+    snapshot = connected_bot.metrics.snapshot()
+    assert snapshot['commands']['costly']['limited'] == 3
+    assert snapshot['commands']['cheap']['limited'] == 1
+    assert snapshot['sources']['rate_limit']['limited'] == 1
+    assert 'pbnj_command_rate_limited_total' in render_prometheus(snapshot)
+
+
+def test_check_only():
+    limiter = RateLimiter(1, 10, clock=Clock())
+    assert limiter.allow('a', count=False)
+    assert limiter.allow('a', count=False)
+    assert len(limiter) == 0
+    assert limiter.allow('a')
+    assert not limiter.allow('a', count=False)
+    assert limiter.stats() == {
+        'keys': 1, 'allowed': 1, 'limited': 1, 'evicted': 0}
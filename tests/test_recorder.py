@@ -0,0 +1,113 @@
+import gzip
+from pbnj.bot import Bot
+from pbnj.recorder import Recorder, RECEIVED, SENT, recording_files, records
+from pbnj.replay import ReplaySocket, replay
+from common import *
+
+
+def test_rotation(tmp_path):
+    path = str(tmp_path / 'rec.log')
+    clock = Clock(100.0)
+    rec = Recorder(path, max_bytes=200, backups=2, compress=True, clock=clock)
+    for i in range(20):
+        clock.now += 0.5
+        rec.received([b':a!~a@h PRIVMSG #c :%d' % i])
+    rec.sent(b'PRIVMSG #c :one\r\nPRIVMSG #c :two\r\n')
+    rec.close()
+    assert rec.rotations > 2
+    assert recording_files(path) == [path + '.2.gz', path + '.1.gz', path]
+    with gzip.open(path + '.1.gz') as f:
+        assert f.readline().startswith(b'# pbnj recording ')
+    kept = list(records(path))
+    # the oldest went with the rotations past the backups
+    assert kept[-2:] == [(10.0, SENT, b'PRIVMSG #c :one'),
+                         (10.0, SENT, b'PRIVMSG #c :two')]
+    assert kept[-3] == (10.0, RECEIVED, b':a!~a@h PRIVMSG #c :19')
+    assert [at for at, _, _ in kept] == sorted(at for at, _, _ in kept)
+
+
+def test_appending(tmp_path):
+    path = str(tmp_path / 'rec.log')
+    clock = Clock(100.0)
+    for text in (b'first', b'second'):
+        rec = Recorder(path, clock=clock)
+        clock.now += 2
+        rec.received([text])
+        rec.close()
+    # a second recorder starts at zero again, but follows on from the first
+    assert list(records(path)) == [(2.0, RECEIVED, b'first'),
+                                   (4.0, RECEIVED, b'second')]
+
+
+def test_recording_a_connection(tmp_path):
+    path = str(tmp_path / 'rec.log')
+    server = ScriptedServer([SAMPLE_PRIV], ['PRIVMSG #channel :hi'])
+    server.start()
+    bot = Bot(NICK, use_builtin=False)
+    bot.command('^hello')(lambda m: 'hi')
+    rec = Recorder(path)
+    bot.connect('127.0.0.1', server.port, recorder=rec)
+    bot.run()
+    server.join(5)
+    # the bot closed it on the way out, with everything written
+    assert rec._file is None
+    lines = [(direction, line.decode()) for _, direction, line in records(path)]
+    assert lines[:2] == [(SENT, 'NICK foo'), (SENT, 'USER foo foo 127.0.0.1 :foo')]
+    assert (RECEIVED, SAMPLE_PRIV) in lines
+    assert lines.index((RECEIVED, SAMPLE_PRIV)) < lines.index(
+        (SENT, 'PRIVMSG #channel :hi'))
+    assert lines[-1][0] == SENT and lines[-1][1].startswith('QUIT :')
+
+
+def test_recording_after_close(tmp_path):
+    path = str(tmp_path / 'rec.log')
+    clock = Clock(100.0)
+    rec = Recorder(path, clock=clock)
+    clock.now += 1
+    rec.received([b'first'])
+    rec.close()
+    # like a supervised bot connecting again after it stopped
+    clock.now += 1
+    rec.received([b'second'])
+    rec.close()
+    assert list(records(path)) == [(1.0, RECEIVED, b'first'),
+                                   (2.0, RECEIVED, b'second')]
+
+
+def test_replay(tmp_path):
+    path = str(tmp_path / 'rec.log')
+    clock = Clock(100.0)
+    rec = Recorder(path, clock=clock)
+    for i in range(50):
+        clock.now += 1
+        rec.received([b':a!~a@h PRIVMSG #c :.count %d' % i])
+    rec.received([b'PING :irc.example.net'])
+    rec.close()
+    bot = Bot(NICK, use_builtin=False)
+    bot.command('^\\.count')(lambda m: m.message.split()[-1])
+    result = replay(bot, path)
+    assert result['lines_in'] == 51
+    sent = bot.conn.sent_lines()
+    assert sent[:2] == ['NICK foo', 'USER foo foo replay :foo']
+    assert [l for l in sent if l.startswith('PRIVMSG')] == [
+        'PRIVMSG #c :%d' % i for i in range(50)]
+    assert 'PONG :irc.example.net' in sent
+    assert result['lines_out'] == len(sent)
+
+
+def test_replay_pace():
+    clock = Clock(100.0)
+    recording = [(5.0, RECEIVED, b'one'), (5.0, SENT, b'ignored'),
+                 (5.5, RECEIVED, b'two'), (9.0, RECEIVED, b'three')]
+    sock = ReplaySocket(recording, speed=2, clock=clock, sleep=clock.sleep)
+    # the first line comes straight away, the rest as far apart as they were,
+    # halved
+    assert sock.recv(4096) == b'one\r\n'
+    assert clock.now == 100.0
+    assert sock.recv(4096) == b'two\r\n'
+    assert clock.now == 100.25
+    clock.now += 5
+    assert sock.recv(4096) == b'three\r\n'
+    assert sock.recv(4096) == b''
+    fast = ReplaySocket(recording)
+    assert fast.recv(4096) == b'one\r\ntwo\r\nthree\r\n'
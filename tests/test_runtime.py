@@ -0,0 +1,47 @@
+import pytest
+from pbnj.bot import Bot
+from pbnj.runtime import Runtime, Network
+from pbnj import __version__
+from common import *
+import logging
+log = logging.getLogger('pbnj')
+log.setLevel(logging.DEBUG)
+
+
+def test_runtime_routes_replies():
+    bot = Bot(NICK)
+
+    @bot.command('^\\.where')
+    def where(message):
+        return '{} on {}'.format(message.nick, message.network)
+
+    servers = {}
+    runtime = Runtime(bot)
+    for i, name in enumerate(['alpha', 'beta', 'gamma']):
+        nick = 'bot{}'.format(i)
+        server = ScriptedServer([
+            'PING :{}'.format(name),
+            ':u{0}!~u@host PRIVMSG #{1} :.where'.format(i, name),
+            ':u{0}!~u@host PRIVMSG {1} :.version'.format(i, nick),
+        ], expect=[
+            'PRIVMSG #{0} :u{1} on {0}'.format(name, i),
+            'PRIVMSG u{0} :u{0}: {1} version {2}'.format(i, nick, __version__),
+        ])
+        server.start()
+        servers[name] = server
+        network = runtime.add(name, '127.0.0.1', server.port, nick=nick, channels=[name])
+        assert isinstance(network, Network)
+    with pytest.raises(ValueError):
+        runtime.add('alpha', '127.0.0.1', 1)
+    runtime.run()
+    for i, (name, server) in enumerate(servers.items()):
+        server.join(5)
+        assert 'NICK bot{}'.format(i) in server.sent
+        assert 'JOIN #{}'.format(name) in server.sent
+        assert 'PONG :{}'.format(name) in server.sent
+        for line in server.expect:
+            assert line in server.sent
+        # nothing leaked onto the wrong network
+        for other in servers:
+            if other != name:
+                assert not [l for l in server.sent if ' on ' + other in l]
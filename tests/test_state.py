@@ -0,0 +1,127 @@
+import pytest
+from pbnj.bot import Bot
+from pbnj.models import Message
+from pbnj.state import State
+from common import _wrap
+from common import *
+
+
+def feed(state, *lines):
+    for line in lines:
+        state.update(Message(line))
+
+
+@pytest.fixture
+def state():
+    state = State('pbnj')
+    feed(
+        state,
+        ':irc.example.net 001 pbnj :Welcome',
+        ':irc.example.net 005 pbnj PREFIX=(qov)~@+ CASEMAPPING=rfc1459 :are supported',
+        ':pbnj!~pbnj@bot.host JOIN #Chan',
+        ':irc.example.net 353 pbnj = #chan :pbnj ~Owner @Op +Voice plain',
+        ':irc.example.net 366 pbnj #chan :End of /NAMES list.',
+        ':pbnj!~pbnj@bot.host JOIN #other',
+        ':irc.example.net 353 pbnj = #other :pbnj @plain',
+        ':irc.example.net 366 pbnj #other :End of /NAMES list.',
+    )
+    return state
+
+
+def test_names(state):
+    assert state.isupport['PREFIX'] == '(qov)~@+'
+    assert sorted(state.members('#chan')) == ['Op', 'Owner', 'Voice', 'pbnj', 'plain']
+    assert state.channel('#CHAN').name == '#Chan'
+    assert state.channel('#chan').synced
+    assert sorted(state.channels_of('PLAIN')) == ['#Chan', '#other']
+    assert state.is_on('op', '#chan')
+    assert not state.is_on('op', '#other')
+    assert state.members('#nowhere') == []
+
+
+def test_join_part_kick_quit(state):
+    feed(
+        state,
+        ':new!~n@new.host JOIN #chan',
+        ':Voice!~v@v.host PART #chan :bye',
+        ':Op!~o@o.host KICK #chan Owner :out',
+        ':plain!~p@p.host QUIT :gone',
+        ':someone!~s@s.host JOIN #notours',
+    )
+    assert sorted(state.members('#chan')) == ['Op', 'new', 'pbnj']
+    assert state.user('new').host == 'new.host'
+    # users we don't share a channel with any more are forgotten
+    assert state.user('Voice') is None
+    assert state.user('plain') is None
+    assert state.members('#other') == ['pbnj']
+    assert state.channel('#notours') is None
+
+
+def test_nick_changes_and_casemapping(state):
+    feed(state, ':plain!~p@p.host NICK :Fancy[m]', ':pbnj!~pbnj@bot.host NICK pbnj2')
+    assert state.nick == 'pbnj2'
+    # rfc1459 says [] and {} are the same letters
+    assert state.is_on('fancy{M}', '#chan')
+    assert sorted(state.channels_of('FANCY[M]')) == ['#Chan', '#other']
+    assert not state.is_on('plain', '#chan')
+    feed(state, ':irc.example.net 005 pbnj2 CASEMAPPING=ascii :are supported')
+    assert state.casemapping == 'ascii'
+    assert not state.is_on('fancy{m}', '#chan')
+    assert state.is_on('fancy[m]', '#chan')
+
+
+def test_leaving_and_renames(state):
+    feed(state, ':pbnj!~pbnj@bot.host PART #chan')
+    assert state.channel('#chan') is None
+    assert state.user('Owner') is None
+    assert state.channels_of('plain') == ['#other']
+    # a second NAMES list replaces the first
+    feed(
+        state,
+        ':irc.example.net 353 pbnj = #other :pbnj fresh',
+        ':irc.example.net 366 pbnj #other :End of /NAMES list.',
+    )
+    assert sorted(state.members('#other')) == ['fresh', 'pbnj']
+
+
+def test_bot_tracks_state(connected_bot):
+    bot = connected_bot
+
+    @bot.command('^\\.who')
+    def who(message):
+        return ' '.join(sorted(bot.state.members(message.dest)))
+
+    with bot.conn:
+        for line in [
+            ':{0}!~{0}@host JOIN #chan'.format(NICK),
+            ':irc.example.net 353 {} = #chan :{} alice @bob'.format(NICK, NICK),
+            ':alice!~a@host PRIVMSG #chan :.who',
+        ]:
+            msg = Message(line)
+            if bot._should_handle(msg):
+                bot.handle(msg)
+    assert _wrap('PRIVMSG #chan :alice bob {}'.format(NICK)) in bot.conn.conn.sent
+
+
+def test_joinall_no_duplicates(connected_bot):
+    bot = connected_bot
+    with bot.conn:
+        bot.joinall(['#foo', 'FOO', '#bar'])
+        bot.joinall(['#foo'])
+        assert bot.channels == ['#foo', '#bar']
+        bot.part(['#Foo', '#missing'])
+        assert bot.channels == ['#bar']
+    # the default list isn't shared between bots
+    assert Bot(NICK).channels == []
+    assert Bot(NICK).channels is not Bot(NICK).channels
+
+
+def test_targmax(state):
+    assert state.targmax() == 1
+    state.update(Message(':irc.example.net 005 foo MAXTARGETS=4 :are supported'))
+    assert state.targmax() == 4
+    state.update(Message(':irc.example.net 005 foo '
+                         'TARGMAX=NAMES:1,PRIVMSG:3,NOTICE:,WHOIS: :are supported'))
+    assert state.targmax('PRIVMSG') == 3
+    assert state.targmax('NOTICE') is None
+    assert state.targmax('KICK') == 1
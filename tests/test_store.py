@@ -0,0 +1,72 @@
+import sqlite3
+import pytest
+from pbnj.store import Store
+from common import *
+
+
+def rows(path):
+    with sqlite3.connect(str(path)) as db:
+        return sorted(db.execute('select Message, Up, Down from Votes'))
+
+
+def test_write_behind(tmp_path):
+    path = tmp_path / 'votes.sqlite3'
+    store = Store(str(path), 'Votes', key='Message', fields=('Up', 'Down'),
+                  flush_interval=3600)
+    assert store.incr('pbnj') == 1
+    assert store.incr('pbnj', 'Up') == 2
+    assert store.incr('pbnj', 'Down', 3) == 3
+    store.incr('vim', 'Down')
+    assert store.get('pbnj') == {'Up': 2, 'Down': 3}
+    assert store.value('vim', 'Down') == 1
+    assert store.value('emacs') == 0 and store.get('emacs') is None
+    with pytest.raises(KeyError):
+        store.incr('pbnj', 'Sideways')
+    # nothing is written until a flush
+    assert rows(path) == []
+    assert store.flush() == 2
+    assert rows(path) == [('pbnj', 2, 3), ('vim', 0, 1)]
+    store.incr('pbnj', 'Up')
+    store.close()
+    assert rows(path) == [('pbnj', 3, 3), ('vim', 0, 1)]
+    assert store.stats()['flushes'] == 2
+    # and it's all there when the store is opened again
+    store = Store(str(path), 'Votes', key='Message', fields=('Up', 'Down'))
+    assert sorted(store.items()) == [
+        ('pbnj', {'Up': 3, 'Down': 3}), ('vim', {'Up': 0, 'Down': 1}),
+    ]
+    store.close()
+
+
+def test_background_flush(tmp_path):
+    path = tmp_path / 'counters.sqlite3'
+    store = Store(str(path), flush_interval=0.01)
+    store.incr('a')
+    for _ in range(500):
+        if store.stats()['flushes']:
+            break
+        store._stopped.wait(0.01)
+    with sqlite3.connect(str(path)) as db:
+        assert db.execute('select key, value from counters').fetchall() == [('a', 1)]
+        assert db.execute('pragma journal_mode').fetchone() == ('wal',)
+    store.close()
+    with pytest.raises(ValueError):
+        Store(str(path), 'Votes; drop table counters')
+
+
+def test_flush_on_bot_exit(response_bot, tmp_path):
+    path = tmp_path / 'votes.sqlite3'
+    store = Store(str(path), 'Votes', key='Message', fields=('Up', 'Down'),
+                  flush_interval=3600)
+
+    @response_bot.command('.*\\+\\+')
+    def up(message):
+        store.incr(message.message.split('++')[0])
+
+    response_bot.on_shutdown(store.flush)
+    response_bot.conn.conn._set_reply_text(
+        ':a!~a@h PRIVMSG #c :pbnj++\n:b!~b@h PRIVMSG #c :pbnj++'
+    )
+    response_bot.run()
+    assert rows(path) == [('pbnj', 2, 0)]
+    store.close()
@@ -0,0 +1,67 @@
+import socket
+from pbnj.bot import Bot
+from pbnj.supervisor import Supervisor
+from common import *
+import logging
+log = logging.getLogger('pbnj')
+log.setLevel(logging.DEBUG)
+
+
+def test_backoff():
+    sup = Supervisor(Bot(NICK), base_delay=2, max_delay=30)
+    for failures in range(10):
+        delay = sup.backoff(failures)
+        assert 0 <= delay <= min(30, 2 * 2 ** failures)
+
+
+def test_reconnect_restores_state():
+    bot = Bot(NICK, initial_channels=['#first'])
+    sup = Supervisor(bot, stable_after=0, sleep=lambda s: None)
+    # once the second connection has rejoined everything, stop reconnecting
+    def stop_when_rejoined(m):
+        if m.type == 'PRIVMSG' and m.message == 'stop':
+            sup.stop()
+        return False
+    bot.command(stop_when_rejoined)(lambda m: None)
+    shutdowns = []
+    bot.on_shutdown(lambda: shutdowns.append(server.connections))
+    server = ScriptedServer(
+        [':a!~b@c INVITE {} :#invited'.format(NICK)], ['JOIN #invited'],
+        [':a!~b@c PRIVMSG #first :stop'], ['JOIN #first', 'JOIN #invited'],
+    )
+    server.start()
+    bot.connect('127.0.0.1', server.port)
+    sup.run()
+    server.join(5)
+    assert server.connections == 2
+    assert server.sent.count('NICK {}'.format(NICK)) == 2
+    assert server.sent.count('JOIN #first') == 2
+    assert server.sent.count('JOIN #invited') == 2
+    stats = sup.stats()
+    assert stats['reconnects'] == 1
+    assert stats['failures'] == 0
+    assert stats['downtime'] >= 0
+    # the shutdown hooks only ran once the supervisor was done
+    assert shutdowns == [2]
+    # the builtin commands were only registered once
+    assert len([c for c in bot.commands if c.name == 'help']) == 1
+
+
+def test_give_up():
+    # find a port nobody is listening on
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    delays = []
+    bot = Bot(NICK)
+    bot.connect('127.0.0.1', port)
+    sup = Supervisor(bot, base_delay=1, max_delay=4, max_attempts=4, sleep=delays.append)
+    sup.run()
+    assert len(delays) == 3
+    assert all(0 <= d <= 4 for d in delays)
+    stats = sup.stats()
+    assert stats['failures'] == 4
+    assert stats['reconnects'] == 3
+    assert not stats['connected']
+    assert 'ConnectionRefusedError' in stats['last_error']
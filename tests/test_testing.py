@@ -0,0 +1,101 @@
+import socket
+from pbnj.bot import Bot
+from pbnj.testing import Server, load_test
+from common import _wrap
+from common import *
+
+
+class Client:
+    '''a plain socket client, reading whole lines'''
+    def __init__(self, server, nick):
+        self.sock = socket.create_connection((server.host, server.port), 5)
+        self.buf = b''
+        self.send('NICK ' + nick, 'USER {0} 0 * :{0}'.format(nick))
+
+    def send(self, *lines):
+        self.sock.sendall(b''.join(_wrap(l) for l in lines))
+
+    def readline(self):
+        while b'\r\n' not in self.buf:
+            data = self.sock.recv(4096)
+            if not data:
+                return None
+            self.buf += data
+        line, self.buf = self.buf.split(b'\r\n', 1)
+        return line.decode()
+
+    def until(self, fragment):
+        '''read lines up to and including the one containing fragment'''
+        lines = []
+        while True:
+            line = self.readline()
+            assert line is not None, lines
+            lines.append(line)
+            if fragment in line:
+                return lines
+
+
+def test_server_conversation():
+    with Server() as server:
+        a = Client(server, 'alice')
+        assert ':irc.example.net 001 alice :Welcome' in a.until(' 422 ')[0]
+        b = Client(server, 'ALICE')
+        assert b.until(' 433 ') == [
+            ':irc.example.net 433 * ALICE :Nickname is already in use']
+        b.send('NICK bob')
+        b.until(' 422 ')
+        a.send('JOIN #c')
+        a.until(' 366 ')
+        b.send('PING :tok', 'JOIN #c')
+        assert b.until('PONG') == [':irc.example.net PONG irc.example.net :tok']
+        assert b.until(' 353 ')[-1] == ':irc.example.net 353 bob = #c :alice bob'
+        assert a.until('JOIN') == [':bob!ALICE@127.0.0.1 JOIN #c']
+        a.send('PRIVMSG #c :hi all', 'PRIVMSG bob :hi you', 'PRIVMSG carol :hi?',
+               'PRIVMSG #c :json {"x": 1} {}')
+        assert b.until('hi you')[-2:] == [
+            ':alice!alice@127.0.0.1 PRIVMSG #c :hi all',
+            ':alice!alice@127.0.0.1 PRIVMSG bob :hi you']
+        assert b.until('json') == [':alice!alice@127.0.0.1 PRIVMSG #c :json {"x": 1} {}']
+        assert a.until(' 401 ') == [
+            ':irc.example.net 401 alice carol :No such nick/channel']
+        b.send('PART #c :later')
+        assert a.until('PART') == [':bob!ALICE@127.0.0.1 PART #c :later']
+        a.send('QUIT :done')
+        assert a.until('ERROR') == ['ERROR :Closing link: 127.0.0.1 (Quit: done)']
+        assert a.readline() is None
+        assert server.stats()['flood_kicks'] == 0
+
+
+def test_flood_kick():
+    with Server(flood_lines=5) as server:
+        c = Client(server, 'flooder')
+        c.until(' 001 ')
+        c.send(*['PRIVMSG flooder :%d' % i for i in range(10)])
+        assert c.until('ERROR')[-1].endswith('(Excess Flood)')
+        assert server.stats()['flood_kicks'] == 1
+
+
+def echo_bot():
+    bot = Bot(NICK, use_builtin=False)
+    bot.command('^\\.echo')(lambda m: m.message)
+    return bot
+
+
+def test_load():
+    # every reply goes through the server twice, once to the bot and once
+    # back to the users, a few bytes at a time
+    report = load_test(echo_bot(), users=3, rate=50, duration=0.2,
+                       latency=0.005, chunk_size=7)
+    assert report['sent'] == report['answered'] == 10
+    assert report['dropped'] == report['disconnected'] == 0
+    assert 0.01 <= report['p50'] <= report['max'] < 1
+    assert report['server']['connections'] == 4
+
+
+def test_load_flood_kicked_bot():
+    report = load_test(echo_bot(), users=5, rate=50, duration=0.4,
+                       flood_lines=10, flood_window=5, grace=0.5)
+    assert report['server']['flood_kicks'] == 1
+    assert report['sent'] == 20
+    assert report['answered'] < 10
+    assert report['dropped'] == report['sent'] - report['answered']
@@ -0,0 +1,65 @@
+import threading
+import pytest
+from pbnj.bot import Bot
+from pbnj.threaded import InboundQueue
+from common import *
+
+
+def test_inbound_overflow():
+    q = InboundQueue(3)
+    chatter = [b':a!~a@h PRIVMSG #c :%d' % i for i in range(3)]
+    q.put(chatter[0])
+    q.put(b':irc.example.net 353 foo = #c :foo')
+    q.put(chatter[1])
+    # full, so the oldest PRIVMSG goes
+    q.put(b':irc.example.net 366 foo #c :End')
+    q.put(chatter[2])
+    assert q.stats() == {'depth': 3, 'high_water': 3, 'dropped': 2, 'blocked': 0}
+    assert q.get() == b':irc.example.net 353 foo = #c :foo'
+    q.put(b':irc.example.net 375 foo :- motd')
+    q.put(b':a!~a@h JOIN #c')
+    assert q.dropped == 3
+    # with no PRIVMSGs left to drop, the reader has to wait
+    tagged = b'@time=x :b!~b@h PRIVMSG #c :tagged'
+    waiting = threading.Thread(target=q.put, args=(tagged,))
+    waiting.start()
+    waiting.join(0.05)
+    assert waiting.is_alive() and q.blocked
+    assert q.get() == b':irc.example.net 366 foo #c :End'
+    waiting.join(5)
+    assert not waiting.is_alive()
+    q.put(b':irc.example.net 376 foo :End of motd')
+    assert q.dropped == 4
+    q.close()
+    assert [q.get() for _ in range(4)] == [
+        b':irc.example.net 375 foo :- motd', b':a!~a@h JOIN #c',
+        b':irc.example.net 376 foo :End of motd', None,
+    ]
+    with pytest.raises(ValueError):
+        InboundQueue(overflow='drop-newest')
+    # what's been dropped doesn't linger while the dispatcher is stalled
+    q = InboundQueue(10)
+    for i in range(100000):
+        q.put(b':a!~a@h PRIVMSG #c :%d' % i)
+    assert len(q) == 10 and len(q._lines) <= 21
+    assert [q.get() for _ in range(10)] == [
+        b':a!~a@h PRIVMSG #c :%d' % i for i in range(99990, 100000)]
+
+
+def test_threaded_bot():
+    bot = Bot(NICK, use_builtin=False)
+    bot.command('^\\.echo')(lambda m: m.message)
+    server = ScriptedServer([
+        ':a!~a@h PRIVMSG #c :.echo one',
+        'PING :irc.example.net',
+        ':a!~a@h PRIVMSG #c :.echo two',
+    ], ['PONG :irc.example.net', 'PRIVMSG #c :.echo one', 'PRIVMSG #c :.echo two'])
+    server.start()
+    bot.connect('127.0.0.1', server.port, threaded=True, max_inbound=100)
+    bot.run()
+    server.join(5)
+    assert server.sent.index('PRIVMSG #c :.echo one') < server.sent.index(
+        'PRIVMSG #c :.echo two')
+    stats = bot.metrics.snapshot()['connections']['default']
+    assert stats['inbound_depth'] == 0 and stats['inbound_dropped'] == 0
+    assert stats['lines_out'] >= len(server.sent)
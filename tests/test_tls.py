@@ -0,0 +1,155 @@
+import ssl
+import shutil
+import subprocess
+import pytest
+from pbnj import tls
+from pbnj.bot import Bot
+from pbnj.connection import Connection
+from common import *
+
+pytestmark = pytest.mark.skipif(
+    shutil.which('openssl') is None, reason='needs openssl to make certificates')
+
+
+def openssl(*args, cwd):
+    subprocess.run(('openssl',) + args, cwd=str(cwd), check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def issue(ca, name, cn, names, cwd):
+    '''a key and certificate for cn signed by our CA, valid for names'''
+    with open(str(cwd / (name + '.ext')), 'w') as f:
+        f.write('basicConstraints=CA:FALSE\n')
+        f.write('subjectKeyIdentifier=hash\n')
+        f.write('authorityKeyIdentifier=keyid,issuer\n')
+        if names:
+            f.write('subjectAltName=' + ','.join(names) + '\n')
+    openssl('req', '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+            '-nodes', '-keyout', name + '.key', '-out', name + '.csr',
+            '-subj', '/CN=' + cn, cwd=cwd)
+    openssl('x509', '-req', '-in', name + '.csr', '-CA', ca + '.pem',
+            '-CAkey', ca + '.key', '-CAcreateserial', '-days', '1',
+            '-extfile', name + '.ext', '-out', name + '.pem', cwd=cwd)
+    return str(cwd / (name + '.pem')), str(cwd / (name + '.key'))
+
+
+@pytest.fixture(scope='module')
+def certs(tmp_path_factory):
+    d = tmp_path_factory.mktemp('certs')
+    openssl('req', '-x509', '-newkey', 'ec', '-pkeyopt',
+            'ec_paramgen_curve:prime256v1', '-nodes', '-keyout', 'ca.key',
+            '-out', 'ca.pem', '-days', '1', '-subj', '/CN=pbnj test CA',
+            '-addext', 'basicConstraints=critical,CA:TRUE',
+            '-addext', 'keyUsage=critical,keyCertSign,cRLSign', cwd=d)
+    return {
+        'ca': str(d / 'ca.pem'),
+        'server': issue('ca', 'server', 'localhost', ['DNS:localhost'], d),
+        'client': issue('ca', 'client', 'pbnjbot', [], d),
+    }
+
+
+def server_context(certs, client_certs=False):
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ctx.load_cert_chain(*certs['server'])
+    if client_certs:
+        ctx.load_verify_locations(certs['ca'])
+        ctx.verify_mode = ssl.CERT_REQUIRED
+    return ctx
+
+
+def session(conn):
+    '''register, read until the server says goodbye, and get ready to
+    connect again'''
+    with conn:
+        conn.register(NICK, NICK, 'localhost')
+        messages = list(conn.recieve())
+    conn.reset()
+    return messages
+
+
+def test_shared_context(certs):
+    ctx = tls.context(certs['ca'])
+    assert tls.context(certs['ca']) is ctx
+    assert ctx.check_hostname and ctx.verify_mode == ssl.CERT_REQUIRED
+    assert tls.context(certs['ca'], verify=False) is not ctx
+    a = Connection('localhost', 6697, cafile=certs['ca'])
+    b = Connection('localhost', 6697, cafile=certs['ca'])
+    assert a.conn.context is b.conn.context is ctx
+    assert a.conn.server_hostname == 'localhost'
+    a.conn.close()
+    b.conn.close()
+
+
+def test_session_resumption(certs):
+    server = ScriptedServer(
+        [':irc.example.net 001 foo :Welcome'], ['USER foo foo localhost :foo'],
+        [':irc.example.net 001 foo :Welcome back'], ['USER foo foo localhost :foo'],
+        context=server_context(certs),
+    )
+    server.start()
+    conn = Connection('localhost', server.port, use_ssl=True, cafile=certs['ca'])
+    assert session(conn) == [':irc.example.net 001 foo :Welcome']
+    assert session(conn) == [':irc.example.net 001 foo :Welcome back']
+    server.join(5)
+    assert server.resumed == [False, True]
+    assert (conn.tls_handshakes, conn.tls_resumed) == (2, 1)
+
+
+def test_hostname_verification(certs):
+    # the certificate is for localhost, not 127.0.0.1
+    server = ScriptedServer([], context=server_context(certs))
+    server.start()
+    conn = Connection('127.0.0.1', server.port, use_ssl=True, cafile=certs['ca'])
+    with pytest.raises(ssl.SSLCertVerificationError):
+        conn._connect()
+    conn.conn.close()
+    server.join(5)
+
+
+def test_sasl_external(certs):
+    server = ScriptedServer([
+        ':irc.example.net NOTICE * :*** Looking up your hostname',
+        ':irc.example.net CAP * ACK :sasl',
+        'AUTHENTICATE +',
+        ':irc.example.net 900 foo foo!foo@localhost pbnjbot :You are now logged in',
+        ':irc.example.net 903 foo :SASL authentication successful',
+    ], ['CAP END'], context=server_context(certs, client_certs=True))
+    server.start()
+    cert, key = certs['client']
+    conn = Connection('localhost', server.port, use_ssl=True, cafile=certs['ca'],
+                      certfile=cert, keyfile=key)
+    messages = session(conn)
+    server.join(5)
+    assert server.peers == [{'commonName': 'pbnjbot'}]
+    assert server.sent[:5] == [
+        'CAP REQ :sasl', 'NICK foo', 'USER foo foo localhost :foo',
+        'AUTHENTICATE EXTERNAL', 'AUTHENTICATE +',
+    ]
+    assert server.sent[5] == 'CAP END'
+    # what came in during SASL that wasn't part of it is still handed on
+    assert messages == [
+        ':irc.example.net NOTICE * :*** Looking up your hostname',
+        ':irc.example.net 900 foo foo!foo@localhost pbnjbot :You are now logged in',
+    ]
+
+
+def test_bot_sasl_external(certs):
+    # a bot's prefilter keeps only the numerics it uses, none of SASL's
+    server = ScriptedServer([
+        ':irc.example.net CAP * ACK :sasl',
+        'AUTHENTICATE +',
+        ':irc.example.net 900 foo foo!foo@localhost pbnjbot :You are now logged in',
+        ':irc.example.net 903 foo :SASL authentication successful',
+        SAMPLE_PRIV,
+    ], ['CAP END', 'PRIVMSG #channel :hi'],
+        context=server_context(certs, client_certs=True))
+    server.start()
+    bot = Bot(NICK, use_builtin=False)
+    bot.command('^hello')(lambda m: 'hi')
+    cert, key = certs['client']
+    bot.connect('localhost', server.port, ssl=True, cafile=certs['ca'],
+                certfile=cert, keyfile=key)
+    bot.run()
+    server.join(5)
+    assert server.sent[5] == 'CAP END'
+    assert 'PRIVMSG #channel :hi' in server.sent
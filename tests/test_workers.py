@@ -0,0 +1,124 @@
+import time
+import threading
+import pytest
+from pbnj.models import Message, Command
+from pbnj.workers import WorkerPool
+from common import _wrap
+from common import *
+
+
+def crunch(message):
+    '''module level, so it can be sent to a worker process'''
+    for word in message.args:
+        yield str(sum(ord(c) for c in word))
+
+
+class Collector:
+    def __init__(self):
+        self.replies = []
+        self.done = threading.Event()
+    def __call__(self, command, message, resp):
+        if isinstance(resp, str):
+            self.replies.append(resp)
+        else:
+            self.replies.extend(resp)
+        self.done.set()
+        return True
+
+
+def test_command_executor_validation():
+    with pytest.raises(ValueError):
+        Command('^\\.x', crunch, executor='fiber')
+    c = Command('^\\.x', crunch, executor='thread', max_concurrency=2, timeout=1)
+    assert (c.executor, c.max_concurrency, c.timeout) == ('thread', 2, 1)
+
+
+def test_thread_pool_streams_in_order():
+    pool = WorkerPool()
+    collect = Collector()
+    c = Command('^\\.crunch', crunch, executor='thread')
+    m = Message(':a!~b@c PRIVMSG #channel :.crunch a b c')
+    assert pool.submit(c, m, collect)
+    assert collect.done.wait(5)
+    assert collect.replies == ['97', '98', '99']
+    pool.shutdown(wait=True)
+
+
+def test_process_pool():
+    pool = WorkerPool(max_processes=1)
+    collect = Collector()
+    c = Command('^\\.crunch', crunch, executor='process')
+    m = Message(':a!~b@c PRIVMSG #channel :.crunch ab')
+    assert pool.submit(c, m, collect)
+    assert collect.done.wait(30)
+    assert collect.replies == ['195']
+    pool.shutdown(wait=True)
+
+
+def test_concurrency_limit_and_timeout():
+    release = threading.Event()
+    def stuck(message):
+        release.wait(5)
+        return 'too late'
+    pool = WorkerPool()
+    collect = Collector()
+    c = Command('^\\.stuck', stuck, executor='thread', max_concurrency=1, timeout=0.05)
+    m = Message(':a!~b@c PRIVMSG #channel :.stuck')
+    assert pool.submit(c, m, collect)
+    assert not pool.submit(c, m, collect)
+    assert pool.rejected == 1
+    time.sleep(0.1)
+    release.set()
+    pool.shutdown(wait=True)
+    assert pool.timed_out == 1
+    assert not collect.replies
+    # the slot was given back once the call finished
+    release.clear()
+    assert pool.submit(c, m, collect)
+    release.set()
+    pool.shutdown(wait=True)
+    # another command with the same callback has slots of its own
+    release.clear()
+    other = Command('^\\.other', stuck, executor='thread', max_concurrency=2)
+    assert pool.submit(c, m, collect)
+    assert pool.submit(other, m, collect) and pool.submit(other, m, collect)
+    assert not pool.submit(other, m, collect)
+    release.set()
+    pool.shutdown(wait=True)
+
+
+def test_stale_calls_and_default_cap():
+    release = threading.Event()
+    calls = []
+    def stuck(message):
+        calls.append(message)
+        release.wait(5)
+        return 'too late'
+    pool = WorkerPool(max_threads=1, max_pending=2)
+    collect = Collector()
+    c = Command('^\\.stuck', stuck, executor='thread', timeout=0.05)
+    m = Message(':a!~b@c PRIVMSG #channel :.stuck')
+    assert pool.submit(c, m, collect) and pool.submit(c, m, collect)
+    assert not pool.submit(c, m, collect)
+    assert c.stats.rejected == 1
+    time.sleep(0.1)
+    release.set()
+    deadline = time.monotonic() + 5
+    while pool.timed_out < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pool.shutdown(wait=True)
+    # the second call waited past its timeout, so it never ran
+    assert pool.timed_out == 2
+    assert len(calls) == 1
+    assert not collect.replies
+
+
+def test_bot_executor(connected_bot):
+    fs = connected_bot.conn.conn
+    connected_bot.command('^\\.crunch', executor='thread')(crunch)
+    m = Message(':a!~b@c PRIVMSG #channel :.crunch a b')
+    with connected_bot.conn:
+        assert connected_bot.handle(m)
+        connected_bot.workers.shutdown(wait=True)
+        assert _wrap('PRIVMSG #channel :97') in fs.sent
+        assert fs.sent.index(_wrap('PRIVMSG #channel :97')) < fs.sent.index(_wrap('PRIVMSG #channel :98'))